@@ -5,6 +5,7 @@ import sys
 from pathlib import Path
 
 import asyncio as aio
+from command_bus import Command
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
@@ -117,12 +118,13 @@ class MyRadiobuttonFrame(ctk.CTkFrame):
 
 class EXPgui(ctk.CTk):
 
-    def __init__(self, loop, ARGS, func, in_queue):
+    def __init__(self, loop, ARGS, func, commands):
         super().__init__()
         self.loop = loop
         self.args = ARGS
         self.func = func
-        self.in_queue = in_queue
+        self.commands = commands
+        self.experiment = None
         self.visual_fdbck = None
         self.protocol('WM_DELETE_WINDOW', self.close)
         sys.stdout.write = self.redirector
@@ -207,31 +209,47 @@ class EXPgui(ctk.CTk):
                 biomod_path=biomod_path,
                 qtm_ip=self.args.qtmip,
                 qtm_pwd=self.args.password,
-                in_queue=self.in_queue,
+                commands=self.commands,
                 axes=self.visual_fdbck.axes,
-                fig=self.visual_fdbck.fig
+                fig=self.visual_fdbck.fig,
+                replay_path=self.args.replay,
+                trace_path=self.args.trace,
+                ik_method=self.args.ik_method,
+                ik_process=self.args.ik_process,
+                session_path=self.args.session,
+                calibration_frames=self.args.calib_frames,
+                calibration_max_std=self.args.calib_max_std,
+                preview=self.args.preview,
+                sinks=self.args.sinks,
+                gh_convention=self.args.gh_convention,
+                live_bus_name=self.args.live_bus,
+                replay_rate=self.args.replay_rate,
+                replay_realtime=self.args.replay_realtime,
+                replay_loop=self.args.replay_loop,
                                         ))
 
         self.tasks.append(task)
         self.experiment = task
 
     def set_init_position(self):
-        self.in_queue.put('')
+        self.commands.post(Command.SET_REFERENCE)
         print('Reset the zero pose')
 
     def accepted(self):
-        self.in_queue.put('Ok')
+        self.commands.post(Command.ACCEPT)
 
     def stop_experiment(self):
         if self.experiment is not None:
             print('Closing experiment')
-            self.experiment.cancel()
+            # The experiment ends its loop and reports, it is cancelled only if it is stuck
+            self.commands.post(Command.STOP)
+            self.loop.call_later(2, self.experiment.cancel)
             self.experiment = None
 
     async def updater(self, interval):
         while True:
             self.update()
-            await aio.sleep(1e-5)
+            await aio.sleep(interval)
 
     def close(self):
         for task in self.tasks:
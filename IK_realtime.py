@@ -1,218 +1,227 @@
 import argparse
-import os
-import threading
-from time import sleep, time
-import queue
-from pathlib import Path
 from qtm_interface import QTMInterface
-from Exp_gui import EXPgui
-# from QTgui import
-# from PyQt5.QtWidgets import QApplication
-from biosiglive import (
-    MskFunctions,
-    LivePlot,
-    PlotType,
-    InterfaceType
-)
-
-import biorbd as brbd
+from replay_interface import ReplayInterface
+from ik_solvers import IK_SOLVERS
+from feedback import FEEDBACK_DTYPE, ellipse_parameters, ellipse_renderer, gh_feedback, make_sink
+from joint_buffer import JointBuffer, OneEuroFilter
+from model_cache import convert_osim, get_model
+from latency_trace import LatencyRecorder
+from command_bus import Command, CommandBus, TerminalCommands
+from session_recorder import SessionRecorder
+from calibration import ReferenceCalibration, preview_pose
+from gh_angles import GHAngles
+from pacing import DeadlinePacer
+# The GUI (customtkinter), bioviz, the osim converter, qtm_rt, the IK worker and the live bus (multiprocessing,
+# shared_memory) are imported only when they are used, see benchmarks/test_startup.py for the import time check
+
 import asyncio as aio
-import qtm_rt as qtm
-from scipy.spatial.transform import Rotation as R
-from osim_to_biomod import Converter, MuscleType, MuscleStateType
 import numpy as np
 from Parameters import osim_path
 
-import matplotlib.pyplot as plt
-from matplotlib.patches import Ellipse
-
-class manage_queue:
-    def __init__(self, queue):
-        self.is_running = True
-        self.thread = threading.Thread(target=self.listen)
-        self.queue = queue
-        self.thread.start()
-
-    def listen(self):
-        while self.is_running:
-            self.queue.put(input())
-
-    def stop(self):
-        self.is_running = False
-
 async def generate_scaled_biomod(osim_path=None):
-    biomod_path = str(Path(osim_path).parent / Path(osim_path).stem) + '.bioMod'
-    converter = Converter(
-        biomod_path,
-        osim_path,
-        ignore_muscle_applied_tag=False,
-        ignore_fixed_dof_tag=False,
-        ignore_clamped_dof_tag=False,
-        mesh_dir=str(Path(osim_path).parent) + '/Geometry',
-        skip_muscle=True,
-        print_general_informations=True,
-    )
-    converter.convert_file()
-    return biomod_path
+    return convert_osim(osim_path)
 
-async def update_ellipse(cE, q, GH_q1_ref, GH_q2_ref, center=[0,0], rx=1, ry=1, ax=None):
-    cE.set_center(center)
-    cE.set_width(width=(q[11]-GH_q1_ref)*rx)
-    cE.set_height(height=(q[12]-GH_q2_ref)*ry)
-
-async def set_zero_position(interface, biomod_path, marker_order, in_queue):
-    #todo: save ref positions
+async def set_zero_position(interface, biomod_path, marker_order, commands, ik_solver=None, session=None,
+                            n_frames=100, max_std=1, preview=False, feedback_dofs=None):
     print('Set the participant in the starting position')
-    # marker_plot = LivePlot(name='markers', plot_type=PlotType.Scatter3D)
-    # marker_plot.init()
-    while 1:
-        try:
-            in_queue.get_nowait()
-            break
-        except:
-            await aio.sleep(0.1)
+    model = get_model(biomod_path)
+    if ik_solver is None:
+        ik_solver = IK_SOLVERS['least_squares'](model, rate=interface.system_rate)
+    dof_names = [name.to_string() for name in model.nameDof()]
+    calibration = ReferenceCalibration(ik_solver.nb_q, n_frames=n_frames, max_std=max_std,
+                                       feedback_dofs=feedback_dofs, dof_names=dof_names)
+    if await commands.wait_for(Command.SET_REFERENCE, Command.STOP) == Command.STOP:
+        return None
     while 1:
-        mark_tmp, _ = await interface.get_marker_set_data(marker_names=interface.marker_sets[0].marker_names,
-                                                          update_marker_order=True,
-                                                          target_marker_list=marker_order)
-
-        q_ref, qdot = await interface.get_kinematics_from_markers(model_path=biomod_path,
-                                                              marker_set_name='markers',
-                                                              kin_data_window=2,
-                                                              get_markers_data=True,
-                                                              method='biorbd_least_square', #'biorbd_kalman',
-                                                                  # #biorbd_least_square'
-                                                              initial_q = None, #[0,0,0,0,0,0,
-                                                              #              0,0,
-                                                              #              0,0,0,
-                                                              #              -0.61,-1.41,-1,
-                                                              #              1,0,
-                                                              #              0,0
-                                                              #              ],
-                                                                  )
-        # marker_plot.update(mark_tmp[:,:,-1].T, size=0.03)
-
-        print(f'The zero position is defined as:'
-              f'GH_q1: {np.rad2deg(q_ref[11][0])},'
-              f'GH_q2: {np.rad2deg(q_ref[12][0])},'
-              f'Elbow: {np.rad2deg(q_ref[14][0])}')
-        while 1:
-
-            import bioviz
-            biorbd_viz = bioviz.Viz(biomod_path)
-            biorbd_viz.load_movement(q_ref)
-            biorbd_viz.exec()
-            print(';oolah')
-
+        calibration.reset()
+        while not calibration.is_complete:
             try:
-                ref_decision = in_queue.get_nowait()
-                break
-            except:
-                await aio.sleep(0.1)
-        if ref_decision == 'Ok':
+                await interface.get_marker_set_data(marker_names=interface.marker_sets[0].marker_names,
+                                                    target_marker_list=marker_order)
+            except EOFError:
+                print('End of the replayed trial before the reference was set')
+                return None
+            q, _ = await interface.get_kinematics_from_markers(marker_set_name='markers', solver=ik_solver)
+            # Extrapolated poses are not measured, they are left out of the reference
+            if not ik_solver.is_extrapolated:
+                calibration.add(q[:, -1])
+        reference = calibration.result()
+        calibration.report(reference)
+        if preview:
+            preview_pose(biomod_path, reference['q'])
+
+        if reference['is_static']:
             print('Accepted ref position')
+            ref_decision = Command.ACCEPT
+        else:
+            print(f'The participant moved more than {max_std} deg, accept anyway or set the reference again')
+            ref_decision = await commands.wait_for(Command.ACCEPT, Command.SET_REFERENCE, Command.STOP)
+        if ref_decision == Command.STOP:
+            return None
+        if ref_decision == Command.ACCEPT:
+            if session is not None:
+                session.set_reference(reference['q'])
             break
-    return q_ref
+    return reference
 
 
 async def main(to_create_biomod = True, osim_path=None, biomod_path=None,
-               qtm_ip="127.0.0.1", qtm_pwd='password', in_queue = None, axes=None, fig=None):
+               qtm_ip="127.0.0.1", qtm_pwd='password', commands=None, axes=None, fig=None, stream=True,
+               replay_path=None, trace_path=None, ik_method='least_squares', ik_process=False, session_path=None,
+               calibration_frames=100, calibration_max_std=1, preview=False, sinks=(), gh_convention='model',
+               live_bus_name=None, replay_rate=None, replay_realtime=True, replay_loop=False):
 
     # Generate model and initiate interface
     if to_create_biomod:
         biomod_path = await generate_scaled_biomod(osim_path)
 
-    model = brbd.Model(biomod_path)
+    model = get_model(biomod_path)
     markers_order_biomod = [model.markerNames()[i].to_string() for i in range(len(model.markerNames()))]
     print(f'Loaded {biomod_path}')
-    # GH_transformation_body = [[i, iseg] for i, iseg in enumerate(model.segments()) if
-    #                           iseg.name().to_string()=='ulna_parent_offset'][0]
-    # glenoid_body = [[i, iseg] for i, iseg in enumerate(model.segments()) if
-    #                           iseg.name().to_string() == 'humerus_translation'][0]
-    # gh_seq = 'xyz'
+    gh_angles = GHAngles(model, convention=gh_convention)
 
     # interface = InterfaceType.Custom
 
-    interface = await QTMInterface(system_rate=100, ip=qtm_ip, init_now=True)
-
-    n_markers = 33 #42
+    if replay_path:
+        # Paced at the trial rate (read from the C3D if not given) or served as fast as possible, once or in loop
+        interface = await ReplayInterface(replay_path, system_rate=replay_rate, realtime=replay_realtime,
+                                          loop=replay_loop)
+        stream = False
+    else:
+        interface = await QTMInterface(system_rate=100, ip=qtm_ip, init_now=True)
+    ik_solver = IK_SOLVERS[ik_method](model, rate=interface.system_rate)
 
+    # The set takes the bioMod markers among the QTM labels
     await interface.add_marker_set(
-        nb_markers=n_markers,
+        nb_markers=len(markers_order_biomod),
         data_buffer_size=100,
         marker_data_file_key="markers",
         name="markers",
-        rate=100,
-        unit="mm"
+        rate=interface.system_rate,
+        unit="mm",
+        target_marker_list=markers_order_biomod,
     )
     print('Marker set added')
+    if stream:
+        await interface.start_streaming()
+    interface.recorder = LatencyRecorder()
+    ik_worker = None
+    if ik_process:
+        from ik_worker import IKWorker
+
+        ik_worker = IKWorker(biomod_path, len(markers_order_biomod), ik_solver.nb_q, rate=interface.system_rate,
+                             ik_method=ik_method).start()
+    session = None
+    if session_path:
+        session = SessionRecorder(session_path, len(markers_order_biomod), ik_solver.nb_q,
+                                  rate=interface.system_rate, marker_names=markers_order_biomod)
+    live_bus = None
+    if live_bus_name:
+        from live_bus import LiveBus
 
-    await start_moving(interface, biomod_path=biomod_path, marker_order=markers_order_biomod, in_queue=in_queue,
-                       axes=axes, fig=fig)
+        live_bus = LiveBus(live_bus_name, len(markers_order_biomod), ik_solver.nb_q)
+
+    try:
+        await start_moving(interface, biomod_path=biomod_path, marker_order=markers_order_biomod,
+                           commands=commands, axes=axes, fig=fig, ik_solver=ik_solver, trace_path=trace_path,
+                           ik_worker=ik_worker, session=session, calibration_frames=calibration_frames,
+                           calibration_max_std=calibration_max_std, preview=preview, sinks=sinks,
+                           gh_angles=gh_angles, live_bus=live_bus)
+    finally:
+        if ik_worker is not None:
+            ik_worker.stop()
+        if session is not None:
+            session.close()
+        if live_bus is not None:
+            live_bus.close()
     print('Experiment ended')
 
-async def start_moving(interface, biomod_path, marker_order, in_queue, axes, fig):
-    GH_q1_ref = 0
-    GH_q2_ref = 0
-    await set_zero_position(interface, biomod_path, marker_order,  in_queue)
-    plt.ion()
-    fdbck_ellipse = Ellipse((0,0),
-                      width=3,
-                      height=3,
-                      facecolor='b',
-                      edgecolor='none',
-                      alpha=0.3)
-    axes.add_patch(fdbck_ellipse)
-    fig.canvas.draw()
-    fig.canvas.flush_events()
-
-    if not in_queue.empty():
-        in_queue.get()
+async def start_moving(interface, biomod_path, marker_order, commands, axes, fig, ik_solver=None,
+                       trace_path=None, ik_worker=None, session=None, calibration_frames=100,
+                       calibration_max_std=1, preview=False, sinks=(), gh_angles=None, live_bus=None):
+    recorder = interface.recorder if interface.recorder is not None else LatencyRecorder()
+    gh_angles = gh_angles if gh_angles is not None else GHAngles(get_model(biomod_path))
+    if ik_solver is None:
+        ik_solver = IK_SOLVERS['least_squares'](get_model(biomod_path), rate=interface.system_rate)
+    reference = await set_zero_position(interface, biomod_path, marker_order, commands, ik_solver=ik_solver,
+                                        session=session, n_frames=calibration_frames,
+                                        max_std=calibration_max_std, preview=preview,
+                                        feedback_dofs=gh_angles.feedback_dofs)
+    if reference is None:
+        return
+    gh_ref = gh_angles(reference['q'])
+    if live_bus is not None:
+        live_bus.set_reference(reference['q'])
+    # The GUI feedback window is one sink among the ones asked for on the command line
+    sinks = [make_sink(spec, recorder=recorder) for spec in sinks]
+    if axes is not None:
+        sinks.append(ellipse_renderer(fig, axes, max_fps=60, recorder=recorder))
+    sink_tasks = [aio.get_event_loop().create_task(sink.run()) for sink in sinks]
+    feedback = np.zeros((), dtype=FEEDBACK_DTYPE)
+    q_buffer = JointBuffer(ik_solver.nb_q, size=1000,
+                           filters={'one_euro': OneEuroFilter(ik_solver.nb_q, rate=interface.system_rate)})
+
+    commands.clear()
+    marker_set = interface.marker_sets[0]
+    q, qdot, ik_frame_number = np.zeros(ik_solver.nb_q), np.zeros(ik_solver.nb_q), -1
+    # Streamed and replayed frames pace the loop by their arrival (as fast as possible for a replay that is not in
+    # real time), polling QTM is paced on the frame period. Either way only the latest frame is processed after an
+    # overrun.
+    is_paced_by_frames = interface.frame_buffer is not None or isinstance(interface, ReplayInterface)
+    pacer = DeadlinePacer(interface.system_rate, sleep=not is_paced_by_frames)
 
     while 1:
-        await interface.get_marker_set_data(marker_names=interface.marker_sets[0].marker_names)
-        q, qdot = await interface.get_kinematics_from_markers(model_path=biomod_path,
-                                                              marker_set_name='markers',
-                                                              kin_data_window=1,
-                                                              get_markers_data=True,
-                                                              method='biorbd_least_square',)
-
-        await update_ellipse(fdbck_ellipse, q,
-                           GH_q1_ref=GH_q1_ref,
-                           GH_q2_ref=GH_q2_ref,
-                           ax=axes)
-        fig.canvas.draw()
-        fig.canvas.flush_events()
+        await pacer.wait()
         try:
-            in_queue.get_nowait()
-            break
-        except:
-            await aio.sleep(0.1)
-        print('out?')
-        if not in_queue.empty():
-            in_queue.get()
-            print('2nd block')
+            _, timestamp = await interface.get_marker_set_data(marker_names=marker_set.marker_names)
+        except EOFError:
+            print('End of the replayed trial')
             break
+        pacer.frame(interface.frame_number)
+        if ik_worker is not None:
+            # The frame is solved in the worker process, only its latest solved frame is shown
+            ik_worker.submit(marker_set.ordered_data.T, marker_set.valid, interface.frame_number, recorder.row)
+            result = ik_worker.latest()
+            row = None
+            if result is not None:
+                q, qdot, meta = result
+                ik_frame_number, row = int(meta[0]), int(meta[1])
+                recorder.record('ik', int(meta[2]), int(meta[3]), row)
+                with recorder.span('filtering', row):
+                    q_buffer.append(q, qdot)
+        else:
+            with recorder.span('ik'):
+                q, qdot = await interface.get_kinematics_from_markers(marker_set_name='markers', solver=ik_solver)
 
-    # interface.marker_sets[0].kin_method = 'biorbd_least_square' #, 'biorbd_kalman', 'biorbd_least_square'
-
-    while 1:
-        q, qdot = await interface.get_kinematics_from_markers(model_path=biomod_path,
-                                                              marker_set_name='markers',
-                                                              kin_data_window=5,
-                                                              get_markers_data=True,
-                                                              method='biorbd_least_square')
-        # humerus
-
-
-        if not in_queue.empty():
-            in_queue.get()
+            q, qdot, ik_frame_number = q[:, -1], qdot[:, -1], interface.frame_number
+            with recorder.span('filtering'):
+                q_buffer.append(q, qdot)
+            row = recorder.row
+        if row is not None:
+            gh_feedback(gh_angles.relative(q_buffer.latest('one_euro'), gh_ref), ik_frame_number, timestamp,
+                        out=feedback)
+            for sink in sinks:
+                sink.post(feedback, row=row)
+        ellipse = ellipse_parameters(feedback['gh'])
+        if session is not None:
+            session.record(interface.frame_number, timestamp, marker_set.ordered_data.T, q, qdot, ellipse,
+                           ik_frame_number)
+        if live_bus is not None:
+            live_bus.publish(interface.frame_number, timestamp, marker_set.ordered_data.T, q, qdot, ellipse,
+                             ik_frame_number)
+        # Commands are checked once per frame
+        if commands.poll() == Command.STOP:
             break
-    await print('out')
-        # loop_time = time() - tic
-        # real_time_to_sleep = time_to_sleep - loop_time
-        # if real_time_to_sleep > 0:
-        #     sleep(real_time_to_sleep)
+    for task in sink_tasks:
+        task.cancel()
+    pacer.report('Acquisition loop')
+    for sink in sinks:
+        sink.report()
+        sink.close()
+    recorder.summary()
+    if trace_path:
+        recorder.to_parquet(trace_path) if trace_path.endswith('.parquet') else recorder.to_csv(trace_path)
+
 
 if __name__ == '__main__':
     PARSER = argparse.ArgumentParser(description='Start experiment')
@@ -222,22 +231,76 @@ if __name__ == '__main__':
                              'folder in the QTM project')
     PARSER.add_argument('--password', dest='password', default='password',
                         help='QTM streaming password')
+    PARSER.add_argument('--replay', dest='replay', default=None,
+                        help='Recorded trial (.c3d or .npy) replayed instead of connecting to QTM')
+    PARSER.add_argument('--replay-rate', dest='replay_rate', type=float, default=None,
+                        help='Rate of the replayed trial, read from the C3D if omitted (100 Hz for .npy)')
+    PARSER.add_argument('--replay-realtime', dest='replay_realtime', action='store_true', default=True,
+                        help='Replay the trial at its rate (default)')
+    PARSER.add_argument('--no-realtime', dest='replay_realtime', action='store_false',
+                        help='Replay the trial as fast as the pipeline runs')
+    PARSER.add_argument('--loop', dest='replay_loop', action='store_true',
+                        help='Replay the trial in loop instead of stopping at its end')
+    PARSER.add_argument('--trace', dest='trace', default=None,
+                        help='Dump the per-frame latency trace to this .csv or .parquet at the end of the session')
+    PARSER.add_argument('--ik', dest='ik_method', default='least_squares', choices=list(IK_SOLVERS),
+                        help='shoulder_chain fits the thorax rigidly and solves only the shoulder chain, kalman keeps '
+                             'an extended Kalman filter over the session')
+    PARSER.add_argument('--ik-process', dest='ik_process', action='store_true',
+                        help='Solve the IK in a dedicated process fed through shared memory')
+    PARSER.add_argument('--session', dest='session', default=None,
+                        help='Folder where the markers, q and feedback of the session are recorded')
+    PARSER.add_argument('--calib-frames', dest='calib_frames', type=int, default=100,
+                        help='Number of static frames averaged for the reference pose')
+    PARSER.add_argument('--calib-max-std', dest='calib_max_std', type=float, default=1,
+                        help='Reference accepted without confirmation below this std (deg) of the feedback dofs')
+    PARSER.add_argument('--preview', dest='preview', action='store_true',
+                        help='Show the reference pose in bioviz, in a separate window')
+    PARSER.add_argument('--headless', dest='headless', action='store_true',
+                        help='Run without the Tk GUI, commands are typed in the terminal (Enter sets the reference, '
+                             'ok accepts it, q stops)')
+    PARSER.add_argument('--biomod', dest='biomod', default=None,
+                        help='Headless: bioMod of the participant, converted from Parameters.osim_path if omitted')
+    PARSER.add_argument('--live-bus', dest='live_bus', default=None,
+                        help='Name of a shared memory bus publishing every frame to other processes, '
+                             'see live_bus.py')
+    PARSER.add_argument('--gh-convention', dest='gh_convention', default='model',
+                        help='GH angles of the feedback: model for the plane, elevation and axial rotation dofs, or '
+                             'an intrinsic sequence of the humerus in the scapula, e.g. yxy (ISB)')
+    PARSER.add_argument('--sink', dest='sinks', nargs='+', default=[],
+                        help='Feedback sinks, among mpl, null, udp:host:port and osc:host:port. Headless runs '
+                             'default to null, the GUI feedback window is always used otherwise')
     ARGS = PARSER.parse_args()
-    in_queue = queue.Queue(maxsize=2)
-    gui_input = manage_queue(queue=in_queue)
-    use_gui = True
+    loop = aio.new_event_loop()
+    commands = CommandBus(loop)
+    TerminalCommands(commands)
+    use_gui = not ARGS.headless
     if use_gui:
-        loop = aio.new_event_loop()
-        # app = QApplication([])
-        app = EXPgui(loop, ARGS, main, in_queue=in_queue)
+        from Exp_gui import EXPgui
+
+        app = EXPgui(loop, ARGS, main, commands=commands)
         loop.run_forever()
     else:
-        loop = aio.get_event_loop()
         loop.run_until_complete(main(
-            to_create_biomod=False,
+            to_create_biomod=ARGS.biomod is None,
             osim_path=osim_path,
-            biomod_path="D:\Shoulder_ER_IR\Analysis\\results\\00IB\\_models\\wu_na_scaled_markers.bioMod",
-            in_queue=in_queue),
+            biomod_path=ARGS.biomod,
+            qtm_ip=ARGS.qtmip,
+            qtm_pwd=ARGS.password,
+            commands=commands,
+            replay_path=ARGS.replay,
+            trace_path=ARGS.trace,
+            ik_method=ARGS.ik_method,
+            ik_process=ARGS.ik_process,
+            session_path=ARGS.session,
+            calibration_frames=ARGS.calib_frames,
+            calibration_max_std=ARGS.calib_max_std,
+            preview=ARGS.preview,
+            sinks=ARGS.sinks if ARGS.sinks else ['null'],
+            gh_convention=ARGS.gh_convention,
+            live_bus_name=ARGS.live_bus,
+            replay_rate=ARGS.replay_rate,
+            replay_realtime=ARGS.replay_realtime,
+            replay_loop=ARGS.replay_loop),
         )
-        loop.close()
-    gui_input.stop()
\ No newline at end of file
+        loop.close()
\ No newline at end of file
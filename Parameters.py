@@ -1 +1,4 @@
+results_root = "D:\\Shoulder_ER_IR\\Analysis\\results"
+model_folder = "_models"
+model_name = "wu_na_scaled_markers.osim"
 osim_path = "D:\\Shoulder_ER_IR\\Analysis\\results\\00IB\_models\\wu_na_scaled_markers.osim"
\ No newline at end of file
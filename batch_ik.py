@@ -0,0 +1,118 @@
+"""
+Batched inverse kinematics over whole trials, solved in parallel across processes.
+
+    python batch_ik.py --biomod wu_na_scaled_markers.bioMod --markers trial.c3d --output trial_q.npz
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+
+from ik_solvers import LeastSquaresIK
+
+_worker_model = None
+
+
+def _init_worker(biomod_path):
+    # One model per worker, parsed once for all the chunks it solves
+    global _worker_model
+    from model_cache import get_model
+
+    _worker_model = get_model(biomod_path)
+
+
+def _solve_chunk(markers, rate, overlap):
+    ik_solver = LeastSquaresIK(_worker_model, rate=rate)
+    q, _ = ik_solver.solve(markers)
+    return q[:, overlap:]
+
+
+def split_chunks(n_frames: int, chunk_size: int, overlap: int):
+    """
+    Split a trial in chunks, each one starting overlap frames early so that its solver is already warm-started
+    when it reaches its first kept frame.
+
+    Returns
+    -------
+    chunks: list
+        (first solved frame, first kept frame, end frame) of each chunk.
+    """
+    chunks = []
+    for start in range(0, n_frames, chunk_size):
+        chunks.append((max(0, start - overlap), start, min(start + chunk_size, n_frames)))
+    return chunks
+
+
+def batch_inverse_kinematics(biomod_path: str, markers: np.ndarray, rate: float = 100, n_workers: int = None,
+                             chunk_size: int = 500, overlap: int = 10):
+    """
+    Solve the inverse kinematics of a whole trial across a process pool.
+
+    Parameters
+    ----------
+    biomod_path: str
+        Path of the bioMod, loaded once in each worker.
+    markers: np.ndarray
+        Markers positions (3, n_markers, n_frames) in meters, in the bioMod marker order.
+    rate: float
+        Rate of the markers.
+    n_workers: int
+        Number of processes, all the cores if None.
+    chunk_size: int
+        Number of frames kept from each chunk.
+    overlap: int
+        Number of frames solved before each chunk to warm-start it and then discarded.
+
+    Returns
+    -------
+    q, qdot: tuple
+        Generalized coordinates and velocities (n_q, n_frames).
+    """
+    chunks = split_chunks(markers.shape[2], chunk_size, overlap)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(biomod_path,)) as pool:
+        futures = [pool.submit(_solve_chunk, markers[:, :, first:end], rate, start - first)
+                   for first, start, end in chunks]
+        q = np.concatenate([future.result() for future in futures], axis=1)
+    qdot = np.gradient(q, 1 / rate, axis=1)
+    return q, qdot
+
+
+def load_ordered_markers(trial_path: str, marker_order: list):
+    """
+    Load a C3D or .npy trial and reorder its markers as in the bioMod.
+    """
+    from replay_interface import load_trial
+
+    markers, labels, rate = load_trial(trial_path)
+    if labels is not None:
+        label_idx = {label: i for i, label in enumerate(labels)}
+        markers = markers[:, [label_idx[name] for name in marker_order], :]
+    return markers, rate
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Batched inverse kinematics of a whole trial')
+    PARSER.add_argument('--biomod', dest='biomod', required=True)
+    PARSER.add_argument('--markers', dest='markers', required=True,
+                        help='Trial (.c3d, or .npy 3 x n_markers x n_frames in meters and bioMod order)')
+    PARSER.add_argument('--output', dest='output', default=None, help='Output .npz, next to the trial if None')
+    PARSER.add_argument('--rate', dest='rate', type=float, default=None)
+    PARSER.add_argument('--workers', dest='workers', type=int, default=None)
+    PARSER.add_argument('--chunk', dest='chunk', type=int, default=500)
+    PARSER.add_argument('--overlap', dest='overlap', type=int, default=10)
+    ARGS = PARSER.parse_args()
+
+    from model_cache import get_model
+
+    model = get_model(ARGS.biomod)
+    trial, trial_rate = load_ordered_markers(ARGS.markers, [name.to_string() for name in model.markerNames()])
+    trial_rate = ARGS.rate if ARGS.rate else trial_rate if trial_rate else 100
+    tic = time.perf_counter()
+    q_trial, qdot_trial = batch_inverse_kinematics(ARGS.biomod, trial, trial_rate, ARGS.workers,
+                                                   ARGS.chunk, ARGS.overlap)
+    duration = time.perf_counter() - tic
+    print(f'{trial.shape[2]} frames solved in {duration:.1f} s ({trial.shape[2] / duration:.0f} fps)')
+    output = ARGS.output if ARGS.output else str(Path(ARGS.markers).with_suffix('')) + '_q.npz'
+    np.savez(output, q=q_trial, qdot=qdot_trial)
+    print(f'Saved {output}')
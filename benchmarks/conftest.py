@@ -0,0 +1,106 @@
+"""
+Latency benchmarks of the real-time pipeline, run with pytest-benchmark:
+
+    python -m pytest benchmarks
+    python -m pytest benchmarks/test_ik.py --biomod Wu_Shoulder_Model.bioMod --trial trial.npy
+    python -m pytest benchmarks -k decode --frames 2000
+
+Recorded markers are expected as a .npy array (3, n_markers, n_frames) in meters, in the bioMod marker order.
+Without recorded data, a synthetic trial is generated from the model itself. Benchmarks needing biorbd are skipped
+when it is not installed.
+
+Runs are compared across commits with the pytest-benchmark storage:
+
+    python -m pytest benchmarks --benchmark-autosave
+    pytest-benchmark compare 0001 0002 --group-by group --columns median,max
+"""
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('pipeline benchmarks')
+    group.addoption('--biomod', dest='biomod', default=str(REPO_DIR / 'Wu_Shoulder_Model.bioMod'))
+    group.addoption('--trial', dest='trial', default=None,
+                    help='Recorded markers (.npy, 3 x n_markers x n_frames, meters, bioMod order)')
+    group.addoption('--frames', dest='frames', type=int, default=200)
+    group.addoption('--rate', dest='rate', type=float, default=100)
+    group.addoption('--hours', dest='hours', type=float, default=0.1, help='Length of the recorded session')
+
+
+def load_markers(markers_path=None, model=None, n_frames=500, rate=100, noise=0.002, seed=0):
+    """
+    Load recorded markers or generate a smooth synthetic trial from the model.
+    """
+    if markers_path:
+        return np.load(markers_path)
+    from ik_solvers import get_q_bounds
+
+    rng = np.random.default_rng(seed)
+    q_min, q_max = get_q_bounds(model)
+    q_min, q_max = np.maximum(q_min, -np.pi), np.minimum(q_max, np.pi)
+    t = np.arange(n_frames) / rate
+    phase = rng.uniform(0, 2 * np.pi, model.nbQ())
+    q = (q_min + q_max)[:, None] / 2 + (q_max - q_min)[:, None] / 4 * np.sin(2 * np.pi * 0.5 * t + phase[:, None])
+    markers = np.zeros((3, model.nbMarkers(), n_frames))
+    for i in range(n_frames):
+        markers[:, :, i] = np.array([mark.to_array() for mark in model.markers(q[:, i])]).T
+    return markers + rng.normal(0, noise, markers.shape)
+
+
+@pytest.fixture(scope='session')
+def n_frames(request):
+    return request.config.getoption('frames')
+
+
+@pytest.fixture(scope='session')
+def rate(request):
+    return request.config.getoption('rate')
+
+
+@pytest.fixture(scope='session')
+def hours(request):
+    return request.config.getoption('hours')
+
+
+@pytest.fixture(scope='session')
+def biomod_path(request):
+    return request.config.getoption('biomod')
+
+
+@pytest.fixture(scope='session')
+def model(biomod_path):
+    pytest.importorskip('biorbd')
+    from model_cache import get_model
+
+    return get_model(biomod_path)
+
+
+@pytest.fixture(scope='session')
+def markers(request, model, n_frames, rate):
+    return load_markers(request.config.getoption('trial'), model, n_frames, rate)
+
+
+@pytest.fixture
+def per_frame(benchmark):
+    """
+    Time func(i) once for every frame i of a trial, the first frame being a warmup round. prepare(i), when given,
+    runs before each frame out of the timing (acquisition of the frame, pacing...).
+    """
+    def run(func, n_frames, prepare=None):
+        frames = iter(range(n_frames))
+
+        def setup():
+            i = next(frames)
+            if prepare is not None:
+                prepare(i)
+            return (i,), {}
+
+        return benchmark.pedantic(func, setup=setup, rounds=n_frames - 1, warmup_rounds=1)
+
+    return run
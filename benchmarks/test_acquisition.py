@@ -0,0 +1,151 @@
+"""
+Acquisition side of the loop: packet decoding, marker reordering, replay and loop pacing.
+"""
+import asyncio as aio
+import time
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('path', ['per marker loop', 'precomputed gather'])
+def test_reorder(benchmark, path, n_markers=33, n_frames=2000, seed=0):
+    """
+    Per-marker reordering loop against the precomputed index gather of QTMInterface.
+    """
+    from qtm_interface import QTMInterface
+
+    benchmark.group = 'reorder'
+    rng = np.random.default_rng(seed)
+    labels = [f'marker_{i}' for i in range(n_markers)]
+    target = list(rng.permutation(labels))
+    frames = rng.normal(0, 1, (n_frames, n_markers, 3))
+    markers = SimpleNamespace(marker_names=labels, nb_channels=n_markers, sample=1)
+    QTMInterface._set_marker_order(markers, target)
+
+    def loop(i):
+        indices = [labels.index(name) for name in target]
+        new_data = np.zeros((3, n_markers, 1))
+        markers_data = np.zeros((3, n_markers, 1))
+        for j, imark in enumerate(indices):
+            markers_data[:, j, :] = frames[i].T[:, imark, np.newaxis]
+            new_data[:, j, :] = frames[i].T[:, imark, np.newaxis]
+        return new_data
+
+    def gather(i):
+        np.take(frames[i], markers.indices, axis=0, out=markers.ordered_data, mode='clip')
+        return markers.new_data
+
+    func = loop if path == 'per marker loop' else gather
+    frame = iter(range(n_frames))
+    benchmark.pedantic(lambda: func(next(frame)), rounds=n_frames - 1, warmup_rounds=1)
+    np.testing.assert_array_equal(func(0)[:, :, 0], frames[0].T[:, markers.indices])
+
+
+@pytest.mark.parametrize('path', ['get_3d_markers', 'frombuffer'])
+@pytest.mark.parametrize('residuals', [False, True], ids=['3d', '3dres'])
+@pytest.mark.parametrize('nb_markers', [33, 128])
+def test_decode(benchmark, nb_markers, residuals, path, occlusion=0.1, seed=0):
+    """
+    Decode time of a QTM packet, get_3d_markers tuples against the preallocated frombuffer decoder.
+    """
+    from qtm_rt.packet import QRTPacket
+    from fake_qtm import data_packet
+    from qtm_interface import PacketDecoder
+
+    benchmark.group = f'decode {nb_markers} markers{" + res" if residuals else ""}'
+    rng = np.random.default_rng(seed)
+    markers = rng.normal(0, 500, (3, nb_markers))
+    markers[:, rng.random(nb_markers) < occlusion] = np.nan
+    marker_residuals = np.where(np.isfinite(markers).all(axis=0), rng.random(nb_markers), np.nan)
+    # Packets as received by qtm_rt, without the 8 bytes packet header
+    data = data_packet(markers, 1, 0, marker_residuals if residuals else None)[8:]
+    if path == 'get_3d_markers':
+        get_markers = QRTPacket.get_3d_markers_residual if residuals else QRTPacket.get_3d_markers
+        pos = benchmark(lambda: np.array(get_markers(QRTPacket(data))[1]) * 1e-3)
+        decoded, decoded_residuals = pos[:, :3], pos[:, 3] * 1e3 if residuals else None
+    else:
+        decoder = PacketDecoder(nb_markers, residuals)
+        benchmark(lambda: decoder.decode(QRTPacket(data)))
+        decoded, decoded_residuals = decoder.positions, decoder.residuals
+    np.testing.assert_allclose(decoded, markers.T * 1e-3, rtol=1e-6)
+    if residuals:
+        np.testing.assert_allclose(decoded_residuals, marker_residuals, rtol=1e-6)
+
+
+def test_replay(benchmark, model, markers, rate, tmp_path):
+    """
+    Acquisition and IK of a replayed trial, per frame.
+    """
+    from ik_solvers import LeastSquaresIK
+    from replay_interface import ReplayInterface
+
+    marker_order = [name.to_string() for name in model.markerNames()]
+    trial_path = str(tmp_path / 'trial.npy')
+    np.save(trial_path, markers)
+    loop = aio.new_event_loop()
+    interface = loop.run_until_complete(ReplayInterface(trial_path, marker_names=marker_order, system_rate=rate))
+    loop.run_until_complete(interface.add_marker_set(nb_markers=len(marker_order), name='markers', rate=rate,
+                                                     target_marker_list=marker_order))
+    ik_solver = LeastSquaresIK(model, rate=rate)
+
+    async def frame():
+        await interface.get_marker_set_data()
+        await interface.get_kinematics_from_markers(marker_set_name='markers', solver=ik_solver)
+
+    benchmark.pedantic(lambda: loop.run_until_complete(frame()), rounds=interface.nb_frames - 1, warmup_rounds=1)
+    loop.close()
+
+
+@pytest.mark.parametrize('method', ['biorbd_least_square', 'biorbd_kalman', 'persistent'])
+def test_kinematics(per_frame, biomod_path, model, markers, rate, method, tmp_path):
+    """
+    QTMInterface.get_kinematics_from_markers for each method, fed by a replayed trial.
+    """
+    from ik_solvers import LeastSquaresIK
+    from replay_interface import ReplayInterface
+
+    marker_order = [name.to_string() for name in model.markerNames()]
+    trial_path = str(tmp_path / 'trial.npy')
+    np.save(trial_path, markers)
+    loop = aio.new_event_loop()
+    interface = loop.run_until_complete(ReplayInterface(trial_path, marker_names=marker_order, system_rate=rate))
+    loop.run_until_complete(interface.add_marker_set(nb_markers=len(marker_order), name='markers', rate=rate,
+                                                     target_marker_list=marker_order))
+    ik_solver = LeastSquaresIK(model, rate=rate) if method == 'persistent' else None
+    per_frame(lambda i: loop.run_until_complete(interface.get_kinematics_from_markers(
+                  marker_set_name='markers', model_path=biomod_path, method=method, solver=ik_solver,
+                  kin_data_window=1)),
+              interface.nb_frames, prepare=lambda i: loop.run_until_complete(interface.get_marker_set_data()))
+    loop.close()
+
+
+@pytest.mark.parametrize('path', ['fixed sleep', 'deadline'])
+def test_pacing(benchmark, path, rate, n_frames, work_ms=3, spike_ms=25, spike_every=50):
+    """
+    Loop period with a fixed sleep after each iteration against deadline pacing, the iteration work having
+    occasional spikes longer than the frame period. Each round is one period of the loop.
+    """
+    from pacing import DeadlinePacer
+
+    benchmark.group = 'pacing'
+    pacer = DeadlinePacer(rate)
+    frame = iter(range(n_frames + 1))
+
+    def work(i):
+        time.sleep((spike_ms if i % spike_every == spike_every - 1 else work_ms) / 1e3)
+
+    async def fixed_sleep():
+        work(next(frame))
+        await aio.sleep(1 / rate)
+
+    async def deadline():
+        await pacer.wait()
+        work(next(frame))
+
+    iteration = fixed_sleep if path == 'fixed sleep' else deadline
+    loop = aio.new_event_loop()
+    benchmark.pedantic(lambda: loop.run_until_complete(iteration()), rounds=n_frames, warmup_rounds=1)
+    loop.close()
+    if path == 'deadline':
+        benchmark.extra_info.update(pacer.stats())
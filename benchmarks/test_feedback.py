@@ -0,0 +1,127 @@
+"""
+Feedback side of the loop: joint filters, GH angles, feedback sinks and the matplotlib ellipse.
+"""
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='module')
+def gh(n_frames, seed=0):
+    return np.random.default_rng(seed).normal(0, 1, (n_frames, 3))
+
+
+@pytest.mark.parametrize('path', ['incremental (3 filters)', 'whole window butterworth'])
+@pytest.mark.parametrize('window', [100, 1000, 10000])
+def test_filters(benchmark, window, path, rate, nb_q=20, n_samples=2000, seed=0):
+    """
+    Cost per sample of the incremental joint filters against refiltering the whole window, as windows grow.
+    """
+    from scipy import signal
+    from joint_buffer import JointBuffer, ExponentialFilter, OneEuroFilter, ButterworthFilter
+
+    benchmark.group = f'filters window {window}'
+    rng = np.random.default_rng(seed)
+    q = np.cumsum(rng.normal(0, 0.01, (nb_q, n_samples)), axis=1)
+    q_buffer = JointBuffer(nb_q, size=window, filters={
+        'exponential': ExponentialFilter(nb_q),
+        'one_euro': OneEuroFilter(nb_q, rate),
+        'butterworth': ButterworthFilter(nb_q, rate),
+    })
+    for i in range(window):
+        q_buffer.append(q[:, i % n_samples])
+    sample = iter(range(n_samples))
+    if path.startswith('incremental'):
+        def incremental():
+            q_buffer.append(q[:, next(sample)])
+            return q_buffer.latest('butterworth', [11, 12])
+
+        benchmark.pedantic(incremental, rounds=n_samples)
+    else:
+        b, a = signal.butter(2, 6, fs=rate)
+        benchmark.pedantic(lambda: signal.lfilter(b, a, q_buffer.window(), axis=1)[[11, 12], -1],
+                           setup=lambda: q_buffer.append(q[:, next(sample)]), rounds=n_samples)
+
+
+@pytest.mark.parametrize('path', ['ellipse update', 'blitted render', 'full canvas draw'])
+def test_ellipse(benchmark, gh, path):
+    """
+    Cost of the feedback ellipse update and draw, blitted by the renderer or with a full canvas redraw.
+    """
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Ellipse
+    from feedback import FeedbackRenderer, gh_feedback, update_ellipse
+
+    benchmark.group = 'ellipse'
+    feedback = [gh_feedback(gh_frame, i) for i, gh_frame in enumerate(gh)]
+    fig, axes = plt.subplots(1, 1)
+    axes.set_xlim(-10, 10)
+    axes.set_ylim(-10, 10)
+    ellipse = Ellipse((0, 0), width=3, height=3, facecolor='b', edgecolor='none', alpha=0.3)
+    renderer = FeedbackRenderer(fig, axes, ellipse, update_ellipse)
+    frame = iter(feedback)
+    if path == 'ellipse update':
+        benchmark.pedantic(lambda: update_ellipse(ellipse, next(frame)), rounds=len(feedback))
+    elif path == 'blitted render':
+        benchmark.pedantic(lambda: renderer.render(next(frame)), rounds=len(feedback))
+    else:
+        benchmark.pedantic(fig.canvas.draw, setup=lambda: update_ellipse(ellipse, next(frame)), rounds=len(feedback))
+    renderer.close()
+    plt.close(fig)
+
+
+@pytest.mark.parametrize('sink', ['feedback record', 'null', 'udp', 'osc', 'mpl'])
+def test_sinks(benchmark, gh, sink, port=9000):
+    """
+    Cost for the acquisition loop of building a feedback record and of posting it to each sink.
+    """
+    import matplotlib
+
+    matplotlib.use('Agg')
+    from feedback import NullSink, UdpSink, ellipse_renderer, gh_feedback
+
+    benchmark.group = 'sinks'
+    feedback = gh_feedback(gh[0])
+    frame = iter(enumerate(gh))
+    if sink == 'feedback record':
+        benchmark.pedantic(lambda: gh_feedback(*next(frame)[::-1], out=feedback), rounds=len(gh))
+        return
+    sinks = {'null': NullSink, 'udp': lambda: UdpSink(port=port), 'osc': lambda: UdpSink(port=port, osc=True),
+             'mpl': ellipse_renderer}
+    feedback_sink = sinks[sink]()
+
+    def next_record():
+        i, gh_frame = next(frame)
+        gh_feedback(gh_frame, i, out=feedback)
+
+    benchmark.pedantic(feedback_sink.post, args=(feedback,), setup=next_record, rounds=len(gh))
+    if sink == 'mpl':
+        for gh_frame in gh[:100]:
+            feedback_sink.render(gh_feedback(gh_frame))
+        benchmark.extra_info['render median (ms)'] = float(np.median(feedback_sink.render_time) * 1e3)
+    feedback_sink.close()
+
+
+@pytest.mark.parametrize('path', ['model', 'yxy', 'xzy', 'yxy batch', 'scipy as_euler'])
+def test_gh_angles(benchmark, model, n_frames, path, seed=0):
+    """
+    GH angles of the feedback for each convention, frame by frame and in one batch, against a scipy Rotation
+    conversion per frame.
+    """
+    from scipy.spatial.transform import Rotation
+    from gh_angles import GHAngles
+
+    benchmark.group = 'gh_angles'
+    q = np.random.default_rng(seed).normal(0, 0.5, (model.nbQ(), n_frames))
+    gh_angles = GHAngles(model, convention=path.split()[0] if path != 'scipy as_euler' else 'yxy')
+    frame = iter(range(n_frames))
+    if path == 'yxy batch':
+        benchmark.extra_info['frames per batch'] = n_frames
+        benchmark(gh_angles, q)
+    elif path == 'scipy as_euler':
+        rotations = gh_angles.rotation(q)
+        benchmark.pedantic(lambda: Rotation.from_matrix(rotations[next(frame)]).as_euler('YXY'), rounds=n_frames)
+    else:
+        benchmark.pedantic(lambda: gh_angles(q[:, next(frame)]), rounds=n_frames)
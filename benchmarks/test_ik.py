@@ -0,0 +1,229 @@
+"""
+Per-frame cost and accuracy of the inverse kinematics solvers, in process and in the IK worker.
+"""
+import numpy as np
+import pytest
+
+FEEDBACK_DOFS = (11, 12, 13, 14)
+
+
+def rotation_trial(model, n_frames=500, rate=100, axial_dof=13, amplitude=60, frequency=1.5, noise=0.002, seed=0):
+    """
+    Synthetic rapid internal/external rotation: the GH axial rotation swings +/- amplitude degrees at frequency
+    around the middle of its range, the other degrees of freedom drift slowly.
+
+    Returns
+    -------
+    markers, q: tuple
+        Noisy markers (3, n_markers, n_frames) and the true q (n_q, n_frames).
+    """
+    from ik_solvers import get_q_bounds
+
+    rng = np.random.default_rng(seed)
+    q_min, q_max = get_q_bounds(model)
+    q_min, q_max = np.maximum(q_min, -np.pi), np.minimum(q_max, np.pi)
+    t = np.arange(n_frames) / rate
+    phase = rng.uniform(0, 2 * np.pi, model.nbQ())
+    q = (q_min + q_max)[:, None] / 2 + (q_max - q_min)[:, None] / 10 * np.sin(2 * np.pi * 0.2 * t + phase[:, None])
+    q[axial_dof] = (q_min[axial_dof] + q_max[axial_dof]) / 2 + np.deg2rad(amplitude) * np.sin(2 * np.pi * frequency * t)
+    markers = np.zeros((3, model.nbMarkers(), n_frames))
+    for i in range(n_frames):
+        markers[:, :, i] = np.array([mark.to_array() for mark in model.markers(q[:, i])]).T
+    return markers + rng.normal(0, noise, markers.shape), q
+
+
+def solve_trial(ik_solver, markers):
+    q = None
+    for i in range(markers.shape[2]):
+        q_frame = ik_solver.solve(markers[:, :, i])[0][:, -1]
+        q = np.zeros((q_frame.size, markers.shape[2])) if q is None else q
+        q[:, i] = q_frame
+    return q
+
+
+@pytest.fixture(scope='module')
+def least_square_q(model, markers, rate):
+    from ik_solvers import LeastSquaresIK
+
+    return solve_trial(LeastSquaresIK(model, rate=rate), markers)
+
+
+@pytest.mark.parametrize('path', ['biosiglive per call', 'persistent warm-started'])
+def test_ik(per_frame, benchmark, biomod_path, model, markers, rate, path):
+    """
+    Per-call biosiglive least square path against the persistent warm-started solver.
+    """
+    from biosiglive import MskFunctions
+    from ik_solvers import LeastSquaresIK
+
+    benchmark.group = 'ik'
+    if path == 'biosiglive per call':
+        msk_function = MskFunctions(biomod_path, data_buffer_size=1)
+        per_frame(lambda i: msk_function.compute_inverse_kinematics(markers[:, :, i:i + 1],
+                                                                    method='biorbd_least_square'),
+                  markers.shape[2])
+    else:
+        ik_solver = LeastSquaresIK(model, rate=rate)
+        per_frame(lambda i: ik_solver.solve(markers[:, :, i]), markers.shape[2])
+
+
+@pytest.mark.parametrize('solver', ['full least square', 'shoulder chain'])
+def test_chain_ik(per_frame, benchmark, model, markers, rate, least_square_q, solver):
+    """
+    Reduced shoulder chain IK against the full least square solution, with the difference on the feedback dofs.
+    """
+    from ik_solvers import LeastSquaresIK, ShoulderChainIK
+
+    benchmark.group = 'chain_ik'
+    ik_solver = (LeastSquaresIK if solver == 'full least square' else ShoulderChainIK)(model, rate=rate)
+    q = np.zeros_like(least_square_q)
+
+    def solve(i):
+        q[:, i] = ik_solver.solve(markers[:, :, i])[0][:, -1]
+
+    per_frame(solve, markers.shape[2])
+    if benchmark.disabled:
+        return
+    error = np.rad2deg(q - least_square_q)[:, 1:]
+    for dof in FEEDBACK_DOFS:
+        benchmark.extra_info[f'q[{dof}] delta RMS (deg)'] = float(np.sqrt(np.mean(error[dof] ** 2)))
+        benchmark.extra_info[f'q[{dof}] delta max (deg)'] = float(np.abs(error[dof]).max())
+
+
+@pytest.mark.parametrize('trial', ['clean', 'occluded'])
+@pytest.mark.parametrize('solver', ['full least square', 'shoulder chain'])
+def test_gaps(per_frame, benchmark, model, markers, rate, solver, trial, occlusion=0.2, gap_length=15, seed=0):
+    """
+    Per-frame IK latency on a clean trial and on the same trial with occlusion gaps (NaN) of random markers.
+    """
+    from ik_solvers import LeastSquaresIK, ShoulderChainIK
+
+    benchmark.group = f'gaps {solver}'
+    markers = markers.copy()
+    if trial == 'occluded':
+        rng = np.random.default_rng(seed)
+        for start in range(0, markers.shape[2], gap_length):
+            hidden = rng.random(markers.shape[1]) < occlusion
+            markers[:, hidden, start:start + rng.integers(1, gap_length + 1)] = np.nan
+        # A few frames with nearly every marker hidden, solved by extrapolation
+        markers[:, 2:, markers.shape[2] // 2:markers.shape[2] // 2 + 5] = np.nan
+    ik_solver = (LeastSquaresIK if solver == 'full least square' else ShoulderChainIK)(model, rate=rate)
+    per_frame(lambda i: ik_solver.solve(markers[:, :, i]), markers.shape[2])
+    benchmark.extra_info['occluded markers (%)'] = float(np.isnan(markers[0]).mean() * 100)
+    benchmark.extra_info['extrapolated frames'] = ik_solver.total_extrapolated
+
+
+@pytest.mark.parametrize('solver', ['least square', 'kalman noise 1e-10', 'kalman noise 1e-08'])
+def test_kalman(per_frame, benchmark, model, n_frames, rate, solver, axial_dof=13):
+    """
+    Persistent Kalman IK against the least square IK, on a rapid internal/external rotation trial with a known
+    ground truth: RMS error of the feedback dofs and lag of the axial rotation.
+    """
+    from ik_solvers import LeastSquaresIK, KalmanIK
+
+    benchmark.group = 'kalman'
+    markers, q_true = rotation_trial(model, n_frames, rate, axial_dof)
+    if solver == 'least square':
+        ik_solver = LeastSquaresIK(model, rate=rate)
+    else:
+        ik_solver = KalmanIK(model, rate=rate, noise_factor=float(solver.split()[-1]))
+    q = np.zeros_like(q_true)
+    skip = int(rate // 10)
+    # The filter settles during the first tenth of a second, left out of the timing and of the errors
+    for i in range(skip):
+        q[:, i] = ik_solver.solve(markers[:, :, i])[0][:, -1]
+
+    def solve(i):
+        q[:, skip + i] = ik_solver.solve(markers[:, :, skip + i])[0][:, -1]
+
+    per_frame(solve, n_frames - skip)
+    if benchmark.disabled:
+        return
+    error = np.rad2deg(q - q_true)[:, skip:]
+    for dof in FEEDBACK_DOFS:
+        benchmark.extra_info[f'q[{dof}] RMS (deg)'] = float(np.sqrt(np.mean(error[dof] ** 2)))
+    axial = q_true[axial_dof, skip:] - q_true[axial_dof, skip:].mean()
+    lag = np.argmax(np.correlate(q[axial_dof, skip:] - q[axial_dof, skip:].mean(), axial, 'full')) - axial.size + 1
+    benchmark.extra_info['axial rotation lag (ms)'] = float(lag * 1e3 / rate)
+
+
+@pytest.mark.parametrize('path', ['in-process solve', 'worker round trip', 'worker submit'])
+def test_worker(per_frame, benchmark, biomod_path, model, markers, rate, path):
+    """
+    In-process IK against the IK worker process: round trip through the shared memory rings, and time the event
+    loop is blocked submitting a frame. The solve time inside the worker is kept in the extra info.
+    """
+    from ik_solvers import LeastSquaresIK
+    from ik_worker import IKWorker
+
+    benchmark.group = 'worker'
+    if path == 'in-process solve':
+        ik_solver = LeastSquaresIK(model, rate=rate)
+        per_frame(lambda i: ik_solver.solve(markers[:, :, i]), markers.shape[2])
+        return
+
+    solve = []
+
+    def wait_result():
+        while (result := ik_worker.latest()) is None:
+            pass
+        solve.append((result[2][3] - result[2][2]) * 1e-9)
+
+    def round_trip(i):
+        ik_worker.submit(markers[:, :, i], frame_number=i)
+        wait_result()
+
+    with IKWorker(biomod_path, markers.shape[1], model.nbQ(), rate=rate, drop_stale=False) as ik_worker:
+        if path == 'worker round trip':
+            per_frame(round_trip, markers.shape[2])
+        else:
+            per_frame(lambda i: ik_worker.submit(markers[:, :, i], frame_number=i), markers.shape[2],
+                      prepare=lambda i: i and wait_result())
+    benchmark.extra_info['worker solve mean (ms)'] = float(np.mean(solve[1:]) * 1e3) if len(solve) > 1 else None
+
+
+@pytest.mark.parametrize('mode', ['acquisition', 'sequential', 'processes'])
+@pytest.mark.parametrize('n_sets', [1, 2, 4])
+def test_marker_sets(per_frame, benchmark, biomod_path, model, markers, rate, n_sets, mode, tmp_path):
+    """
+    Cost per tick of several marker sets served from one frame (copies of the model markers with prefixed labels):
+    acquisition with a single gather, then the IK of every set in process, one after another, or in IKWorker
+    processes.
+    """
+    import asyncio as aio
+    from ik_solvers import LeastSquaresIK
+    from ik_worker import IKWorker
+    from replay_interface import ReplayInterface
+
+    benchmark.group = f'marker_sets {n_sets}'
+    marker_order = [name.to_string() for name in model.markerNames()]
+    labels = [f'S{i}_{name}' for i in range(n_sets) for name in marker_order]
+    trial_path = str(tmp_path / 'trial.npy')
+    np.save(trial_path, np.concatenate([markers] * n_sets, axis=1))
+    loop = aio.new_event_loop()
+    interface = loop.run_until_complete(ReplayInterface(trial_path, marker_names=labels, system_rate=rate))
+    for i in range(n_sets):
+        loop.run_until_complete(interface.add_marker_set(nb_markers=len(marker_order), name=f'set_{i}', rate=rate,
+                                                         target_marker_list=marker_order, label_prefix=f'S{i}_'))
+
+    def acquire(i):
+        loop.run_until_complete(interface.get_marker_set_data())
+
+    if mode == 'acquisition':
+        per_frame(acquire, interface.nb_frames)
+    elif mode == 'sequential':
+        solvers = {f'set_{i}': LeastSquaresIK(model, rate=rate) for i in range(n_sets)}
+
+        def solve(i):
+            for markers_set in interface.marker_sets:
+                solvers[markers_set.name].solve(markers_set.new_data, valid=markers_set.valid)
+
+        per_frame(solve, interface.nb_frames, prepare=acquire)
+    else:
+        solvers = {f'set_{i}': IKWorker(biomod_path, len(marker_order), model.nbQ(), rate=rate).start()
+                   for i in range(n_sets)}
+        per_frame(lambda i: loop.run_until_complete(interface.get_kinematics_from_marker_sets(solvers)),
+                  interface.nb_frames, prepare=acquire)
+        for ik_worker in solvers.values():
+            ik_worker.stop()
+    loop.close()
@@ -0,0 +1,97 @@
+"""
+Cost for the acquisition loop of recording the session and of publishing frames on the live bus.
+"""
+import time
+import numpy as np
+import pytest
+
+
+def test_session(benchmark, tmp_path, hours, rate, nb_markers=33, nb_q=18, speed_up=100, batch=100):
+    """
+    Sustained session recording, replayed speed_up times faster than real time: cost of staging a frame in the
+    acquisition loop, with the frames dropped, the disk throughput and the time to map the session back.
+    """
+    from session_recorder import SessionRecorder, open_session
+
+    n_frames = int(hours * 3600 * rate)
+    rng = np.random.default_rng(0)
+    markers = rng.normal(0, 1, (3, nb_markers))
+    q = rng.normal(0, 1, nb_q)
+    path = tmp_path / 'session'
+    session = SessionRecorder(str(path), nb_markers, nb_q, rate=rate)
+    frame = iter(range(n_frames))
+    tic = time.perf_counter()
+
+    def pace():
+        i = next(frame)
+        if i % batch == 0:
+            time.sleep(max(0., tic + i / (rate * speed_up) - time.perf_counter()))
+        return (i, i * 1e6 / rate, markers, q, q, (0, 0, q[11], q[12])), {}
+
+    benchmark.pedantic(session.record, setup=pace, rounds=n_frames)
+    session.close()
+    duration = time.perf_counter() - tic
+    tic = time.perf_counter()
+    frames, _ = open_session(str(path))
+    frames['q'][:, 11].mean()
+    benchmark.extra_info.update({
+        'frames': n_frames,
+        'dropped frames': session.dropped_frames,
+        'write throughput (MB/s)': n_frames * session.dtype.itemsize / 1e6 / duration,
+        'write batch median (ms)': float(np.median(session.write_time) * 1e3) if session.write_time else None,
+        'map and average (ms)': (time.perf_counter() - tic) * 1e3,
+    })
+    del frames
+
+
+def _bus_reader(name, n_frames, results):
+    from live_bus import LiveBusReader
+
+    with LiveBusReader(name) as reader:
+        received, inconsistent = 0, 0
+        while received + reader.lost_frames < n_frames:
+            records = reader.wait_new(timeout=5)
+            if records.size == 0:
+                break
+            received += records.size
+            # Every field of a frame was written from the frame number, a torn copy would mix two frames
+            inconsistent += int(np.sum(records['q'][:, 0] != records['frame_number']))
+        results.put((received, reader.lost_frames, inconsistent))
+
+
+@pytest.mark.parametrize('n_readers', [0, 1, 3])
+def test_live_bus(benchmark, n_readers, n_frames, rate, nb_markers=33, nb_q=15):
+    """
+    Cost of publishing a frame on the live bus with reader processes attached. Every frame published must reach
+    every reader, lost or received, and none may be torn.
+    """
+    import multiprocessing as mp
+    from live_bus import LiveBus
+
+    benchmark.group = 'live_bus'
+    context = mp.get_context('spawn')
+    markers = np.zeros((3, nb_markers))
+    name = f'bench_live_bus_{n_readers}'
+    frame = iter(range(n_frames))
+
+    def next_frame():
+        i = next(frame)
+        time.sleep(1 / rate)
+        q = np.full(nb_q, float(i))
+        return (i, i, markers, q, q), {}
+
+    with LiveBus(name, nb_markers, nb_q) as bus:
+        results = context.Queue()
+        readers = [context.Process(target=_bus_reader, args=(name, n_frames, results)) for _ in range(n_readers)]
+        for reader in readers:
+            reader.start()
+        # Let the readers attach before publishing
+        time.sleep(2 if n_readers else 0)
+        benchmark.pedantic(bus.publish, setup=next_frame, rounds=n_frames)
+        # A disabled benchmark publishes a single frame
+        published = n_frames if not benchmark.disabled else 1
+        for reader in readers:
+            received, lost, inconsistent = results.get(timeout=10)
+            reader.join()
+            assert received + lost == published
+            assert inconsistent == 0
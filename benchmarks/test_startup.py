@@ -0,0 +1,66 @@
+"""
+Startup cost of the entry points: import time and model loading.
+"""
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+# Loaded on demand only, importing one of them at startup is an import time regression
+LAZY_MODULES = ('tkinter', 'customtkinter', 'bioviz', 'osim_to_biomod', 'qtm_rt', 'ezc3d', 'pandas', 'ik_worker',
+                'live_bus', 'multiprocessing.shared_memory', 'biosiglive', 'matplotlib',
+                'matplotlib.pyplot', 'scipy.signal')
+
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns
+    -------
+    times: list
+        (name, depth, self_us, cumulative_us) of every imported module, in import order.
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                            text=True, check=True, cwd=Path(__file__).resolve().parent.parent).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return times
+
+
+@pytest.mark.parametrize('module', ['IK_realtime'])
+def test_import(benchmark, module, top=10):
+    """
+    Import time of an entry point in a fresh interpreter, with its slowest direct imports. Loading one of the
+    lazy modules at import fails the benchmark.
+    """
+    times = benchmark.pedantic(import_times, args=(module,), rounds=5)
+    # The direct imports of the module are the first level entries after the previous top level import
+    start = max(i for i, entry in enumerate(times[:-1]) if entry[1] == 0) + 1 if len(times) > 1 else 0
+    direct = sorted((entry for entry in times[start:-1] if entry[1] == 1), key=lambda entry: -entry[3])
+    benchmark.extra_info['slowest imports (ms)'] = {name: cumulative_us / 1e3
+                                                    for name, _, _, cumulative_us in direct[:top]}
+    loaded = sorted({entry[0] for entry in times} & set(LAZY_MODULES))
+    assert not loaded, f'{", ".join(loaded)} imported with {module}'
+
+
+@pytest.mark.parametrize('path', ['biorbd.Model', 'model registry'])
+def test_load(benchmark, biomod_path, path):
+    """
+    bioMod parsing time, against the same model served by the session model registry.
+    """
+    brbd = pytest.importorskip('biorbd')
+    from model_cache import get_model, clear_models
+
+    benchmark.group = 'load'
+    if path == 'biorbd.Model':
+        benchmark.pedantic(brbd.Model, args=(biomod_path,), rounds=10)
+    else:
+        clear_models()
+        # The first call parses the model, every following one is served from the registry
+        benchmark.pedantic(get_model, args=(biomod_path,), rounds=10, warmup_rounds=1)
@@ -0,0 +1,99 @@
+"""
+Reference pose calibration from the IK of static frames.
+"""
+import numpy as np
+
+# Indices in the Wu model, gh_angles.GHAngles.feedback_dofs resolves them by name on the loaded model
+FEEDBACK_DOFS = {'GH_q1': 11, 'GH_q2': 12, 'elbow': 14}
+
+
+class ReferenceCalibration:
+    def __init__(self, nb_q: int, n_frames: int = 100, max_std: float = 1, feedback_dofs: dict = None,
+                 dof_names: list = None):
+        """
+        Average q over n_frames static frames and check the participant did not move.
+
+        Parameters
+        ----------
+        nb_q: int
+            Number of generalized coordinates.
+        n_frames: int
+            Number of solved frames averaged.
+        max_std: float
+            Maximum standard deviation (degrees) of the feedback degrees of freedom to accept the reference.
+        feedback_dofs: dict
+            Name and index of the degrees of freedom the feedback is computed from.
+        dof_names: list
+            Names of the degrees of freedom (biorbd nameDof) for the report, the translations (Trans) are
+            reported in millimeters.
+        """
+        self.n_frames = n_frames
+        self.max_std = max_std
+        self.feedback_dofs = feedback_dofs if feedback_dofs else FEEDBACK_DOFS
+        self.dof_names = dof_names if dof_names else [f'q[{dof}]' for dof in range(nb_q)]
+        self.q = np.zeros((nb_q, n_frames))
+        self.count = 0
+
+    @property
+    def is_complete(self):
+        return self.count >= self.n_frames
+
+    def reset(self):
+        self.count = 0
+
+    def add(self, q: np.ndarray):
+        if not self.is_complete:
+            self.q[:, self.count] = q
+            self.count += 1
+
+    def result(self):
+        """
+        Reference pose of the collected frames.
+
+        Returns
+        -------
+        reference: dict
+            'q' mean pose (n_q,), 'std' standard deviation of each degree of freedom (degrees), the reference
+            value of each feedback degree of freedom and 'is_static' if they all move less than max_std.
+        """
+        q = self.q[:, :self.count]
+        reference = {'q': q.mean(axis=1), 'std': np.rad2deg(q.std(axis=1))}
+        for name, dof in self.feedback_dofs.items():
+            reference[name] = reference['q'][dof]
+        feedback_std = reference['std'][list(self.feedback_dofs.values())]
+        reference['is_static'] = bool(feedback_std.max() < self.max_std)
+        return reference
+
+    def report(self, reference: dict):
+        """
+        Print the mean and standard deviation of every degree of freedom, the rotations above max_std flagged.
+        """
+        print(f'Reference over {self.count} frames (mean +/- std, deg or mm):')
+        feedback_names = {dof: name for name, dof in self.feedback_dofs.items()}
+        std = self.q[:, :self.count].std(axis=1)
+        for dof, dof_name in enumerate(self.dof_names):
+            label = f'{dof_name} ({feedback_names[dof]})' if dof in feedback_names else dof_name
+            if 'Trans' in dof_name:
+                print(f'  {label:<48} {reference["q"][dof] * 1e3:8.1f} +/- {std[dof] * 1e3:.2f} mm')
+                continue
+            flag = ' > max std' if reference['std'][dof] > self.max_std else ''
+            print(f'  {label:<48} {np.rad2deg(reference["q"][dof]):8.1f} +/- {reference["std"][dof]:.2f} deg{flag}')
+
+
+def _show_pose(biomod_path, q):
+    import bioviz
+
+    biorbd_viz = bioviz.Viz(biomod_path)
+    biorbd_viz.load_movement(np.repeat(q[:, np.newaxis], 2, axis=1))
+    biorbd_viz.exec()
+
+
+def preview_pose(biomod_path: str, q: np.ndarray):
+    """
+    Show a pose in bioviz from another process, the experiment keeps running while the window is open.
+    """
+    import multiprocessing as mp
+
+    process = mp.get_context('spawn').Process(target=_show_pose, args=(biomod_path, q), daemon=True)
+    process.start()
+    return process
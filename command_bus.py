@@ -0,0 +1,94 @@
+"""
+Asyncio command bus between the GUI (or the terminal) and the experiment coroutines.
+"""
+import time
+import threading
+import asyncio as aio
+from enum import Enum
+
+
+class Command(Enum):
+    SET_REFERENCE = 'set_reference'
+    ACCEPT = 'accept'
+    STOP = 'stop'
+
+
+# Terminal inputs, an empty line (Enter) asks for a new reference as before
+COMMAND_ALIASES = {
+    '': Command.SET_REFERENCE,
+    'ref': Command.SET_REFERENCE,
+    'ok': Command.ACCEPT,
+    'stop': Command.STOP,
+    'q': Command.STOP,
+}
+
+
+class CommandBus:
+    def __init__(self, loop=None):
+        """
+        Typed commands posted by the GUI or the terminal and awaited by the experiment, alongside the frames.
+
+        Parameters
+        ----------
+        loop: asyncio.AbstractEventLoop
+            Loop of the experiment, needed only to post from another thread.
+        """
+        self.loop = loop
+        self.history = []
+        self._queue = aio.Queue()
+
+    def post(self, command: Command):
+        """
+        Post a command from the loop thread (e.g. a Tk callback pumped by the loop).
+        """
+        self.history.append((time.perf_counter_ns(), command))
+        self._queue.put_nowait(command)
+
+    def post_threadsafe(self, command: Command):
+        self.loop.call_soon_threadsafe(self.post, command)
+
+    def poll(self):
+        """
+        Next pending command, None if there is none. Never waits.
+        """
+        try:
+            return self._queue.get_nowait()
+        except aio.QueueEmpty:
+            return None
+
+    async def get(self):
+        return await self._queue.get()
+
+    async def wait_for(self, *commands: Command):
+        """
+        Wait for one of the given commands, the other ones are discarded.
+        """
+        while True:
+            command = await self._queue.get()
+            if command in commands:
+                return command
+
+    def clear(self):
+        while self.poll() is not None:
+            pass
+
+
+class TerminalCommands:
+    def __init__(self, bus: CommandBus):
+        """
+        Read commands typed in the terminal (see COMMAND_ALIASES) in a daemon thread and post them on the bus.
+        """
+        self.bus = bus
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def listen(self):
+        while True:
+            try:
+                line = input().strip().lower()
+            except EOFError:
+                return
+            if line not in COMMAND_ALIASES:
+                print(f'Unknown command {line!r}, expected one of {list(COMMAND_ALIASES)}')
+                continue
+            self.bus.post_threadsafe(COMMAND_ALIASES[line])
@@ -0,0 +1,199 @@
+"""
+Local fake of the QTM real-time server, to run the acquisition offline.
+It speaks the little endian QTM RT protocol used by qtm_rt, serves a 3D marker parameters XML, answers
+getcurrentframe and streams frames at the requested rate.
+
+    python fake_qtm.py --biomod Wu_Shoulder_Model.bioMod --markers trial.npy
+"""
+import argparse
+import re
+import struct
+import time
+import asyncio as aio
+import numpy as np
+
+from qtm_rt.packet import QRTPacketType, QRTComponentType, QRTEvent
+
+
+def read_biomod_marker_names(biomod_path):
+    """
+    Read the marker names of a bioMod without loading it, commented markers are skipped.
+    """
+    with open(biomod_path) as file:
+        return re.findall(r'^\s*marker\s+(\S+)', file.read(), flags=re.MULTILINE)
+
+
+def _packet(packet_type, payload):
+    return struct.pack('<II', 8 + len(payload), packet_type.value) + payload
+
+
+def _string_packet(packet_type, text):
+    return _packet(packet_type, text.encode() + b'\0')
+
+
+def _event_packet(event):
+    return _packet(QRTPacketType.PacketEvent, bytes([event.value]))
+
+
+def _parameters_xml(labels):
+    names = ''.join(f'<Label><Name>{name}</Name><RGBColor>0</RGBColor></Label>' for name in labels)
+    return (f'<QTM_Parameters_Ver_1.25><The_3D><AxisUpwards>+Z</AxisUpwards>'
+            f'<Labels>{len(labels)}</Labels>{names}</The_3D></QTM_Parameters_Ver_1.25>')
+
+
+def data_packet(markers, frame_number, timestamp, residuals=None):
+    """
+    Build a QTM data packet holding a single 3D component, or 3D residual component if residuals are given.
+
+    Parameters
+    ----------
+    markers: np.ndarray
+        Markers positions (3, n_markers) in millimeters, NaN for occluded markers.
+    frame_number: int
+        QTM frame number.
+    timestamp: int
+        QTM timestamp in microseconds.
+    residuals: np.ndarray
+        Residual of each marker (n_markers,) in millimeters.
+    """
+    if residuals is None:
+        component_type, values = QRTComponentType.Component3d, markers.T
+    else:
+        component_type, values = QRTComponentType.Component3dRes, np.vstack((markers, residuals)).T
+    component = struct.pack('<Ihh', markers.shape[1], 0, 0) + values.astype('<f4').tobytes()
+    component = struct.pack('<II', 8 + len(component), component_type.value) + component
+    return _packet(QRTPacketType.PacketData, struct.pack('<qII', timestamp, frame_number, 1) + component)
+
+
+class FakeQTMServer:
+    def __init__(self, markers: np.ndarray, labels: list, rate: float = 100, ip: str = "127.0.0.1",
+                 port: int = 22223, drop_every: int = None, duplicate_every: int = None):
+        """
+        Fake QTM RT server replaying a marker trial in loop.
+
+        Parameters
+        ----------
+        markers: np.ndarray
+            Markers positions (3, n_markers, n_frames) in meters, in the order of the labels.
+        labels: list
+            Marker labels as they would be defined in the QTM project.
+        rate: float
+            Capture rate of the fake system.
+        ip: str
+            Address to listen on.
+        port: int
+            Port to listen on, 22223 is the QTM little endian port.
+        drop_every: int
+            Do not send one streamed frame out of drop_every, to emulate network losses.
+        duplicate_every: int
+            Send one streamed frame out of duplicate_every twice.
+        """
+        if markers.shape[1] != len(labels):
+            raise ValueError("The number of labels and the number of markers are not the same.")
+        self.markers = markers * 1e3
+        self.labels = labels
+        self.rate = rate
+        self.ip = ip
+        self.port = port
+        self.drop_every = drop_every
+        self.duplicate_every = duplicate_every
+        self.rt_started = False
+        self.server = None
+        self._t0 = time.perf_counter()
+
+    async def start(self):
+        self.server = await aio.start_server(self._handle_client, self.ip, self.port)
+        print(f'Fake QTM listening on {self.ip}:{self.port}')
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def current_frame_number(self):
+        return int((time.perf_counter() - self._t0) * self.rate) + 1
+
+    def frame_packet(self, frame_number, residuals=False):
+        markers = self.markers[:, :, (frame_number - 1) % self.markers.shape[2]]
+        # Constant residual of the seen markers, NaN for the occluded ones as in QTM
+        marker_residuals = np.where(np.isfinite(markers).all(axis=0), 0.5, np.nan) if residuals else None
+        return data_packet(markers, frame_number, int((frame_number - 1) * 1e6 / self.rate), marker_residuals)
+
+    async def _stream(self, writer, residuals=False):
+        frame_number = self.current_frame_number()
+        deadline = time.perf_counter()
+        while True:
+            if not (self.drop_every and frame_number % self.drop_every == 0):
+                writer.write(self.frame_packet(frame_number, residuals))
+                if self.duplicate_every and frame_number % self.duplicate_every == 0:
+                    writer.write(self.frame_packet(frame_number, residuals))
+                await writer.drain()
+            frame_number += 1
+            deadline += 1 / self.rate
+            await aio.sleep(max(0., deadline - time.perf_counter()))
+
+    async def _handle_client(self, reader, writer):
+        stream_task = None
+        writer.write(_string_packet(QRTPacketType.PacketCommand, 'QTM RT Interface connected'))
+        try:
+            while True:
+                size, _ = struct.unpack('<II', await reader.readexactly(8))
+                command = (await reader.readexactly(size - 8)).rstrip(b'\0').decode()
+                args = command.lower().split()
+                if args[0] == 'version':
+                    writer.write(_string_packet(QRTPacketType.PacketCommand, f'Version set to {args[1]}'))
+                elif args[0] == 'getstate':
+                    event = QRTEvent.EventRTfromFileStarted if self.rt_started else QRTEvent.EventConnected
+                    writer.write(_event_packet(event))
+                elif args[0] == 'takecontrol':
+                    writer.write(_string_packet(QRTPacketType.PacketCommand, 'You are now master'))
+                elif args[0] in ('start', 'new'):
+                    self.rt_started = True
+                    text = 'Starting RT from file' if 'rtfromfile' in args else 'Starting measurement'
+                    writer.write(_string_packet(QRTPacketType.PacketCommand, text))
+                elif args[0] == 'stop':
+                    self.rt_started = False
+                    writer.write(_string_packet(QRTPacketType.PacketCommand, 'Stopping measurement'))
+                elif args[0] == 'getparameters':
+                    writer.write(_string_packet(QRTPacketType.PacketXML, _parameters_xml(self.labels)))
+                elif args[0] == 'getcurrentframe':
+                    writer.write(self.frame_packet(self.current_frame_number(), '3dres' in args))
+                elif args[0] == 'streamframes' and args[1] == 'stop':
+                    if stream_task:
+                        stream_task.cancel()
+                        stream_task = None
+                elif args[0] == 'streamframes':
+                    stream_task = aio.get_event_loop().create_task(self._stream(writer, '3dres' in args))
+                else:
+                    writer.write(_string_packet(QRTPacketType.PacketError, f'Parse error: {command}'))
+                await writer.drain()
+        except (aio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            if stream_task:
+                stream_task.cancel()
+            writer.close()
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Start a fake QTM real-time server')
+    PARSER.add_argument('--biomod', dest='biomod', default='Wu_Shoulder_Model.bioMod',
+                        help='bioMod used to name the markers')
+    PARSER.add_argument('--markers', dest='markers', default=None,
+                        help='Markers to replay (.npy, 3 x n_markers x n_frames, meters, bioMod order)')
+    PARSER.add_argument('--rate', dest='rate', type=float, default=100)
+    PARSER.add_argument('--port', dest='port', type=int, default=22223)
+    PARSER.add_argument('--drop-every', dest='drop_every', type=int, default=None)
+    ARGS = PARSER.parse_args()
+    marker_labels = read_biomod_marker_names(ARGS.biomod)
+    if ARGS.markers:
+        trial = np.load(ARGS.markers)
+    else:
+        trial = np.random.default_rng(0).normal(0, 0.001, (3, len(marker_labels), 1000))
+    aio.run(FakeQTMServer(trial, marker_labels, rate=ARGS.rate, port=ARGS.port,
+                          drop_every=ARGS.drop_every).serve_forever())
@@ -0,0 +1,295 @@
+"""
+Feedback rendering decoupled from the acquisition loop.
+The acquisition posts its latest result in a single slot mailbox and never waits on the GUI, the renderer
+redraws only the feedback artist with blitting at a capped display rate.
+
+Every feedback sink (the matplotlib window, a UDP/OSC socket, or nothing) receives the same FEEDBACK_DTYPE record
+of the GH angles relative to the reference pose.
+"""
+import time
+import socket
+import struct
+from functools import partial
+import numpy as np
+
+from pacing import DeadlinePacer
+
+FEEDBACK_DTYPE = np.dtype([
+    ('frame_number', np.int64),
+    ('timestamp', np.int64),
+    ('gh', np.float64, (3,)),
+])
+# Binary UDP packet of a feedback record: little endian frame number, timestamp (us) and GH angles (rad)
+FEEDBACK_PACKET = struct.Struct('<qq3d')
+
+
+def gh_feedback(gh, frame_number=0, timestamp=0, out=None):
+    """
+    FEEDBACK_DTYPE record of the GH angles relative to the reference pose (see gh_angles.GHAngles.relative),
+    written in out if given.
+    """
+    if out is None:
+        out = np.zeros((), dtype=FEEDBACK_DTYPE)
+    out['frame_number'] = frame_number
+    out['timestamp'] = timestamp
+    out['gh'] = gh
+    return out
+
+
+def ellipse_parameters(gh, center=(0, 0), rx=1, ry=1):
+    """
+    Feedback ellipse (center x, center y, width, height) from the GH angles relative to the reference.
+    """
+    return center[0], center[1], gh[0] * rx, gh[1] * ry
+
+
+def update_ellipse(cE, feedback, center=(0, 0), rx=1, ry=1, ax=None):
+    """
+    Update the feedback ellipse from a FEEDBACK_DTYPE record.
+    """
+    center_x, center_y, width, height = ellipse_parameters(feedback['gh'], center, rx, ry)
+    cE.set_center((center_x, center_y))
+    cE.set_width(width=width)
+    cE.set_height(height=height)
+
+
+class Mailbox:
+    def __init__(self):
+        """
+        Single slot mailbox, a new value replaces the one not taken yet.
+        """
+        self.value = None
+        self.has_value = False
+        self.overwritten = 0
+
+    def put(self, value):
+        if self.has_value:
+            self.overwritten += 1
+        self.value = value
+        self.has_value = True
+
+    def take(self):
+        """
+        Take the latest value, None if nothing was posted since the last take.
+        """
+        if not self.has_value:
+            return None
+        self.has_value = False
+        return self.value
+
+
+class FeedbackSink:
+    """
+    Destination of the feedback records. post never blocks the acquisition, run is started as a task next to it.
+    """
+    def post(self, feedback, row: int = None):
+        raise NotImplementedError
+
+    async def run(self):
+        pass
+
+    def report(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullSink(FeedbackSink):
+    def __init__(self):
+        """
+        Discard the feedback, to run or benchmark the pipeline without any display.
+        """
+        self.count = 0
+
+    def post(self, feedback, row: int = None):
+        self.count += 1
+
+    def report(self):
+        print(f'Null feedback sink: {self.count} records discarded')
+
+
+class UdpSink(FeedbackSink):
+    def __init__(self, host: str = '127.0.0.1', port: int = 9000, osc: bool = False,
+                 osc_address: str = '/shoulder/gh'):
+        """
+        Send each feedback record in a UDP datagram, e.g. to an external display or a game engine.
+
+        Parameters
+        ----------
+        host, port:
+            Address of the receiver.
+        osc: bool
+            Send OSC messages (osc_address ,ifff: frame number and GH angles in degrees) instead of
+            FEEDBACK_PACKET.
+        osc_address: str
+            OSC address pattern of the messages.
+        """
+        self.address = (host, port)
+        self.osc = osc
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        if osc:
+            address = osc_address.encode() + b'\0'
+            type_tags = b',ifff\0'
+            self._osc_header = address + b'\0' * (-len(address) % 4) + type_tags + b'\0' * (-len(type_tags) % 4)
+            self._osc_values = struct.Struct('>i3f')
+        self.sent = 0
+        self.dropped = 0
+
+    def encode(self, feedback):
+        if self.osc:
+            return self._osc_header + self._osc_values.pack(int(feedback['frame_number']) & 0x7fffffff,
+                                                            *np.rad2deg(feedback['gh']))
+        return FEEDBACK_PACKET.pack(int(feedback['frame_number']), int(feedback['timestamp']), *feedback['gh'])
+
+    def post(self, feedback, row: int = None):
+        try:
+            self.socket.sendto(self.encode(feedback), self.address)
+            self.sent += 1
+        except (BlockingIOError, ConnectionRefusedError):
+            self.dropped += 1
+
+    def report(self):
+        print(f'UDP feedback sink {self.address[0]}:{self.address[1]}{" (OSC)" if self.osc else ""}: '
+              f'{self.sent} records sent, {self.dropped} dropped')
+
+    def close(self):
+        self.socket.close()
+
+
+class FeedbackRenderer(FeedbackSink):
+    def __init__(self, fig, axes, artist, update_artist: callable, max_fps: float = 60, recorder=None):
+        """
+        Blit a single artist from the latest posted value.
+
+        Parameters
+        ----------
+        fig: matplotlib.figure.Figure
+            Figure of the feedback window.
+        axes: matplotlib.axes.Axes
+            Axes holding the artist.
+        artist: matplotlib.artist.Artist
+            Artist to update, e.g. the feedback ellipse.
+        update_artist: callable
+            Called as update_artist(artist, value) before the artist is redrawn.
+        max_fps: float
+            Maximum display rate.
+        recorder: LatencyRecorder
+            If given, the artist update and the draw are traced in the row the value was posted with.
+        """
+        self.fig = fig
+        self.axes = axes
+        self.artist = artist
+        self.update_artist = update_artist
+        self.pacer = DeadlinePacer(max_fps)
+        self.mailbox = Mailbox()
+        self.render_time = []
+        self.recorder = recorder
+        self.background = None
+        artist.set_animated(True)
+        if artist.axes is None:
+            axes.add_patch(artist)
+        self._draw_cid = fig.canvas.mpl_connect('draw_event', self._on_draw)
+        fig.canvas.draw()
+        fig.canvas.flush_events()
+
+    def _on_draw(self, event):
+        # The background is cached again whenever matplotlib does a full redraw (e.g. window resize)
+        self.background = self.fig.canvas.copy_from_bbox(self.axes.bbox)
+        self.axes.draw_artist(self.artist)
+
+    @property
+    def dropped_renders(self):
+        return self.mailbox.overwritten
+
+    def post(self, value, row: int = None):
+        """
+        Post the latest value to display, never blocks.
+
+        Parameters
+        ----------
+        value:
+            Value given to update_artist.
+        row: int
+            Latency recorder row of the frame the value comes from.
+        """
+        self.mailbox.put((value, row))
+
+    def render(self, value, row: int = None):
+        tic = time.perf_counter()
+        canvas = self.fig.canvas
+        tic_ns = time.perf_counter_ns()
+        self.update_artist(self.artist, value)
+        if self.recorder is not None and row is not None:
+            self.recorder.record('ellipse_update', tic_ns, time.perf_counter_ns(), row)
+            tic_ns = time.perf_counter_ns()
+        if self.background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self.axes.draw_artist(self.artist)
+            canvas.blit(self.axes.bbox)
+        canvas.flush_events()
+        if self.recorder is not None and row is not None:
+            self.recorder.record('draw', tic_ns, time.perf_counter_ns(), row)
+        self.render_time.append(time.perf_counter() - tic)
+
+    async def run(self):
+        """
+        Render the latest posted value at most at max_fps, to run as a task next to the acquisition.
+        """
+        while True:
+            await self.pacer.wait()
+            posted = self.mailbox.take()
+            if posted is not None:
+                self.render(*posted)
+
+    def report(self):
+        """
+        Print the render time statistics and the number of posted values never displayed.
+        """
+        if not self.render_time:
+            print('No feedback rendered')
+            return
+        render_time = np.array(self.render_time) * 1e3
+        print(f'Feedback rendered {render_time.size} times: '
+              f'mean {render_time.mean():.2f} ms, p95 {np.percentile(render_time, 95):.2f} ms, '
+              f'max {render_time.max():.2f} ms, dropped renders {self.dropped_renders}')
+        self.pacer.report('Feedback renderer')
+
+    def close(self):
+        self.fig.canvas.mpl_disconnect(self._draw_cid)
+
+
+def ellipse_renderer(fig=None, axes=None, max_fps: float = 60, recorder=None, center=(0, 0), rx=1, ry=1):
+    """
+    Matplotlib feedback sink drawing the GH angles as an ellipse, in a new figure if none is given.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Ellipse
+
+    plt.ion()
+    if axes is None:
+        fig, axes = plt.subplots(1, 1)
+        axes.set_xlim(-10, 10)
+        axes.set_ylim(-10, 10)
+        plt.show()
+    ellipse = Ellipse(center, width=3, height=3, facecolor='b', edgecolor='none', alpha=0.3)
+    return FeedbackRenderer(fig, axes, ellipse, partial(update_ellipse, center=center, rx=rx, ry=ry),
+                            max_fps=max_fps, recorder=recorder)
+
+
+def make_sink(spec: str, recorder=None):
+    """
+    Feedback sink from its command line description: 'mpl', 'null', 'udp:host:port' or 'osc:host:port'.
+    """
+    kind, _, address = spec.partition(':')
+    if kind == 'mpl':
+        return ellipse_renderer(recorder=recorder)
+    if kind == 'null':
+        return NullSink()
+    if kind in ('udp', 'osc'):
+        host, _, port = address.rpartition(':')
+        return UdpSink(host if host else '127.0.0.1', int(port) if port else 9000, osc=kind == 'osc')
+    raise ValueError(f"Unknown feedback sink {spec!r}, expected mpl, null, udp:host:port or osc:host:port.")
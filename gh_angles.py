@@ -0,0 +1,180 @@
+"""
+Glenohumeral angles of the feedback, from degrees of freedom and segments resolved by name once on the loaded model.
+"""
+import numpy as np
+
+from ik_solvers import get_dof_offsets
+
+# Degrees of freedom of the Wu shoulder model, named by the segment they rotate
+GH_DOF_NAMES = {
+    'plane': 'humerus_shoulder_plane',
+    'elevation': 'humerus_shoulder_ele',
+    'axial_rotation': 'humerus_shoulder_rotation',
+}
+ELBOW_DOF_NAME = 'ulna_elbow_flexion'
+AXES = 'xyz'
+
+
+def dof_index(model, name: str):
+    """
+    Index in q of a degree of freedom, from its biorbd name (e.g. humerus_shoulder_plane_RotX) or from the name of
+    a segment with a single degree of freedom (e.g. humerus_shoulder_plane).
+    """
+    dof_names = [dof.to_string() for dof in model.nameDof()]
+    if name in dof_names:
+        return dof_names.index(name)
+    segment_names = [model.segment(i).name().to_string() for i in range(model.nbSegment())]
+    if name in segment_names:
+        segment_idx = segment_names.index(name)
+        nb_dof = model.segment(segment_idx).nbDof()
+        if nb_dof == 1:
+            return get_dof_offsets(model)[segment_idx]
+        raise ValueError(f"The segment '{name}' has {nb_dof} degrees of freedom, give the name of one of them.")
+    raise ValueError(f"No degree of freedom or segment named '{name}' in the model.")
+
+
+def elementary_rotations(axis: int, angles: np.ndarray):
+    """
+    Rotation matrices (n, 3, 3) of the given angles about the x (0), y (1) or z (2) axis.
+    """
+    angles = np.atleast_1d(angles)
+    cos, sin = np.cos(angles), np.sin(angles)
+    i, j = (axis + 1) % 3, (axis + 2) % 3
+    rotations = np.zeros((angles.size, 3, 3))
+    rotations[:, axis, axis] = 1
+    rotations[:, i, i] = cos
+    rotations[:, j, j] = cos
+    rotations[:, i, j] = -sin
+    rotations[:, j, i] = sin
+    return rotations
+
+
+def euler_angles(rotations: np.ndarray, sequence: str):
+    """
+    Angles of an intrinsic sequence of rotation matrices, vectorized over frames.
+
+    Parameters
+    ----------
+    rotations: np.ndarray
+        Rotation matrices (n, 3, 3).
+    sequence: str
+        Intrinsic (body-fixed) sequence, Euler (e.g. 'yxy', ISB humerus) or Cardan (e.g. 'xyz', 'zxy').
+
+    Returns
+    -------
+    angles: np.ndarray
+        Angles (n, 3) in radians, in the order of the sequence. The second angle is in [0, pi] for Euler sequences
+        and in [-pi/2, pi/2] for Cardan sequences.
+    """
+    if len(sequence) != 3 or any(axis not in AXES for axis in sequence.lower()):
+        raise ValueError(f"'{sequence}' is not a sequence of three axes among x, y and z.")
+    i, j, k = (AXES.index(axis) for axis in sequence.lower())
+    if i == j or j == k:
+        raise ValueError(f"Two successive rotations of '{sequence}' are about the same axis.")
+    angles = np.zeros((rotations.shape[0], 3))
+    if i == k:
+        other = 3 - i - j
+        sign = (i - j) * (j - other) * (other - i) / 2
+        angles[:, 0] = np.arctan2(rotations[:, j, i], -sign * rotations[:, other, i])
+        angles[:, 1] = np.arccos(np.clip(rotations[:, i, i], -1, 1))
+        angles[:, 2] = np.arctan2(rotations[:, i, j], sign * rotations[:, i, other])
+    else:
+        sign = (i - j) * (j - k) * (k - i) / 2
+        angles[:, 0] = np.arctan2(-sign * rotations[:, j, k], rotations[:, k, k])
+        angles[:, 1] = np.arcsin(np.clip(sign * rotations[:, i, k], -1, 1))
+        angles[:, 2] = np.arctan2(-sign * rotations[:, i, j], rotations[:, i, i])
+    return angles
+
+
+class GHAngles:
+    def __init__(self, model, convention: str = 'model', proximal: str = 'scapula', distal: str = 'humerus',
+                 dof_names: dict = None, elbow: str = ELBOW_DOF_NAME):
+        """
+        Feedback angles of the GH joint. Degree of freedom indices and the constant rotations of the segments
+        between the scapula and the humerus are resolved once, each frame then costs a few 3x3 products.
+
+        Parameters
+        ----------
+        model: biorbd.Model
+            Loaded biorbd model.
+        convention: str
+            'model' for the plane of elevation, elevation and axial rotation degrees of freedom of the model, or an
+            intrinsic sequence (see euler_angles) of the distal segment orientation in the proximal segment frame,
+            e.g. 'yxy' for the ISB plane of elevation, elevation and axial rotation (singular at zero elevation,
+            where the plane of elevation and the axial rotation cannot be told apart).
+        proximal, distal: str
+            Segments whose relative orientation is decomposed with the convention.
+        dof_names: dict
+            Degree of freedom or segment name of the plane of elevation, elevation and axial rotation (see
+            GH_DOF_NAMES).
+        elbow: str
+            Degree of freedom or segment name of the elbow flexion, checked at the calibration.
+        """
+        dof_names = dof_names if dof_names else GH_DOF_NAMES
+        self.convention = convention.lower()
+        self.dof_idx = {name: dof_index(model, dof) for name, dof in dof_names.items()}
+        self.feedback_dofs = {'GH_q1': self.dof_idx['plane'], 'GH_q2': self.dof_idx['elevation']}
+        if elbow:
+            self.feedback_dofs['elbow'] = dof_index(model, elbow)
+        self._model_idx = np.array([self.dof_idx[name] for name in ('plane', 'elevation', 'axial_rotation')])
+        self._steps, self._last_rotation = [], np.eye(3)
+        if self.convention != 'model':
+            euler_angles(np.eye(3)[np.newaxis], self.convention)
+            self._steps, self._last_rotation = self._rotation_chain(model, proximal, distal)
+
+    @staticmethod
+    def _rotation_chain(model, proximal, distal):
+        """
+        Rotation of distal in proximal as C0 R(q_a) C1 R(q_b) ... Cn, the constant rotations C of the segment
+        frames being folded between the rotational degrees of freedom.
+        """
+        segment_names = [model.segment(i).name().to_string() for i in range(model.nbSegment())]
+        offsets = get_dof_offsets(model)
+        proximal_idx = segment_names.index(proximal)
+        chain, segment_idx = [], segment_names.index(distal)
+        while segment_idx != proximal_idx:
+            chain.append(segment_idx)
+            parent = model.segment(segment_idx).parent().to_string()
+            if parent not in segment_names:
+                raise ValueError(f"The segment '{proximal}' is not a parent of '{distal}'.")
+            segment_idx = segment_names.index(parent)
+        steps, rotation = [], np.eye(3)
+        for segment_idx in reversed(chain):
+            segment = model.segment(segment_idx)
+            rotation = rotation @ segment.localJCS().to_array()[:3, :3]
+            # biorbd stores the translations of a segment before its rotations
+            first_rotation = offsets[segment_idx] + segment.nbDofTrans()
+            for i, axis in enumerate(segment.seqR().to_string().lower()):
+                steps.append((rotation, AXES.index(axis), first_rotation + i))
+                rotation = np.eye(3)
+        return steps, rotation
+
+    def rotation(self, q: np.ndarray):
+        """
+        Rotation matrices (n, 3, 3) of the distal segment in the proximal segment, q being (n_q,) or (n_q, n).
+        """
+        q = np.asarray(q).reshape(np.shape(q)[0], -1)
+        rotations = np.broadcast_to(np.eye(3), (q.shape[1], 3, 3))
+        for constant, axis, dof in self._steps:
+            rotations = rotations @ constant @ elementary_rotations(axis, q[dof])
+        return rotations @ self._last_rotation
+
+    def __call__(self, q: np.ndarray):
+        """
+        Angles (3,) of a pose q (n_q,), or (3, n) of q (n_q, n), in radians.
+        """
+        q = np.asarray(q)
+        if self.convention == 'model':
+            return q[self._model_idx]
+        angles = euler_angles(self.rotation(q), self.convention).T
+        return angles[:, 0] if q.ndim == 1 else angles
+
+    def relative(self, q: np.ndarray, reference: np.ndarray):
+        """
+        Angles of q relative to the reference angles, wrapped to [-pi, pi] for the sequences.
+        """
+        q = np.asarray(q)
+        angles = self(q) - (reference if q.ndim == 1 else np.asarray(reference)[:, np.newaxis])
+        if self.convention == 'model':
+            return angles
+        return (angles + np.pi) % (2 * np.pi) - np.pi
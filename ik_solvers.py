@@ -0,0 +1,434 @@
+"""
+Persistent inverse kinematics solvers bound to an already loaded biorbd model.
+"""
+import time
+import numpy as np
+from scipy.optimize import least_squares
+
+
+def get_q_bounds(model):
+    """
+    Get the generalized coordinates ranges declared in the bioMod.
+
+    Parameters
+    ----------
+    model: biorbd.Model
+        Loaded biorbd model.
+
+    Returns
+    -------
+    bounds: tuple
+        Lower and upper bounds of each degree of freedom.
+    """
+    q_min, q_max = [], []
+    for segment in model.segments():
+        for q_range in segment.QRanges():
+            q_min.append(q_range.min())
+            q_max.append(q_range.max())
+    return np.array(q_min), np.array(q_max)
+
+
+class GapTolerantIK:
+    def __init__(self, model, rate: float = 100, min_markers: int = None, history_size: int = 10,
+                 max_extrapolation: int = 10):
+        """
+        Frame loop shared by the persistent solvers. Occluded (NaN) markers are left out of the solve and,
+        when too few markers are visible, the pose is extrapolated at the velocity of the last solved frames
+        for max_extrapolation frames and then held until enough markers come back.
+
+        Parameters
+        ----------
+        model: biorbd.Model
+            Loaded biorbd model, markers are expected in the model marker order.
+        rate: float
+            Rate of the markers, used to derive qdot.
+        min_markers: int
+            Minimum number of visible markers to solve a frame, enough to constrain every degree of freedom
+            if None.
+        history_size: int
+            Number of solved frames kept to estimate the extrapolation velocity.
+        max_extrapolation: int
+            Maximum number of consecutive extrapolated frames before the pose is held.
+        """
+        from joint_buffer import JointBuffer
+
+        self.model = model
+        self.rate = rate
+        self.nb_q = model.nbQ()
+        self.nb_markers = model.nbMarkers()
+        self.q_bounds = get_q_bounds(model)
+        self.min_markers = min_markers if min_markers else int(np.ceil(self.nb_q / 3))
+        self.max_extrapolation = max_extrapolation
+        self.history = JointBuffer(self.nb_q, size=history_size)
+        self.q = np.zeros(self.nb_q)
+        self.qdot = np.zeros(self.nb_q)
+        self.is_initialized = False
+        self.is_extrapolated = False
+        self.nb_extrapolated = 0
+        self.total_extrapolated = 0
+        self.process_time = []
+        self._extrapolation_velocity = np.zeros(self.nb_q)
+
+    def reset(self, initial_q=None):
+        """
+        Forget the warm-start state and the history, the next frame will be solved from scratch.
+        """
+        self.is_initialized = initial_q is not None
+        self.q = np.zeros(self.nb_q) if initial_q is None else np.array(initial_q, dtype=float)
+        self.q = np.clip(self.q, *self.q_bounds)
+        self.qdot = np.zeros(self.nb_q)
+        self.history.reset()
+        self.is_extrapolated = False
+        self.nb_extrapolated = 0
+
+    def _has_enough_markers(self, valid: np.ndarray):
+        return np.count_nonzero(valid) >= self.min_markers
+
+    def _solve_valid(self, markers: np.ndarray, valid: np.ndarray):
+        """
+        Update self.q from the visible markers only, implemented by each solver.
+        """
+        raise NotImplementedError
+
+    def _velocity(self, q_prev: np.ndarray):
+        return (self.q - q_prev) * self.rate
+
+    def _extrapolate(self):
+        if self.nb_extrapolated == 0:
+            n_samples = min(self.history.count, self.history.size)
+            if n_samples < 2:
+                self._extrapolation_velocity[:] = 0
+            else:
+                window = self.history.window(n_samples=n_samples)
+                self._extrapolation_velocity[:] = (window[:, -1] - window[:, 0]) * self.rate / (n_samples - 1)
+        if self.nb_extrapolated < self.max_extrapolation:
+            self.qdot = self._extrapolation_velocity.copy()
+            self.q = np.clip(self.q + self.qdot / self.rate, *self.q_bounds)
+        else:
+            self.qdot = np.zeros(self.nb_q)
+        self.nb_extrapolated += 1
+        self.total_extrapolated += 1
+
+    def solve_frame(self, markers: np.ndarray, valid: np.ndarray = None):
+        """
+        Solve a single frame.
+
+        Parameters
+        ----------
+        markers: np.ndarray
+            Markers positions (3, n_markers) in meters, NaN for occluded markers.
+        valid: np.ndarray
+            Boolean visibility of each marker (n_markers,), derived from the NaN if None.
+
+        Returns
+        -------
+        q, qdot: tuple
+            Generalized coordinates and velocities (n_q,).
+        """
+        if valid is None:
+            valid = np.isfinite(markers).all(axis=0)
+        self.is_extrapolated = not self._has_enough_markers(valid)
+        if self.is_extrapolated:
+            # Nothing to extrapolate from before the first solved frame, q stays at its initial value
+            if self.is_initialized:
+                self._extrapolate()
+            return self.q, self.qdot
+        q_prev = self.q.copy()
+        was_initialized = self.is_initialized
+        self._solve_valid(markers, valid)
+        if was_initialized:
+            self.qdot = self._velocity(q_prev)
+        self.history.append(self.q)
+        self.nb_extrapolated = 0
+        self.is_initialized = True
+        return self.q, self.qdot
+
+    def solve(self, markers: np.ndarray, valid: np.ndarray = None):
+        """
+        Solve every frame of a marker window in sequence.
+
+        Parameters
+        ----------
+        markers: np.ndarray
+            Markers positions (3, n_markers, n_frames) or (3, n_markers) in meters.
+        valid: np.ndarray
+            Boolean visibility of the markers (n_markers, n_frames) or (n_markers,), derived from the NaN if None.
+
+        Returns
+        -------
+        q, qdot: tuple
+            Generalized coordinates and velocities (n_q, n_frames), same layout as biosiglive.
+        """
+        tic = time.perf_counter()
+        if markers.ndim == 2:
+            markers = markers[:, :, np.newaxis]
+        if valid is not None and valid.ndim == 1:
+            valid = np.broadcast_to(valid[:, np.newaxis], markers.shape[1:])
+        q = np.zeros((self.nb_q, markers.shape[2]))
+        qdot = np.zeros((self.nb_q, markers.shape[2]))
+        for i in range(markers.shape[2]):
+            q[:, i], qdot[:, i] = self.solve_frame(markers[:, :, i], None if valid is None else valid[:, i])
+        self.process_time.append(time.perf_counter() - tic)
+        return q, qdot
+
+
+class LeastSquaresIK(GapTolerantIK):
+    def __init__(self, model, rate: float = 100, initial_q=None, max_nfev: int = None, **gap_options):
+        """
+        Least square inverse kinematics kept alive for the whole session.
+        The model is never reloaded and each frame is warm-started from the previous solution, so only
+        the very first frame is solved from scratch. Every frame is solved within the bioMod ranges, as
+        biorbd.InverseKinematics does.
+        The rows of the occluded markers are dropped from the residual and the Jacobian.
+
+        Parameters
+        ----------
+        model: biorbd.Model
+            Loaded biorbd model, markers are expected in the model marker order.
+        rate: float
+            Rate of the markers, used to derive qdot.
+        initial_q: np.ndarray
+            Optional first guess, e.g. a reference posture.
+        max_nfev: int
+            Maximum number of function evaluations per frame once warm-started.
+        **gap_options
+            min_markers, history_size and max_extrapolation, see GapTolerantIK.
+        """
+        super().__init__(model, rate, **gap_options)
+        self.max_nfev = max_nfev
+        self.reset(initial_q)
+        self._target = np.zeros(3 * self.nb_markers)
+        self._marker_rows = np.arange(3 * self.nb_markers).reshape(self.nb_markers, 3)
+        self._rows = self._marker_rows.ravel()
+
+    def _marker_diff(self, q):
+        markers = np.concatenate([mark.to_array() for mark in self.model.markers(q)])
+        return markers[self._rows] - self._target[self._rows]
+
+    def _marker_jacobian(self, q):
+        return np.vstack([jac.to_array() for jac in self.model.markersJacobian(q)])[self._rows]
+
+    def _solve_valid(self, markers: np.ndarray, valid: np.ndarray):
+        self._target[:] = markers.T.reshape(-1)
+        self._rows = self._marker_rows[valid].ravel()
+        # Bounded on every frame, a warm start only limits the number of evaluations
+        sol = least_squares(self._marker_diff, self.q, jac=self._marker_jacobian, bounds=self.q_bounds,
+                            method='trf', max_nfev=self.max_nfev if self.is_initialized else None)
+        self.q = sol.x
+
+
+def kabsch(local_points: np.ndarray, global_points: np.ndarray):
+    """
+    Rigid transformation best mapping local points onto global points (Kabsch / SVD).
+
+    Parameters
+    ----------
+    local_points: np.ndarray
+        Points in the segment frame (3, n_points).
+    global_points: np.ndarray
+        Measured points (3, n_points).
+
+    Returns
+    -------
+    rotation, translation: tuple
+        (3, 3) rotation and (3,) translation such that global = rotation @ local + translation.
+    """
+    local_mean = local_points.mean(axis=1, keepdims=True)
+    global_mean = global_points.mean(axis=1, keepdims=True)
+    u, _, vt = np.linalg.svd((global_points - global_mean) @ (local_points - local_mean).T)
+    correction = np.diag([1, 1, np.sign(np.linalg.det(u @ vt))])
+    rotation = u @ correction @ vt
+    return rotation, (global_mean - rotation @ local_mean)[:, 0]
+
+
+def get_dof_offsets(model):
+    """
+    First generalized coordinate index of each segment, segments being stored in q order.
+    """
+    offsets, offset = [], 0
+    for i in range(model.nbSegment()):
+        offsets.append(offset)
+        offset += model.segment(i).nbDof()
+    return offsets
+
+
+class ShoulderChainIK(GapTolerantIK):
+    def __init__(self, model, rate: float = 100, root_segment: str = 'thorax',
+                 root_markers: tuple = ('STER', 'XIPH', 'C7', 'T10'), max_iter: int = 5, damping: float = 1e-4,
+                 tol: float = 1e-6, **gap_options):
+        """
+        Reduced inverse kinematics: the root (thorax) pose comes from a rigid fit of its markers and only the
+        degrees of freedom driven by the other markers (clavicle, scapula, humerus, forearm) are solved,
+        with damped Gauss-Newton steps on the biorbd marker Jacobians and a fixed iteration cap.
+
+        Parameters
+        ----------
+        model: biorbd.Model
+            Loaded biorbd model, markers are expected in the model marker order.
+        rate: float
+            Rate of the markers, used to derive qdot.
+        root_segment: str
+            Name of the root segment, attached to ground, whose six degrees of freedom are fitted rigidly.
+        root_markers: tuple
+            Markers of the root segment used for the rigid fit.
+        max_iter: int
+            Maximum number of Gauss-Newton iterations per frame.
+        damping: float
+            Levenberg damping added to the normal equations.
+        tol: float
+            Norm of the step under which the iterations stop.
+        **gap_options
+            min_markers, history_size and max_extrapolation, see GapTolerantIK. Occluded chain markers are
+            dropped from the Gauss-Newton rows and the root pose is kept when less than 3 of its markers are
+            visible.
+        """
+        from scipy.spatial.transform import Rotation
+
+        super().__init__(model, rate, **gap_options)
+        self._rotation = Rotation
+        self.max_iter = max_iter
+        self.damping = damping
+        self.tol = tol
+
+        segment_names = [model.segment(i).name().to_string() for i in range(model.nbSegment())]
+        offsets = get_dof_offsets(model)
+        root_idx = segment_names.index(root_segment)
+        root = model.segment(root_idx)
+        if root.nbDofTrans() != 3 or root.nbDofRot() != 3:
+            raise ValueError(f"The root segment '{root_segment}' must have 3 translations and 3 rotations.")
+        # biorbd stores the translations of a segment before its rotations
+        self.root_trans_idx = np.arange(offsets[root_idx], offsets[root_idx] + 3)
+        self.root_rot_idx = np.arange(offsets[root_idx] + 3, offsets[root_idx] + 6)
+        self.root_seq = root.seqR().to_string().upper()
+        root_jcs = root.localJCS().to_array()
+        self.root_parent_rot = root_jcs[:3, :3]
+        self.root_parent_trans = root_jcs[:3, 3]
+
+        marker_names = [name.to_string() for name in model.markerNames()]
+        self.root_marker_idx = np.array([marker_names.index(name) for name in root_markers])
+        self.root_markers_local = np.array([model.marker(i).to_array() for i in self.root_marker_idx]).T
+        self.chain_marker_idx = np.array([i for i in range(len(marker_names))
+                                          if model.marker(i).parentId() != root_idx])
+
+        # Degrees of freedom of every segment between the chain markers and the root
+        driven_segments = set()
+        for i in self.chain_marker_idx:
+            segment_idx = model.marker(i).parentId()
+            while segment_idx != root_idx and segment_idx not in driven_segments and segment_idx >= 0:
+                driven_segments.add(segment_idx)
+                parent = model.segment(segment_idx).parent().to_string()
+                segment_idx = segment_names.index(parent) if parent in segment_names else -1
+        self.chain_dof_idx = np.array(sorted(offsets[i] + j for i in driven_segments
+                                             for j in range(model.segment(i).nbDof())))
+        self._chain_rows = 3 * self.chain_marker_idx[:, None] + np.arange(3)
+        self._damping = damping * np.eye(self.chain_dof_idx.size)
+        self._initial_solver = LeastSquaresIK(model, rate=rate, **gap_options)
+
+    def fit_root(self, markers: np.ndarray, valid: np.ndarray = None):
+        """
+        Set the root degrees of freedom from the rigid fit of the visible root markers (3, n_markers).
+        The root pose is kept if less than 3 of them are visible.
+        """
+        root_valid = np.ones(self.root_marker_idx.size, dtype=bool) if valid is None else valid[self.root_marker_idx]
+        if np.count_nonzero(root_valid) < 3:
+            return
+        rotation, translation = kabsch(self.root_markers_local[:, root_valid],
+                                       markers[:, self.root_marker_idx[root_valid]])
+        rotation = self.root_parent_rot.T @ rotation
+        self.q[self.root_trans_idx] = self.root_parent_rot.T @ (translation - self.root_parent_trans)
+        self.q[self.root_rot_idx] = self._rotation.from_matrix(rotation).as_euler(self.root_seq)
+
+    def _has_enough_markers(self, valid: np.ndarray):
+        if not self.is_initialized:
+            return self._initial_solver._has_enough_markers(valid)
+        return 3 * np.count_nonzero(valid[self.chain_marker_idx]) >= self.chain_dof_idx.size
+
+    def _solve_valid(self, markers: np.ndarray, valid: np.ndarray):
+        if not self.is_initialized:
+            self.q[:], _ = self._initial_solver.solve_frame(markers, valid)
+            return
+        rows = self._chain_rows[valid[self.chain_marker_idx]].ravel()
+        target = markers.T.reshape(-1)[rows]
+        self.fit_root(markers, valid)
+        for _ in range(self.max_iter):
+            model_markers = np.concatenate([mark.to_array() for mark in self.model.markers(self.q)])
+            residual = model_markers[rows] - target
+            jacobian = np.vstack([jac.to_array() for jac in self.model.markersJacobian(self.q)])
+            jacobian = jacobian[np.ix_(rows, self.chain_dof_idx)]
+            step = np.linalg.solve(jacobian.T @ jacobian + self._damping, -jacobian.T @ residual)
+            self.q[self.chain_dof_idx] = np.clip(self.q[self.chain_dof_idx] + step,
+                                                 self.q_bounds[0][self.chain_dof_idx],
+                                                 self.q_bounds[1][self.chain_dof_idx])
+            if np.linalg.norm(step) < self.tol:
+                break
+
+
+class KalmanIK(GapTolerantIK):
+    def __init__(self, model, rate: float = 100, noise_factor: float = 1e-10, error_factor: float = 1e-5,
+                 initial_q=None, **gap_options):
+        """
+        Extended Kalman filter inverse kinematics (biorbd.KalmanReconsMarkers) kept alive for the whole session
+        and stepped once per frame, so its state is never lost between frames. qdot and qddot are the filter
+        estimates instead of finite differences.
+
+        Parameters
+        ----------
+        model: biorbd.Model
+            Loaded biorbd model, markers are expected in the model marker order.
+        rate: float
+            Rate of the markers, sets the time step of the filter process model.
+        noise_factor: float
+            Scale of the process noise, the lower the smoother (and the more lagging) the estimates.
+        error_factor: float
+            Scale of the initial state covariance.
+        initial_q: np.ndarray
+            Optional initial state, e.g. a least square solution of the first frame.
+        **gap_options
+            min_markers, history_size and max_extrapolation, see GapTolerantIK. The filter itself ignores the
+            occluded markers, which biorbd expects at (0, 0, 0).
+        """
+        import biorbd
+
+        super().__init__(model, rate, **gap_options)
+        self._biorbd = biorbd
+        self.noise_factor = noise_factor
+        self.error_factor = error_factor
+        self.params = biorbd.KalmanParam(rate, noise_factor, error_factor)
+        self.kalman = biorbd.KalmanReconsMarkers(model, self.params)
+        self._q = biorbd.GeneralizedCoordinates(model)
+        self._qdot = biorbd.GeneralizedVelocity(model)
+        self._qddot = biorbd.GeneralizedAcceleration(model)
+        self.qddot = np.zeros(self.nb_q)
+        self._markers = np.zeros((3, self.nb_markers))
+        if initial_q is not None:
+            self.reset(initial_q)
+
+    def reset(self, initial_q=None):
+        """
+        Restart the filter, from initial_q if given.
+        """
+        super().reset(initial_q)
+        self.kalman = self._biorbd.KalmanReconsMarkers(self.model, self.params)
+        self.qddot = np.zeros(self.nb_q)
+        if initial_q is not None:
+            self.kalman.setInitState(self._biorbd.GeneralizedCoordinates(self.q),
+                                     self._biorbd.GeneralizedVelocity(self.qdot),
+                                     self._biorbd.GeneralizedAcceleration(self.qddot))
+
+    def _velocity(self, q_prev: np.ndarray):
+        return self._qdot.to_array()
+
+    def _solve_valid(self, markers: np.ndarray, valid: np.ndarray):
+        self._markers[:] = markers
+        self._markers[:, ~valid] = 0
+        targets = [self._biorbd.NodeSegment(marker) for marker in self._markers.T]
+        self.kalman.reconstructFrame(self.model, targets, self._q, self._qdot, self._qddot)
+        self.q = self._q.to_array()
+        self.qddot = self._qddot.to_array()
+
+
+IK_SOLVERS = {
+    'least_squares': LeastSquaresIK,
+    'shoulder_chain': ShoulderChainIK,
+    'kalman': KalmanIK,
+}
@@ -0,0 +1,275 @@
+"""
+Inverse kinematics solved in a dedicated process, off the asyncio/Tk event loop.
+Markers go in and q comes back through shared memory rings, only a wake-up event crosses the process boundary.
+"""
+import os
+import sys
+import time
+import asyncio as aio
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+META = ('frame_number', 'row', 'start_ns', 'end_ns', 'skipped')
+
+
+def attach_shared_memory(name: str, standalone: bool = False):
+    """
+    Attach to an existing shared memory block without taking over its cleanup.
+
+    Parameters
+    ----------
+    name: str
+        Name of the block.
+    standalone: bool
+        The process was started on its own, with its own resource tracker, from which the block is unregistered
+        so that it is not unlinked when the process exits. Processes started by the owner (e.g. spawned workers)
+        share its tracker and must stay registered. Unused from Python 3.13, where blocks are attached without
+        tracking.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if standalone and os.name == 'posix':
+        # SharedMemory registers its POSIX name, the block name with a leading slash
+        resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    return shm
+
+
+class SharedRing:
+    def __init__(self, slot_shape: tuple, n_slots: int = 64, name: str = None, standalone: bool = False):
+        """
+        Single producer, single consumer ring of float64 slots in shared memory, each slot with int64 metadata.
+        The producer writes a slot and then increments the write counter, a reader checks after its copy that
+        the slot was not overwritten in the meantime.
+
+        Parameters
+        ----------
+        slot_shape: tuple
+            Shape of one slot, e.g. (4, n_markers).
+        n_slots: int
+            Number of slots.
+        name: str
+            Name of an existing ring to attach to, a new ring is created if None.
+        standalone: bool
+            Attached from a process not started by the owner of the ring, see attach_shared_memory.
+        """
+        self.slot_shape = tuple(slot_shape)
+        self.n_slots = n_slots
+        n_values = int(np.prod(slot_shape))
+        size = 8 * (1 + n_slots * len(META) + n_slots * n_values)
+        self.is_owner = name is None
+        if self.is_owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name, standalone)
+        self.name = self.shm.name
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self._meta = np.ndarray((n_slots, len(META)), dtype=np.int64, buffer=self.shm.buf, offset=8)
+        self._data = np.ndarray((n_slots,) + self.slot_shape, dtype=np.float64, buffer=self.shm.buf,
+                                offset=8 * (1 + n_slots * len(META)))
+        if self.is_owner:
+            self._header[0] = 0
+
+    @property
+    def count(self):
+        return int(self._header[0])
+
+    def push(self, data: np.ndarray, *meta):
+        """
+        Write the next slot, meta being the first values of META.
+        """
+        slot = self.count % self.n_slots
+        self._data[slot] = data
+        self._meta[slot, :len(meta)] = meta
+        self._header[0] += 1
+
+    def read(self, index: int):
+        """
+        Copy of the slot of the given write index, None if it was already overwritten.
+
+        Returns
+        -------
+        data, meta: tuple
+            Slot data and its META values.
+        """
+        slot = index % self.n_slots
+        data = self._data[slot].copy()
+        meta = self._meta[slot].copy()
+        if self.count - index >= self.n_slots:
+            return None
+        return data, meta
+
+    def close(self):
+        # The views must be released before the shared memory can be closed
+        del self._header, self._meta, self._data
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+
+
+def _worker_main(biomod_path, in_name, out_name, nb_markers, nb_q, n_slots, rate, ik_method, drop_stale,
+                 new_frame, result_ready, stop, ready):
+    from model_cache import get_model
+    from ik_solvers import IK_SOLVERS
+
+    model = get_model(biomod_path)
+    ik_solver = IK_SOLVERS[ik_method](model, rate=rate)
+    # Spawned by the owner of the rings, the worker shares its resource tracker and stays registered
+    markers_in = SharedRing((4, nb_markers), n_slots, name=in_name)
+    q_out = SharedRing((2, nb_q), n_slots, name=out_name)
+    ready.set()
+    read_count, skipped = 0, 0
+    while not stop.is_set():
+        if not new_frame.wait(0.1):
+            continue
+        new_frame.clear()
+        count = markers_in.count
+        while read_count < count:
+            # Only the latest frame is worth solving once late, unless every frame is asked for
+            first = count - 1 if drop_stale else max(read_count, count - n_slots + 1)
+            skipped += first - read_count
+            read_count = first + 1
+            frame = markers_in.read(first)
+            if frame is None:
+                continue
+            data, meta = frame
+            start_ns = time.perf_counter_ns()
+            q, qdot = ik_solver.solve_frame(data[:3], data[3] > 0)
+            q_out.push(np.vstack((q, qdot)), meta[0], meta[1], start_ns, time.perf_counter_ns(), skipped)
+            result_ready.set()
+    markers_in.close()
+    q_out.close()
+
+
+class IKWorker:
+    def __init__(self, biomod_path: str, nb_markers: int, nb_q: int, rate: float = 100,
+                 ik_method: str = 'least_squares', n_slots: int = 64, drop_stale: bool = True):
+        """
+        Persistent IK solver running in its own process. The acquisition submits each frame without waiting
+        and the feedback only reads the latest solved frame.
+
+        Parameters
+        ----------
+        biomod_path: str
+            Path of the bioMod, loaded once in the worker.
+        nb_markers: int
+            Number of markers, in the bioMod marker order.
+        nb_q: int
+            Number of generalized coordinates of the model.
+        rate: float
+            Rate of the markers.
+        ik_method: str
+            Solver used in the worker, a key of ik_solvers.IK_SOLVERS.
+        n_slots: int
+            Number of slots of both shared memory rings.
+        drop_stale: bool
+            When the worker falls behind, solve only the latest submitted frame instead of every frame.
+        """
+        self.biomod_path = biomod_path
+        self.nb_markers = nb_markers
+        self.nb_q = nb_q
+        self.rate = rate
+        self.ik_method = ik_method
+        self.n_slots = n_slots
+        self.drop_stale = drop_stale
+        self.markers_in = SharedRing((4, nb_markers), n_slots)
+        self.q_out = SharedRing((2, nb_q), n_slots)
+        self._frame = np.zeros((4, nb_markers))
+        self._read_count = 0
+        self._context = mp.get_context('spawn')
+        self._new_frame = self._context.Event()
+        self._result_ready = self._context.Event()
+        self._stop = self._context.Event()
+        self._ready = self._context.Event()
+        self.process = None
+
+    def start(self, timeout: float = 60):
+        """
+        Start the worker process and wait until its model is loaded.
+        """
+        self.process = self._context.Process(
+            target=_worker_main,
+            args=(self.biomod_path, self.markers_in.name, self.q_out.name, self.nb_markers, self.nb_q,
+                  self.n_slots, self.rate, self.ik_method, self.drop_stale, self._new_frame,
+                  self._result_ready, self._stop, self._ready),
+            daemon=True,
+        )
+        self.process.start()
+        deadline = time.perf_counter() + timeout
+        while not self._ready.wait(0.1):
+            if not self.process.is_alive() or time.perf_counter() > deadline:
+                self.stop()
+                raise RuntimeError("The IK worker process could not load the model.")
+        return self
+
+    def submit(self, markers: np.ndarray, valid: np.ndarray = None, frame_number: int = 0, row: int = -1):
+        """
+        Send a frame to the worker, never blocks.
+
+        Parameters
+        ----------
+        markers: np.ndarray
+            Markers positions (3, n_markers) in meters, in the bioMod marker order.
+        valid: np.ndarray
+            Boolean visibility of each marker, derived from the NaN if None.
+        frame_number: int
+            QTM frame number, returned with the result.
+        row: int
+            Latency recorder row of the frame, returned with the result.
+        """
+        self._frame[:3] = markers
+        self._frame[3] = np.isfinite(markers).all(axis=0) if valid is None else valid
+        self.markers_in.push(self._frame, frame_number, row)
+        self._new_frame.set()
+
+    def latest(self):
+        """
+        Latest solved frame if one was solved since the last call, None otherwise.
+
+        Returns
+        -------
+        q, qdot, meta: tuple
+            Generalized coordinates and velocities (n_q,) and the META values of the frame (frame number,
+            recorder row, solve start and end in time.perf_counter_ns, frames skipped so far).
+        """
+        count = self.q_out.count
+        if count == self._read_count:
+            return None
+        self._read_count = count
+        result = self.q_out.read(count - 1)
+        if result is None:
+            return None
+        data, meta = result
+        return data[0], data[1], meta
+
+    async def wait_result(self, timeout: float = 1):
+        """
+        Wait for a solved frame without blocking the event loop, see latest.
+        """
+        result = self.latest()
+        while result is None:
+            if not await aio.to_thread(self._result_ready.wait, timeout):
+                raise TimeoutError(f"The IK worker returned no frame within {timeout} s.")
+            self._result_ready.clear()
+            result = self.latest()
+        return result
+
+    @property
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.markers_in.close()
+        self.q_out.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,189 @@
+"""
+Fixed-size ring buffer of joint kinematics with incremental, constant cost per sample, filters.
+"""
+import numpy as np
+
+
+class ExponentialFilter:
+    def __init__(self, nb_channels: int, alpha: float = 0.3):
+        """
+        First order exponential smoothing, y += alpha * (x - y).
+
+        Parameters
+        ----------
+        nb_channels: int
+            Number of filtered channels (e.g. degrees of freedom).
+        alpha: float
+            Smoothing factor in ]0, 1], 1 means no filtering.
+        """
+        self.alpha = alpha
+        self.y = np.zeros(nb_channels)
+        self.is_initialized = False
+
+    def reset(self):
+        self.is_initialized = False
+
+    def update(self, x: np.ndarray):
+        if not self.is_initialized:
+            self.y[:] = x
+            self.is_initialized = True
+        else:
+            self.y += self.alpha * (x - self.y)
+        return self.y
+
+
+class OneEuroFilter:
+    def __init__(self, nb_channels: int, rate: float, min_cutoff: float = 1, beta: float = 0.1,
+                 d_cutoff: float = 1):
+        """
+        One euro filter (Casiez et al. 2012), low jitter when still and low lag when moving fast.
+
+        Parameters
+        ----------
+        nb_channels: int
+            Number of filtered channels.
+        rate: float
+            Sample rate.
+        min_cutoff: float
+            Cutoff frequency (Hz) at rest.
+        beta: float
+            Increase of the cutoff with the signal speed.
+        d_cutoff: float
+            Cutoff frequency (Hz) of the speed estimate.
+        """
+        self.rate = rate
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_alpha = self._alpha(d_cutoff)
+        self.y = np.zeros(nb_channels)
+        self.dy = np.zeros(nb_channels)
+        self.is_initialized = False
+
+    def _alpha(self, cutoff):
+        return 1 / (1 + self.rate / (2 * np.pi * cutoff))
+
+    def reset(self):
+        self.is_initialized = False
+
+    def update(self, x: np.ndarray):
+        if not self.is_initialized:
+            self.y[:] = x
+            self.dy[:] = 0
+            self.is_initialized = True
+            return self.y
+        self.dy += self.d_alpha * ((x - self.y) * self.rate - self.dy)
+        alpha = self._alpha(self.min_cutoff + self.beta * np.abs(self.dy))
+        self.y += alpha * (x - self.y)
+        return self.y
+
+
+class ButterworthFilter:
+    def __init__(self, nb_channels: int, rate: float, cutoff: float = 6, order: int = 2):
+        """
+        Causal low-pass Butterworth kept in state-space form, one state vector per channel.
+
+        Parameters
+        ----------
+        nb_channels: int
+            Number of filtered channels.
+        rate: float
+            Sample rate.
+        cutoff: float
+            Cutoff frequency (Hz).
+        order: int
+            Order of the filter.
+        """
+        # scipy.signal takes a third of a second to import, only the Butterworth filter needs it
+        from scipy import signal
+
+        a, b, c, d = signal.zpk2ss(*signal.butter(order, cutoff, btype='low', output='zpk', fs=rate))
+        self.a_t = a.T
+        self.b = b[:, 0]
+        self.c = c[0]
+        self.d = d[0, 0]
+        # State reached after a constant input, used to start without transient
+        self.steady_state = np.linalg.solve(np.eye(order) - a, b)[:, 0]
+        self.state = np.zeros((nb_channels, order))
+        self.y = np.zeros(nb_channels)
+        self.is_initialized = False
+
+    def reset(self):
+        self.is_initialized = False
+
+    def update(self, x: np.ndarray):
+        if not self.is_initialized:
+            self.state[:] = np.outer(x, self.steady_state)
+            self.is_initialized = True
+        self.y[:] = self.state @ self.c + self.d * x
+        self.state[:] = self.state @ self.a_t + np.outer(x, self.b)
+        return self.y
+
+
+class JointBuffer:
+    def __init__(self, nb_q: int, size: int = 1000, filters: dict = None):
+        """
+        Preallocated ring buffer of q and qdot, updating its filters once per appended sample.
+
+        Parameters
+        ----------
+        nb_q: int
+            Number of degrees of freedom.
+        size: int
+            Number of samples kept.
+        filters: dict
+            Filters of q by name, e.g. {'one_euro': OneEuroFilter(nb_q, 100)}.
+        """
+        self.nb_q = nb_q
+        self.size = size
+        # Stored sample-major so that appending a sample writes contiguous memory
+        self.q = np.zeros((size, nb_q))
+        self.qdot = np.zeros((size, nb_q))
+        self.filtered_q = {}
+        self.filters = {}
+        self.count = 0
+        for name, q_filter in (filters if filters else {}).items():
+            self.add_filter(name, q_filter)
+
+    def add_filter(self, name: str, q_filter):
+        self.filters[name] = q_filter
+        self.filtered_q[name] = np.zeros((self.size, self.nb_q))
+
+    def append(self, q: np.ndarray, qdot: np.ndarray = None):
+        """
+        Append a sample (n_q,) and update every filter with it.
+        """
+        idx = self.count % self.size
+        self.q[idx] = q
+        if qdot is not None:
+            self.qdot[idx] = qdot
+        for name, q_filter in self.filters.items():
+            self.filtered_q[name][idx] = q_filter.update(q)
+        self.count += 1
+
+    def latest(self, name: str = None, dofs=None):
+        """
+        Latest raw or filtered q.
+
+        Parameters
+        ----------
+        name: str
+            Name of the filter, raw q if None.
+        dofs: Union[int, list]
+            Degrees of freedom to return, all if None.
+        """
+        data = self.q if name is None else self.filtered_q[name]
+        sample = data[(self.count - 1) % self.size]
+        return sample.copy() if dofs is None else sample[dofs]
+
+    def window(self, name: str = None, n_samples: int = None):
+        """
+        Last n_samples of raw or filtered q in chronological order (n_q, n_samples).
+        """
+        data = self.q if name is None else self.filtered_q[name]
+        n_samples = min(n_samples if n_samples else self.size, self.count, self.size)
+        return data[np.arange(self.count - n_samples, self.count) % self.size].T
+
+    def reset(self):
+        self.count = 0
+        for q_filter in self.filters.values():
+            q_filter.reset()
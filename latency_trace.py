@@ -0,0 +1,132 @@
+"""
+Low-overhead per-frame latency tracing, from the QTM frame arrival to the rendered feedback.
+"""
+import time
+import numpy as np
+
+STAGES = ('acquisition', 'reorder', 'ik', 'filtering', 'ellipse_update', 'draw')
+
+
+class _Span:
+    __slots__ = ('recorder', 'stage', 'row', 'start')
+
+    def __init__(self, recorder, stage, row):
+        self.recorder = recorder
+        self.stage = stage
+        self.row = row
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self.recorder.record(self.stage, self.start, time.perf_counter_ns(), self.row)
+
+
+class LatencyRecorder:
+    def __init__(self, capacity: int = 360000, stages: tuple = STAGES):
+        """
+        Preallocated in-memory recorder of the stage durations of each frame, the oldest rows are overwritten
+        once the capacity is reached (one hour at 100 Hz by default).
+
+        Parameters
+        ----------
+        capacity: int
+            Number of frames kept.
+        stages: tuple
+            Names of the traced stages.
+        """
+        self.capacity = capacity
+        self.stages = stages
+        self.stage_idx = {stage: i for i, stage in enumerate(stages)}
+        self.frame_numbers = np.full(capacity, -1, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.arrival_ns = np.zeros(capacity, dtype=np.int64)
+        self.rendered_ns = np.zeros(capacity, dtype=np.int64)
+        self.durations_ns = np.zeros((capacity, len(stages)), dtype=np.int64)
+        self.count = 0
+        self.row = -1
+
+    def begin_frame(self, frame_number: int, timestamp: int, arrival_ns: int = None):
+        """
+        Open the row of a new frame, the following spans are recorded in it.
+
+        Parameters
+        ----------
+        frame_number: int
+            QTM frame number.
+        timestamp: int
+            QTM timestamp (microseconds).
+        arrival_ns: int
+            time.perf_counter_ns() when the frame reached this process, now if None.
+
+        Returns
+        -------
+        row: int
+            Row of the frame, to tag spans recorded later (e.g. by the renderer).
+        """
+        self.row = self.count % self.capacity
+        self.frame_numbers[self.row] = frame_number
+        self.timestamps[self.row] = timestamp
+        self.arrival_ns[self.row] = arrival_ns if arrival_ns else time.perf_counter_ns()
+        self.rendered_ns[self.row] = 0
+        self.durations_ns[self.row] = 0
+        self.count += 1
+        return self.row
+
+    def record(self, stage: str, start_ns: int, end_ns: int, row: int = None):
+        row = self.row if row is None else row
+        if row < 0:
+            return
+        self.durations_ns[row, self.stage_idx[stage]] += end_ns - start_ns
+        if stage == self.stages[-1]:
+            self.rendered_ns[row] = end_ns
+
+    def span(self, stage: str, row: int = None):
+        """
+        Context manager timing a stage of the current (or given) frame.
+        """
+        return _Span(self, stage, self.row if row is None else row)
+
+    def _ordered(self):
+        n_rows = min(self.count, self.capacity)
+        return np.arange(self.count - n_rows, self.count) % self.capacity
+
+    def as_dict(self):
+        """
+        Columns of the recorded frames in chronological order, durations in milliseconds (NaN if not traced).
+        """
+        rows = self._ordered()
+        durations = self.durations_ns[rows] * 1e-6
+        durations[self.durations_ns[rows] == 0] = np.nan
+        end_to_end = (self.rendered_ns[rows] - self.arrival_ns[rows]) * 1e-6
+        end_to_end[self.rendered_ns[rows] == 0] = np.nan
+        columns = {'frame_number': self.frame_numbers[rows], 'qtm_timestamp': self.timestamps[rows]}
+        columns.update({stage: durations[:, i] for i, stage in enumerate(self.stages)})
+        columns['end_to_end'] = end_to_end
+        return columns
+
+    def to_csv(self, path: str):
+        columns = self.as_dict()
+        np.savetxt(path, np.column_stack(list(columns.values())), delimiter=',',
+                   header=','.join(columns.keys()), comments='', fmt=['%d', '%d'] + ['%.6g'] * (len(columns) - 2))
+
+    def to_parquet(self, path: str):
+        import pandas as pd
+
+        pd.DataFrame(self.as_dict()).to_parquet(path)
+
+    def summary(self):
+        """
+        Print and return the p50/p95/p99 of each stage and of the end-to-end latency, in milliseconds.
+        """
+        columns = self.as_dict()
+        stats = {}
+        print(f'Latency over {columns["frame_number"].size} frames (ms)')
+        for name in list(self.stages) + ['end_to_end']:
+            values = columns[name][~np.isnan(columns[name])]
+            if values.size == 0:
+                continue
+            stats[name] = np.percentile(values, [50, 95, 99])
+            print(f'{name:<16} p50 {stats[name][0]:8.3f} | p95 {stats[name][1]:8.3f} | p99 {stats[name][2]:8.3f}')
+        return stats
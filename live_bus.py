@@ -0,0 +1,291 @@
+"""
+Shared memory bus of the live frames, one producer (the acquisition loop) and any number of readers in other
+processes (feedback window, disk recorder, biosiglive LivePlot).
+
+Each slot holds a session_recorder.frame_dtype record and a sequence number. The producer makes the sequence odd
+while it writes a slot and sets it to 2 * (index + 1) once the record is complete, a reader keeps its copy only if
+the sequence was the expected one before and after the copy. Readers never lock or signal the producer, they poll.
+
+    python live_bus.py plot --name shoulder_live
+    python live_bus.py record --name shoulder_live --session sessions/P01_live
+    python live_bus.py ellipse --name shoulder_live
+"""
+import argparse
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from session_recorder import frame_dtype
+from ik_worker import attach_shared_memory
+
+# Header: magic, nb_markers, nb_q, n_slots and write count, as int64
+MAGIC = 0x5348444C42555331
+HEADER_SIZE = 5
+
+
+def _layout(nb_markers: int, nb_q: int, n_slots: int):
+    dtype = frame_dtype(nb_markers, nb_q)
+    sequence_offset = 8 * HEADER_SIZE
+    records_offset = sequence_offset + 8 * n_slots
+    return dtype, sequence_offset, records_offset, records_offset + dtype.itemsize * n_slots
+
+
+class LiveBus:
+    def __init__(self, name: str, nb_markers: int, nb_q: int, n_slots: int = 256):
+        """
+        Producer side of the bus, publishing never waits for the readers.
+
+        Parameters
+        ----------
+        name: str
+            Name of the shared memory block the readers attach to.
+        nb_markers: int
+            Number of markers per frame.
+        nb_q: int
+            Number of generalized coordinates.
+        n_slots: int
+            Number of frames kept, a reader later than that loses the oldest frames.
+        """
+        self.dtype, sequence_offset, records_offset, size = _layout(nb_markers, nb_q, n_slots)
+        self.name = name
+        self.n_slots = n_slots
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left over by a producer that did not close it
+            shared_memory.SharedMemory(name=name).unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=self.shm.buf)
+        self._sequence = np.ndarray((n_slots,), dtype=np.int64, buffer=self.shm.buf, offset=sequence_offset)
+        self._records = np.ndarray((n_slots,), dtype=self.dtype, buffer=self.shm.buf, offset=records_offset)
+        self._sequence[:] = 0
+        self._header[:] = (MAGIC, nb_markers, nb_q, n_slots, 0)
+        self._q_ref = np.zeros(nb_q)
+        self.count = 0
+
+    def set_reference(self, q_ref: np.ndarray):
+        self._q_ref[:] = q_ref
+
+    def publish(self, frame_number: int, timestamp: int, markers: np.ndarray, q: np.ndarray, qdot: np.ndarray,
+                ellipse=(0, 0, 0, 0), ik_frame_number: int = None):
+        """
+        Write a frame in the next slot, same fields as SessionRecorder.record.
+        """
+        slot = self.count % self.n_slots
+        self._sequence[slot] = 2 * self.count + 1
+        record = self._records[slot]
+        record['frame_number'] = frame_number
+        record['timestamp'] = timestamp
+        record['markers'] = markers
+        record['ik_frame_number'] = frame_number if ik_frame_number is None else ik_frame_number
+        record['q'] = q
+        record['qdot'] = qdot
+        record['q_ref'] = self._q_ref
+        record['ellipse'] = ellipse
+        self._sequence[slot] = 2 * self.count + 2
+        self.count += 1
+        self._header[4] = self.count
+
+    def close(self):
+        # The views must be released before the shared memory can be closed
+        del self._header, self._sequence, self._records
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LiveBusReader:
+    def __init__(self, name: str, timeout: float = 10, standalone: bool = False):
+        """
+        Reader side of the bus, attached to a running producer.
+
+        Parameters
+        ----------
+        name: str
+            Name of the bus.
+        timeout: float
+            Time to wait for the producer to create the bus, in seconds.
+        standalone: bool
+            The reader runs in a process started on its own (e.g. python live_bus.py record), with its own
+            resource tracker, from which the bus is unregistered so that it is not unlinked when the reader exits.
+            Readers in the producer process or in processes it started share its tracker and must stay
+            registered. Unused from Python 3.13, where readers attach without tracking.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                self.shm = attach_shared_memory(name, standalone)
+                break
+            except FileNotFoundError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.1)
+        self._header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=self.shm.buf)
+        magic, self.nb_markers, self.nb_q, self.n_slots, _ = (int(value) for value in self._header)
+        if magic != MAGIC:
+            raise ValueError(f"The shared memory '{name}' is not a live bus.")
+        self.dtype, sequence_offset, records_offset, _ = _layout(self.nb_markers, self.nb_q, self.n_slots)
+        self._sequence = np.ndarray((self.n_slots,), dtype=np.int64, buffer=self.shm.buf, offset=sequence_offset)
+        self._records = np.ndarray((self.n_slots,), dtype=self.dtype, buffer=self.shm.buf, offset=records_offset)
+        self.name = name
+        self.read_count = self.count
+        self.lost_frames = 0
+
+    @property
+    def count(self):
+        """
+        Number of frames published so far.
+        """
+        return int(self._header[4])
+
+    def read(self, index: int):
+        """
+        Copy of the frame of the given publication index, None if it is overwritten or being written.
+        """
+        slot = index % self.n_slots
+        sequence = 2 * index + 2
+        if self._sequence[slot] != sequence:
+            return None
+        record = self._records[slot].copy()
+        if self._sequence[slot] != sequence:
+            return None
+        return record
+
+    def latest(self):
+        """
+        Latest complete frame, None if nothing was published yet.
+        """
+        count = self.count
+        for index in range(count - 1, max(count - self.n_slots, 0) - 1, -1):
+            record = self.read(index)
+            if record is not None:
+                return record
+        return None
+
+    def read_new(self):
+        """
+        Frames published since the last call, in order. Frames already overwritten are counted in lost_frames.
+
+        Returns
+        -------
+        records: np.ndarray
+            Structured array of the new frames (fields as in session_recorder.frame_dtype).
+        """
+        count = self.count
+        first = max(self.read_count, count - self.n_slots + 1)
+        self.lost_frames += first - self.read_count
+        records = []
+        for index in range(first, count):
+            record = self.read(index)
+            if record is None:
+                self.lost_frames += 1
+            else:
+                records.append(record)
+        self.read_count = count
+        return np.array(records, dtype=self.dtype)
+
+    def wait_new(self, timeout: float = 1, poll_interval: float = 0.002):
+        """
+        Wait until a frame is published after the last read_new, then read the new frames.
+        """
+        deadline = time.perf_counter() + timeout
+        while self.count == self.read_count:
+            if time.perf_counter() > deadline:
+                return np.zeros(0, dtype=self.dtype)
+            time.sleep(poll_interval)
+        return self.read_new()
+
+    def close(self):
+        del self._header, self._sequence, self._records
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def record_bus(name: str, session_path: str, rate: float = 100, standalone: bool = True):
+    """
+    Record every frame of the bus in a session (see session_recorder), until the producer stops publishing.
+    standalone as in LiveBusReader, False when started from the producer process.
+    """
+    from session_recorder import SessionRecorder
+
+    with LiveBusReader(name, standalone=standalone) as reader:
+        q_ref = None
+        with SessionRecorder(session_path, reader.nb_markers, reader.nb_q, rate=rate) as session:
+            while True:
+                records = reader.wait_new(timeout=5)
+                if records.size == 0:
+                    break
+                for record in records:
+                    if q_ref is None or not np.array_equal(record['q_ref'], q_ref):
+                        q_ref = record['q_ref'].copy()
+                        session.set_reference(q_ref)
+                    session.record(record['frame_number'], record['timestamp'], record['markers'], record['q'],
+                                   record['qdot'], record['ellipse'], record['ik_frame_number'])
+        print(f'Frames lost by the recorder: {reader.lost_frames}')
+
+
+def plot_bus(name: str, dofs: tuple = (11, 12, 13), window: int = 500, standalone: bool = True):
+    """
+    Plot degrees of freedom of the bus (degrees) with biosiglive LivePlot.
+    standalone as in LiveBusReader, False when started from the producer process.
+    """
+    from biosiglive import LivePlot, PlotType
+
+    with LiveBusReader(name, standalone=standalone) as reader:
+        plot = LivePlot(nb_subplots=len(dofs), plot_type=PlotType.Curve, name=f'q {name}',
+                        channel_names=[f'q[{dof}]' for dof in dofs])
+        plot.init(plot_windows=window)
+        while True:
+            records = reader.wait_new(timeout=5)
+            if records.size == 0:
+                break
+            plot.update(np.rad2deg(records['q'][:, list(dofs)].T))
+
+
+def ellipse_bus(name: str, max_fps: float = 60, standalone: bool = True):
+    """
+    Feedback ellipse window fed by the bus, in its own process.
+    standalone as in LiveBusReader, False when started from the producer process.
+    """
+    import matplotlib.pyplot as plt
+    from feedback import ellipse_renderer, gh_feedback
+
+    with LiveBusReader(name, standalone=standalone) as reader:
+        renderer = ellipse_renderer(max_fps=max_fps)
+        frame_number = None
+        while plt.fignum_exists(renderer.fig.number):
+            time.sleep(1 / max_fps)
+            record = reader.latest()
+            if record is None or record['frame_number'] == frame_number:
+                renderer.fig.canvas.flush_events()
+                continue
+            frame_number = record['frame_number']
+            # The recorded ellipse width and height are the relative plane of elevation and elevation
+            _, _, width, height = record['ellipse']
+            renderer.render(gh_feedback((width, height, 0), frame_number, record['timestamp']))
+        renderer.close()
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Reader of the live bus')
+    PARSER.add_argument('reader', choices=['plot', 'record', 'ellipse'])
+    PARSER.add_argument('--name', dest='name', default='shoulder_live', help='Name of the live bus')
+    PARSER.add_argument('--session', dest='session', default='live_session', help='record: session folder')
+    PARSER.add_argument('--rate', dest='rate', type=float, default=100)
+    ARGS = PARSER.parse_args()
+    if ARGS.reader == 'record':
+        record_bus(ARGS.name, ARGS.session, ARGS.rate)
+    elif ARGS.reader == 'plot':
+        plot_bus(ARGS.name)
+    elif ARGS.reader == 'ellipse':
+        ellipse_bus(ARGS.name)
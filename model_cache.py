@@ -0,0 +1,92 @@
+"""
+On-disk cache of the osim -> bioMod conversion and in-process registry of the parsed biorbd models.
+"""
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+_models = {}
+
+
+def _converter_version():
+    try:
+        from importlib.metadata import version
+
+        return version('osim_to_biomod')
+    except Exception:
+        return 'unknown'
+
+
+def conversion_key(osim_path: str, **converter_options):
+    """
+    Hash of the osim file content, the converter options and the converter version.
+    """
+    key = hashlib.sha256(Path(osim_path).read_bytes())
+    key.update(json.dumps(converter_options, sort_keys=True, default=str).encode())
+    key.update(_converter_version().encode())
+    return key.hexdigest()
+
+
+def convert_osim(osim_path: str, cache_dir: str = None, **converter_options):
+    """
+    Convert an osim to a bioMod next to it, unless the same osim was already converted with the same options.
+
+    Parameters
+    ----------
+    osim_path: str
+        Path of the scaled osim model.
+    cache_dir: str
+        Folder of the converted models, '_biomod_cache' next to the osim if None.
+    **converter_options
+        Keyword arguments of osim_to_biomod.Converter, override the defaults used for the experiment.
+
+    Returns
+    -------
+    biomod_path: str
+        Path of the bioMod, named after the osim.
+    """
+    osim_path = Path(osim_path)
+    biomod_path = osim_path.parent / (osim_path.stem + '.bioMod')
+    options = dict(
+        ignore_muscle_applied_tag=False,
+        ignore_fixed_dof_tag=False,
+        ignore_clamped_dof_tag=False,
+        mesh_dir=str(osim_path.parent) + '/Geometry',
+        skip_muscle=True,
+        print_general_informations=True,
+    )
+    options.update(converter_options)
+    cache_dir = Path(cache_dir) if cache_dir else osim_path.parent / '_biomod_cache'
+    cached_path = cache_dir / f'{osim_path.stem}_{conversion_key(str(osim_path), **options)[:16]}.bioMod'
+
+    if cached_path.exists():
+        print(f'Using cached conversion of {osim_path.name}')
+    else:
+        from osim_to_biomod import Converter
+
+        converter = Converter(str(biomod_path), str(osim_path), **options)
+        converter.convert_file()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(biomod_path, cached_path)
+        return str(biomod_path)
+    if not biomod_path.exists() or biomod_path.read_bytes() != cached_path.read_bytes():
+        shutil.copyfile(cached_path, biomod_path)
+    return str(biomod_path)
+
+
+def get_model(biomod_path: str):
+    """
+    Get the biorbd model of a bioMod, parsed only once per session (again if the file changed).
+    """
+    import biorbd as brbd
+
+    path = Path(biomod_path).resolve()
+    key = (str(path), path.stat().st_mtime_ns)
+    if key not in _models:
+        _models[key] = brbd.Model(str(path))
+    return _models[key]
+
+
+def clear_models():
+    _models.clear()
@@ -0,0 +1,119 @@
+"""
+Deadline pacing of the real-time loops, with overrun and jitter statistics.
+"""
+import time
+import asyncio as aio
+import numpy as np
+
+
+class DeadlinePacer:
+    def __init__(self, rate: float, sleep: bool = True, history: int = 100000):
+        """
+        Run a loop on a fixed period. Deadlines already missed when an iteration ends are skipped instead of being
+        run late back to back, so an overrun never queues stale iterations.
+
+        Parameters
+        ----------
+        rate: float
+            Target rate of the loop.
+        sleep: bool
+            Sleep until the next deadline. Without sleeping (e.g. the loop is already paced by the QTM frame
+            arrival) wait only yields to the other tasks and keeps the statistics.
+        history: int
+            Number of iterations kept for the statistics.
+        """
+        self.rate = rate
+        self.period = 1 / rate
+        self.sleep = sleep
+        self.history = history
+        self.deadline = None
+        self.tick = None
+        self.intervals = np.zeros(history)
+        self.lateness = np.zeros(history)
+        self.work_time = np.zeros(history)
+        self.count = 0
+        self.overruns = 0
+        self.skipped_deadlines = 0
+        self.last_frame_number = None
+        self.skipped_frames = 0
+        self.duplicated_frames = 0
+
+    async def wait(self):
+        """
+        Wait for the next deadline, to call at the start of each iteration.
+        """
+        now = time.perf_counter()
+        if self.tick is None:
+            self.deadline = self.tick = now
+            await aio.sleep(0)
+            return
+        work_time = now - self.tick
+        if self.sleep:
+            if work_time > self.period:
+                self.overruns += 1
+            self.deadline += self.period
+            if now > self.deadline + self.period:
+                missed = int((now - self.deadline) / self.period)
+                self.skipped_deadlines += missed
+                self.deadline += missed * self.period
+        elif work_time > 1.5 * self.period:
+            # Paced by the frames, the iteration includes the wait for its frame and half a period of arrival
+            # jitter is tolerated
+            self.overruns += 1
+            self.skipped_deadlines += round(work_time / self.period) - 1
+        # Always yield, the other tasks (renderer, GUI) run even when the loop is late
+        await aio.sleep(max(0., self.deadline - now) if self.sleep else 0)
+        tick = time.perf_counter()
+        if not self.sleep:
+            self.deadline = tick
+        idx = self.count % self.history
+        self.intervals[idx] = tick - self.tick
+        self.lateness[idx] = tick - self.deadline if self.sleep else 0
+        self.work_time[idx] = work_time
+        self.count += 1
+        self.tick = tick
+
+    def frame(self, frame_number: int):
+        """
+        Count the frames skipped (gap in frame numbers) or served twice since the previous iteration.
+        """
+        if self.last_frame_number is not None:
+            if frame_number <= self.last_frame_number:
+                self.duplicated_frames += 1
+                return
+            self.skipped_frames += frame_number - self.last_frame_number - 1
+        self.last_frame_number = frame_number
+
+    def stats(self):
+        """
+        Statistics of the kept iterations, in milliseconds.
+        """
+        n_iter = min(self.count, self.history)
+        intervals = self.intervals[:n_iter] * 1e3
+        if n_iter == 0:
+            return {}
+        return {
+            'iterations': self.count,
+            'rate': 1e3 / intervals.mean(),
+            'interval_p50': np.percentile(intervals, 50),
+            'interval_p99': np.percentile(intervals, 99),
+            'jitter_std': np.std(intervals - self.period * 1e3),
+            'lateness_p99': np.percentile(self.lateness[:n_iter] * 1e3, 99),
+            'work_p99': np.percentile(self.work_time[:n_iter] * 1e3, 99),
+            'overruns': self.overruns,
+            'skipped_deadlines': self.skipped_deadlines,
+            'skipped_frames': self.skipped_frames,
+            'duplicated_frames': self.duplicated_frames,
+        }
+
+    def report(self, name: str = 'Loop'):
+        stats = self.stats()
+        if not stats:
+            print(f'{name}: no iteration')
+            return stats
+        print(f'{name}: {stats["iterations"]} iterations at {stats["rate"]:.1f} Hz (target {self.rate:g} Hz), '
+              f'interval p50 {stats["interval_p50"]:.2f} ms / p99 {stats["interval_p99"]:.2f} ms, '
+              f'jitter {stats["jitter_std"]:.2f} ms, work p99 {stats["work_p99"]:.2f} ms, '
+              f'overruns {stats["overruns"]}, skipped deadlines {stats["skipped_deadlines"]}, '
+              f'skipped frames {stats["skipped_frames"]}, duplicated frames {stats["duplicated_frames"]}')
+        return stats
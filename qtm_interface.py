@@ -1,34 +1,206 @@
 from typing import Union
+import sys
+import time
+import struct
 import numpy as np
 import asyncio as aio
 import xml.etree.ElementTree as et
-from biosiglive import(
-    GenericInterface,
-    InterfaceType,
-    RealTimeProcessing,
-    OfflineProcessing,
-    MskFunctions,
-)
-
-try:
-    import qtm_rt as qtm
-except ModuleNotFoundError:
-    pass
-
-class QTMInterface(GenericInterface):
-    def __init__(self, system_rate:float=100, ip:str= "127.0.0.1", init_now=True):
-        super().__init__(system_rate=system_rate, interface_type=InterfaceType.Custom)
+
+
+# RT3DComponent header (marker count, drop rate, out of sync rate) in front of the markers of a 3D component
+_3D_HEADER = struct.Struct('<Ihh')
+
+
+class PacketDecoder:
+    def __init__(self, nb_markers: int, residuals: bool = False):
+        """
+        Decode the 3D (or 3D residual) component of QTM data packets straight from the packet bytes, without the
+        per marker tuples of get_3d_markers. positions and residuals are reused and overwritten by each decode.
+
+        Parameters
+        ----------
+        nb_markers: int
+            Number of markers of the QTM project.
+        residuals: bool
+            Decode the 3D residual component ('3dres') instead of the 3D component ('3d').
+        """
+        from qtm_rt.packet import QRTComponentType
+
+        self.nb_markers = nb_markers
+        self.component = QRTComponentType.Component3dRes if residuals else QRTComponentType.Component3d
+        self.stride = 4 if residuals else 3
+        self.positions = np.full((nb_markers, 3), np.nan)
+        self.residuals = np.full(nb_markers, np.nan)
+
+    @property
+    def component_name(self):
+        return '3dres' if self.stride == 4 else '3d'
+
+    def decode(self, packet):
+        """
+        Markers positions (n_markers, 3) in meters of a QRTPacket, the residuals (mm) are in self.residuals.
+        """
+        position = packet.components.get(self.component)
+        if position is None:
+            raise ValueError(f"The packet has no {self.component_name} component.")
+        nb_markers = _3D_HEADER.unpack_from(packet.data, position)[0]
+        if nb_markers != self.nb_markers:
+            raise RuntimeError(f"{nb_markers} markers in the QTM frame, {self.nb_markers} expected.")
+        raw = np.frombuffer(packet.data, dtype='<f4', count=nb_markers * self.stride,
+                            offset=position + _3D_HEADER.size).reshape(nb_markers, self.stride)
+        np.multiply(raw[:, :3], 1e-3, out=self.positions)
+        if self.stride == 4:
+            self.residuals[:] = raw[:, 3]
+        return self.positions
+
+
+class FrameBuffer:
+    def __init__(self, nb_markers: int, size: int = 256):
+        """
+        Bounded ring buffer of streamed QTM frames. The producer never blocks, the oldest unread frames are
+        overwritten when the consumer is too slow.
+
+        Parameters
+        ----------
+        nb_markers: int
+            Number of markers in each frame.
+        size: int
+            Number of frames kept in the buffer.
+        """
+        self.size = size
+        self.positions = np.full((size, 3, nb_markers), np.nan)
+        self.residuals = np.full((size, nb_markers), np.nan)
+        self.frame_numbers = np.zeros(size, dtype=np.int64)
+        self.timestamps = np.zeros(size, dtype=np.int64)
+        self.arrival_ns = np.zeros(size, dtype=np.int64)
+        self.latest_arrival_ns = None
+        self.latest_residuals = None
+        self.write_count = 0
+        self.read_count = 0
+        self.last_frame_number = None
+        self.missed_frames = 0
+        self.duplicated_frames = 0
+        self.overwritten_frames = 0
+        self.new_frame = aio.Event()
+
+    def push(self, positions: np.ndarray, frame_number: int, timestamp: int, residuals: np.ndarray = None):
+        """
+        Store a frame, missed (gap in frame numbers) and duplicated frames are counted. The residuals (n_markers,)
+        are stored when streaming the 3D residual component.
+        """
+        if self.last_frame_number is not None:
+            if frame_number <= self.last_frame_number:
+                self.duplicated_frames += 1
+                return
+            self.missed_frames += frame_number - self.last_frame_number - 1
+        self.last_frame_number = frame_number
+        idx = self.write_count % self.size
+        self.positions[idx] = positions
+        if residuals is not None:
+            self.residuals[idx] = residuals
+        self.frame_numbers[idx] = frame_number
+        self.timestamps[idx] = timestamp
+        self.arrival_ns[idx] = time.perf_counter_ns()
+        self.write_count += 1
+        if self.write_count - self.read_count > self.size:
+            self.overwritten_frames += self.write_count - self.read_count - self.size
+            self.read_count = self.write_count - self.size
+        self.new_frame.set()
+
+    def get_latest(self):
+        """
+        Get the latest frame and mark every buffered frame as read.
+
+        Returns
+        -------
+        positions, frame_number, timestamp: tuple
+            Markers positions (3, n_markers) in meters, QTM frame number and timestamp, None if empty.
+        """
+        if self.write_count == 0:
+            return None
+        idx = (self.write_count - 1) % self.size
+        self.read_count = self.write_count
+        self.latest_arrival_ns = self.arrival_ns[idx]
+        self.latest_residuals = self.residuals[idx]
+        self.new_frame.clear()
+        return self.positions[idx], self.frame_numbers[idx], self.timestamps[idx]
+
+    def get_new(self):
+        """
+        Get all the frames received since the last read, oldest first.
+
+        Returns
+        -------
+        positions, frame_numbers, timestamps: tuple
+            Markers positions (n_frames, 3, n_markers) in meters, QTM frame numbers and timestamps.
+        """
+        idx = np.arange(self.read_count, self.write_count) % self.size
+        self.read_count = self.write_count
+        self.new_frame.clear()
+        return self.positions[idx], self.frame_numbers[idx], self.timestamps[idx]
+
+    async def wait(self):
+        """
+        Wait until a frame not read yet is available.
+        """
+        if self.write_count == self.read_count:
+            self.new_frame.clear()
+            await self.new_frame.wait()
+
+
+class QTMInterface:
+    def __init__(self, system_rate:float=100, ip:str= "127.0.0.1", init_now=True, residuals: bool = False):
+        """
+        Interface to the QTM real-time server.
+
+        Parameters
+        ----------
+        system_rate: float
+            Capture rate of QTM.
+        ip: str
+            Address of the QTM computer.
+        init_now: bool
+            Connect to QTM when the interface is awaited.
+        residuals: bool
+            Receive the 3D residual component, the residual (mm) of each marker is then available in residuals
+            (QTM label order) and in the residuals of each marker set (biomod order).
+        """
+        # The attributes of the biosiglive GenericInterface, which is not subclassed: importing biosiglive loads
+        # matplotlib.pyplot and scipy, it is only imported once a marker set is added
+        self.ip = ip
+        self.system_rate = system_rate
+        self.acquisition_rate = None
+        self.marker_sets = []
+        self.is_frame = False
+        self.kalman = None
+        self.interface_type = 'custom'
         self.address = ip
         self.devices = []
         self.marker_set = []
         self.offline_data = None
         self.init_now = init_now
+        self.connection = None
+        self.frame_buffer = None
+        self.frame_number = None
+        self.frame_arrival_ns = None
+        self.recorder = None
+        self.with_residuals = residuals
+        self.decoder = None
+        self.residuals = None
+        self.nb_qtm_markers = None
+        self._indices = np.zeros(0, dtype=np.intp)
+        self._ordered_data = np.zeros((0, 3))
+        self._valid = np.ones(0, dtype=bool)
+        self._ordered_residuals = np.full(0, np.nan)
 
     def __await__(self):
         return self._init_client().__await__()
 
     async def _init_client(self, realtime =False):
         if self.init_now:
+            # qtm_rt is only needed to connect, replays and benchmarks run without it
+            import qtm_rt as qtm
+
             print(f"Connection to Qualisys sdk at: {self.address}")
             connection = await qtm.connect(self.address)
             current_state = await connection.get_state()
@@ -54,15 +226,19 @@ class QTMInterface(GenericInterface):
         unlabeled: bool = False,
         subject_name: str = None,
         kinematics_method= None,
+        target_marker_list: list = None,
+        label_prefix: str = '',
         **kin_method_kwargs,
     ):
         """
-        Add markers set to stream from the Qualisys system.
+        Add markers set to stream from the Qualisys system. Several sets (e.g. one per subject or limb, each with
+        its own bioMod) can be added, they are all served from the same QTM frame.
 
         Parameters
         ----------
         nb_markers: int
-            Number of markers.
+            Number of markers of the set, those of target_marker_list if given (a set can take only some of the QTM
+            labels), otherwise every QTM label.
         name: str
             Name of the markers set.
         data_buffer_size: int
@@ -77,37 +253,172 @@ class QTMInterface(GenericInterface):
             Name of the subject. If None, the subject will be the first one in Nexus.
         kinematics_method: InverseKinematicsMethods
             Method used to compute the kinematics.
+        target_marker_list: list
+            Marker order of the biomod file, the QTM labels are mapped to it once here.
+        label_prefix: str
+            Prefix of the QTM labels of this set, e.g. 'R_' if the bioMod marker 'Acrom' is labeled 'R_Acrom'.
         **kin_method_kwargs
             Keyword arguments for the kinematics method.
         """
-        if len(self.marker_sets) != 0:
-            raise ValueError("Only one marker set can be added for now.")
-
-        markers_tmp = self._add_marker_set(
-            nb_markers=nb_markers,
-            name=name,
-            marker_names=marker_names,
-            rate=rate,
-            unlabeled=unlabeled,
-            kinematics_method=kinematics_method,
-            **kin_method_kwargs,
-        )
-        if self.connection:
-            markers_qtm = await self.connection.get_parameters(['3d'])
-            markers_xml = et.fromstring(markers_qtm)
-            labels = []
-            for i, ilabel in enumerate(markers_xml.findall('The_3D')[0].findall('Label')):
-                labels.append(ilabel.findall('Name')[0].text)
-            if len(labels) != nb_markers:
+        from biosiglive import MarkerSet
+
+        if name in [marker.name for marker in self.marker_sets]:
+            raise RuntimeError(f"The marker set '{name}' already exists.")
+        markers_tmp = MarkerSet(nb_markers, name, marker_names, rate, unlabeled, self.system_rate)
+        markers_tmp.kin_method = kinematics_method
+        markers_tmp.kin_method_kwargs = kin_method_kwargs
+        markers_tmp.interface = self.interface_type
+        markers_tmp.unit = 'm'
+        labels = await self._get_labels()
+        if labels is not None:
+            if not target_marker_list and len(labels) != nb_markers:
                 raise RuntimeError("Number of markers extracted from the qtm file not as expected")
 
             markers_tmp.subject_name = 'No subject name in QTM'
             markers_tmp.marker_names = labels
-        else:
-            # to do
-            pass
+        # Every set is gathered from the same QTM frame, of all the labels
+        if labels is not None:
+            self.nb_qtm_markers = len(labels)
+        elif self.nb_qtm_markers is None:
+            self.nb_qtm_markers = nb_markers
         markers_tmp.data_windows = data_buffer_size
+        markers_tmp.label_prefix = label_prefix
+        self._set_marker_order(markers_tmp, target_marker_list)
         self.marker_sets.append(markers_tmp)
+        self._gather_marker_sets()
+
+    async def _get_labels(self):
+        """
+        Get the 3D marker labels of the QTM project, None if not connected.
+        """
+        if not self.connection:
+            return None
+        markers_qtm = await self.connection.get_parameters(['3d'])
+        markers_xml = et.fromstring(markers_qtm)
+        labels = []
+        for i, ilabel in enumerate(markers_xml.findall('The_3D')[0].findall('Label')):
+            labels.append(ilabel.findall('Name')[0].text)
+        return labels
+
+    @staticmethod
+    def _set_marker_order(markers, target_marker_list=None):
+        """
+        Compute the QTM label -> biomod marker index array and the preallocated buffer it is gathered into.
+        The indices point in the frame of all the QTM labels (marker_names), the set holding nb_channels of them.
+        new_data is a (3, n_markers, 1) view of that buffer, it is overwritten by each new frame, and valid
+        flags the markers QTM did not see (NaN) in that frame. The indices are checked here once, so that the
+        gather of each frame can skip its bounds check.
+        """
+        if target_marker_list and markers.marker_names:
+            label_idx = {label: i for i, label in enumerate(markers.marker_names)}
+            prefix = getattr(markers, 'label_prefix', '')
+            missing = [name for name in target_marker_list if prefix + name not in label_idx]
+            if missing:
+                raise ValueError(f"Markers {missing} of the biomod have no QTM label (prefix '{prefix}').")
+            if len(target_marker_list) != markers.nb_channels:
+                raise ValueError(f"The {len(target_marker_list)} target markers of {markers.name} do not match its "
+                                 f"{markers.nb_channels} markers.")
+            markers.indices = np.array([label_idx[prefix + name] for name in target_marker_list], dtype=np.intp)
+        else:
+            markers.indices = np.arange(markers.nb_channels, dtype=np.intp)
+            if markers.marker_names and len(markers.marker_names) < markers.nb_channels:
+                raise ValueError(f"The QTM labels of {markers.name} do not match its {markers.nb_channels} markers.")
+        markers.target_marker_list = target_marker_list
+        markers.ordered_data = np.zeros((len(markers.indices), 3))
+        markers.valid = np.ones(len(markers.indices), dtype=bool)
+        markers.residuals = np.full(len(markers.indices), np.nan)
+        markers.new_data = markers.ordered_data.T[:, :, np.newaxis]
+
+    def _gather_marker_sets(self):
+        """
+        Concatenate the indices of every marker set so that a frame is reordered with a single gather, each set
+        then reads its markers through views of the shared buffers.
+        """
+        self._indices = np.concatenate([markers.indices for markers in self.marker_sets])
+        self._ordered_data = np.zeros((self._indices.size, 3))
+        self._valid = np.ones(self._indices.size, dtype=bool)
+        self._ordered_residuals = np.full(self._indices.size, np.nan)
+        start = 0
+        for markers in self.marker_sets:
+            end = start + markers.indices.size
+            markers.ordered_data = self._ordered_data[start:end]
+            markers.valid = self._valid[start:end]
+            markers.residuals = self._ordered_residuals[start:end]
+            markers.new_data = markers.ordered_data.T[:, :, np.newaxis]
+            start = end
+
+    def _on_packet(self, packet):
+        pos = self.decoder.decode(packet)
+        self.frame_buffer.push(pos.T, packet.framenumber, packet.timestamp,
+                               self.decoder.residuals if self.with_residuals else None)
+
+    async def start_streaming(self, buffer_size: int = 256, frames: str = 'allframes'):
+        """
+        Stream every frame from QTM into a ring buffer instead of polling the current frame.
+        get_marker_set_data then returns the latest streamed frame.
+
+        Parameters
+        ----------
+        buffer_size: int
+            Number of frames kept in the ring buffer.
+        frames: str
+            Which frames to receive, 'allframes', 'frequency:n' or 'frequencydivisor:n'.
+        """
+        if len(self.marker_sets) == 0:
+            raise ValueError("No marker set has been added to the QTM system.")
+        self.frame_buffer = FrameBuffer(self.nb_qtm_markers, buffer_size)
+        self.decoder = PacketDecoder(self.nb_qtm_markers, self.with_residuals)
+        await self.connection.stream_frames(frames=frames, components=[self.decoder.component_name],
+                                            on_packet=self._on_packet)
+
+    async def stop_streaming(self):
+        await self.connection.stream_frames_stop()
+        self.frame_buffer = None
+
+    def get_latest_frame(self):
+        """
+        Latest streamed frame as (positions, frame_number, timestamp), see FrameBuffer.get_latest.
+        """
+        return self.frame_buffer.get_latest()
+
+    def get_new_frames(self):
+        """
+        All the streamed frames since the last read, see FrameBuffer.get_new.
+        """
+        return self.frame_buffer.get_new()
+
+    async def _get_current_frame(self):
+        """
+        Get the markers of the current frame, from the stream buffer if streaming.
+
+        Returns
+        -------
+        pos, timestamp: tuple
+            Markers positions (n_markers, 3) in meters in the QTM label order, overwritten by the next frame, and
+            QTM timestamp.
+        """
+        if self.frame_buffer is not None:
+            await self.frame_buffer.wait()
+            pos, self.frame_number, frame = self.frame_buffer.get_latest()
+            self.frame_arrival_ns = self.frame_buffer.latest_arrival_ns
+            if self.with_residuals:
+                self.residuals = self.frame_buffer.latest_residuals
+            return pos.T, frame
+        if self.decoder is None:
+            self.decoder = PacketDecoder(self.nb_qtm_markers, self.with_residuals)
+        frame_data = await self.connection.get_current_frame([self.decoder.component_name])
+        self.frame_arrival_ns = time.perf_counter_ns()
+        self.frame_number = frame_data.framenumber
+        pos = self.decoder.decode(frame_data)
+        if self.with_residuals:
+            self.residuals = self.decoder.residuals
+        return pos, frame_data.timestamp
+
+    def get_frame_number(self):
+        """
+        QTM frame number of the last frame returned by get_marker_set_data.
+        """
+        return self.frame_number
 
     async def get_marker_set_data(
             self,
@@ -132,46 +443,42 @@ class QTMInterface(GenericInterface):
         update_marker_order: bool
             Account for changes in marker order between the biomod and the qtm file
         target_marker_list: Union[str, list]
-            Target marker order to align with the biomod file
+            Target marker order to align with the biomod file, only needed if it was not given to add_marker_set.
+            Applied to every marker set.
 
         Returns
         -------
         markers_data: list
-            All asked markers data.
+            All asked markers data, views of the marker set buffers valid until the next call. A single array if
+            there is only one marker set.
         """
         if len(self.marker_sets) == 0:
             raise ValueError("No marker set has been added to the QTM system.")
+        tic = time.perf_counter_ns()
         if get_frame:
-            self.get_frame()
-            frame_data = await self.connection.get_current_frame(['3d'])
-            pos = np.array(frame_data.get_3d_markers()[1]) * 1e-3 #TODO: check unit of data
-            frame = frame_data.timestamp
-
-        if target_marker_list:
-            if marker_names == target_marker_list:
-                update_marker_order = False
-            else:
-                update_marker_order = True
-                new_indices = [marker_names.index(i) for i in target_marker_list]
-                for mark in self.marker_sets:
-                    mark.indices = new_indices
-
-        marker_names=target_marker_list
-
-        if marker_names and isinstance(marker_names, list):
-            marker_names = [marker_names]
+            pos, frame = await self._get_current_frame()
+        if self.recorder is not None and get_frame:
+            self.recorder.begin_frame(self.frame_number, frame, self.frame_arrival_ns)
+            self.recorder.record('acquisition', max(tic, self.frame_arrival_ns), time.perf_counter_ns())
+            tic = time.perf_counter_ns()
 
         all_markers_data = []
 
+        if target_marker_list and any(target_marker_list != markers.target_marker_list
+                                      for markers in self.marker_sets):
+            for markers in self.marker_sets:
+                self._set_marker_order(markers, target_marker_list)
+            self._gather_marker_sets()
+        # The indices are validated by _set_marker_order, clip avoids the buffered copy of the default raise mode
+        np.take(pos, self._indices, axis=0, out=self._ordered_data, mode='clip')
+        np.isfinite(self._ordered_data).all(axis=1, out=self._valid)
+        if self.residuals is not None:
+            np.take(self.residuals, self._indices, out=self._ordered_residuals, mode='clip')
         for markers in self.marker_sets:
-            markers.new_data = np.zeros((3, len(markers.marker_names), markers.sample))
-            markers_data = np.zeros((3, len(markers.marker_names), markers.sample))
-            for i, imark in enumerate(markers.indices):
-                markers_data[:, i, :] = pos.T[:, imark, np.newaxis]
-                markers.new_data[:, i, :] = pos.T[:, imark, np.newaxis]
-
-            all_markers_data.append(markers_data)
+            all_markers_data.append(markers.new_data)
             markers.append_data(pos)
+        if self.recorder is not None:
+            self.recorder.record('reorder', tic, time.perf_counter_ns())
 
         if len(all_markers_data) == 1:
             return all_markers_data[0], frame
@@ -183,6 +490,7 @@ class QTMInterface(GenericInterface):
         model_path: str = None,
         method: Union[list, str] = 'kalman',
         custom_func: callable = None,
+        solver=None,
         **kwargs,
     ):
         """
@@ -193,12 +501,14 @@ class QTMInterface(GenericInterface):
         marker_set_name: str
             name of the markerset.
         model_path: str
-            biorbd model of the kinematics.
+            biorbd model of the kinematics, parsed once per session through the model registry.
         method: str
             Method to use to get the kinematics. Can be "kalman" or "custom".
         custom_func: function
             Custom function to get the kinematics.
-
+        solver: LeastSquaresIK
+            Persistent solver bound to a loaded model. If given, model_path and method are ignored and the
+            last markers of the set are solved warm-started from the previous frame, without the occluded ones.
 
         Returns
         -------
@@ -206,6 +516,57 @@ class QTMInterface(GenericInterface):
             List of kinematics.
         """
         marker_set_idx = [i for i, m in enumerate(self.marker_sets) if m.name == marker_set_name][0]
+        if solver is not None:
+            marker_set = self.marker_sets[marker_set_idx]
+            return solver.solve(marker_set.new_data, valid=marker_set.valid)
+        if isinstance(model_path, str):
+            from model_cache import get_model
+
+            model_path = get_model(model_path)
         return self.marker_sets[marker_set_idx].get_kinematics(model_path, method,
                                                                       custom_func=custom_func,
-                                                                      **kwargs)
\ No newline at end of file
+                                                                      **kwargs)
+
+    async def get_kinematics_from_marker_sets(self, solvers: dict):
+        """
+        Solve the last frame of several marker sets, each one with its own solver. Only IKWorker solvers run in
+        parallel, each in its own process: the frames of the workers are submitted first, then the in-process
+        solvers solve their sets one after another in this thread while the workers run. In-process solvers
+        (biorbd and scipy hold the GIL) would gain nothing from threads, use one IKWorker per set to solve
+        several sets concurrently.
+
+        Parameters
+        ----------
+        solvers: dict
+            Persistent solver (LeastSquaresIK, ShoulderChainIK or a started IKWorker) of each marker set name.
+
+        Returns
+        -------
+        kinematics: dict
+            q and qdot (n_q, 1) of each marker set name.
+        """
+        marker_sets = {markers.name: markers for markers in self.marker_sets}
+        # ik_worker loads multiprocessing and shared_memory, a solver can only be an IKWorker once it is imported
+        is_worker = dict.fromkeys(solvers, False)
+        if 'ik_worker' in sys.modules:
+            from ik_worker import IKWorker
+
+            is_worker = {name: isinstance(solver, IKWorker) for name, solver in solvers.items()}
+        for name, solver in solvers.items():
+            if is_worker[name]:
+                solver.submit(marker_sets[name].ordered_data.T, marker_sets[name].valid, self.frame_number)
+
+        async def solve(name, solver):
+            markers = marker_sets[name]
+            if is_worker[name]:
+                q, qdot, _ = await solver.wait_result()
+                return q[:, np.newaxis], qdot[:, np.newaxis]
+            return solver.solve(markers.new_data, valid=markers.valid)
+
+        # The in-process solvers are run before the workers are awaited, so they overlap with the workers
+        results = {name: await solve(name, solver) for name, solver in solvers.items()
+                   if not is_worker[name]}
+        for name, solver in solvers.items():
+            if is_worker[name]:
+                results[name] = await solve(name, solver)
+        return {name: results[name] for name in solvers}
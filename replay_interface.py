@@ -0,0 +1,111 @@
+"""
+Replay of recorded marker trajectories through the QTMInterface surface, without QTM.
+"""
+import time
+import asyncio as aio
+from pathlib import Path
+import numpy as np
+
+from qtm_interface import QTMInterface
+
+
+def load_trial(path: str, marker_names: list = None):
+    """
+    Load a recorded marker trial.
+
+    Parameters
+    ----------
+    path: str
+        C3D file, or .npy array (3, n_markers, n_frames) in meters.
+    marker_names: list
+        Marker labels of a .npy trial. C3D labels are read from the file.
+
+    Returns
+    -------
+    markers, labels, rate: tuple
+        Markers (3, n_markers, n_frames) in meters, labels and capture rate (None for .npy).
+    """
+    if Path(path).suffix.lower() == '.c3d':
+        import ezc3d
+
+        c3d = ezc3d.c3d(str(path))
+        points = c3d['parameters']['POINT']
+        labels = points['LABELS']['value']
+        scale = 1e-3 if points['UNITS']['value'][0] == 'mm' else 1
+        markers = c3d['data']['points'][:3] * scale
+        return markers, labels, c3d['header']['points']['frame_rate']
+    markers = np.load(path)
+    if marker_names is not None and len(marker_names) != markers.shape[1]:
+        raise ValueError("The number of marker names and the number of markers in the file are not the same.")
+    return markers, marker_names, None
+
+
+class ReplayInterface(QTMInterface):
+    def __init__(self, trial_path: str, marker_names: list = None, system_rate: float = None,
+                 realtime: bool = False, loop: bool = False):
+        """
+        Interface replaying a recorded trial as if it was streamed by QTM.
+
+        Parameters
+        ----------
+        trial_path: str
+            C3D file, or .npy array (3, n_markers, n_frames) in meters.
+        marker_names: list
+            Marker labels of a .npy trial, the file is assumed in the target order if None.
+        system_rate: float
+            Rate of the trial, read from the C3D if None.
+        realtime: bool
+            Pace the frames at the trial rate, the frames already past are skipped when the reader is late.
+            Otherwise frames are served as fast as possible.
+        loop: bool
+            Restart from the first frame at the end of the trial instead of raising EOFError. The frame numbers
+            and timestamps keep increasing across the loops, as QTM would stream them.
+        """
+        markers, labels, file_rate = load_trial(trial_path, marker_names)
+        system_rate = system_rate if system_rate else file_rate if file_rate else 100
+        super().__init__(system_rate=system_rate, init_now=False)
+        self.trial_path = trial_path
+        self.markers = np.ascontiguousarray(markers.transpose(2, 1, 0))
+        self.labels = labels
+        self.nb_qtm_markers = self.markers.shape[1]
+        self.realtime = realtime
+        self.loop = loop
+        self.frame_idx = 0
+        self.loop_count = 0
+        self._t0 = None
+
+    @property
+    def nb_frames(self):
+        return self.markers.shape[0]
+
+    async def _get_labels(self):
+        return self.labels
+
+    def rewind(self):
+        self.frame_idx = 0
+        self.loop_count = 0
+        self._t0 = None
+
+    async def _get_current_frame(self):
+        if self.frame_idx >= self.nb_frames:
+            if not self.loop:
+                raise EOFError(f"End of the replayed trial {self.trial_path}")
+            self.frame_idx = 0
+            self.loop_count += 1
+            self._t0 = None
+        if self.realtime:
+            if self._t0 is None:
+                self._t0 = time.perf_counter()
+            due_idx = min(int((time.perf_counter() - self._t0) * self.system_rate), self.nb_frames - 1)
+            if due_idx > self.frame_idx:
+                # Late, the stale frames are skipped as QTM would stream past them
+                self.frame_idx = due_idx
+            else:
+                await aio.sleep(max(0., self._t0 + self.frame_idx / self.system_rate - time.perf_counter()))
+        pos = self.markers[self.frame_idx]
+        frame = self.loop_count * self.nb_frames + self.frame_idx
+        timestamp = int(frame * 1e6 / self.system_rate)
+        self.frame_idx += 1
+        self.frame_number = frame + 1
+        self.frame_arrival_ns = time.perf_counter_ns()
+        return pos, timestamp
@@ -0,0 +1,288 @@
+"""
+Offline reprocessing of every participant of a results root, one participant per process.
+
+Each participant folder holds its scaled model in _models (an osim, converted once through the model cache, or a
+bioMod) and its trials anywhere below it, C3D files or recorded sessions (see session_recorder). The q and GH
+angles of each trial are written in columns, one file per trial under the output folder:
+
+    python reprocess.py --root D:\\Shoulder_ER_IR\\Analysis\\results --workers 4
+    python reprocess.py --root results --participants 00IB 01JD --gh-convention yxy --format parquet
+
+Each participant keeps a manifest of the trials done with the current model and options, an interrupted job
+started again only solves what is missing, and a model change reprocesses everything of that participant.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import numpy as np
+
+from ik_solvers import IK_SOLVERS
+from Parameters import results_root, model_folder, model_name
+
+MANIFEST_FILE = 'manifest.json'
+OUTPUT_FOLDER = '_reprocessed'
+FORMATS = ('npz', 'csv', 'parquet')
+
+
+def find_model(participant_dir: Path, folder: str = model_folder, name: str = model_name):
+    """
+    Model of a participant: the osim named as in Parameters, else the only osim, else the only bioMod of its
+    model folder. None if there is none.
+    """
+    models_dir = participant_dir / folder
+    if (models_dir / name).exists():
+        return models_dir / name
+    for pattern in ('*.osim', '*.bioMod'):
+        models = sorted(models_dir.glob(pattern))
+        if len(models) > 1:
+            raise ValueError(f"Several {pattern} in {models_dir}, name the one to use with --model-name.")
+        if models:
+            return models[0]
+    return None
+
+
+def find_trials(participant_dir: Path, excluded: tuple = (model_folder, OUTPUT_FOLDER)):
+    """
+    C3D trials and recorded session folders of a participant, outside of the model and output folders.
+    """
+    trials = list(participant_dir.rglob('*.c3d')) + [header.parent for header in participant_dir.rglob('header.json')]
+    return sorted(trial for trial in trials if not any(part in excluded for part in trial.relative_to(
+        participant_dir).parts))
+
+
+def find_participants(root: str, participants: list = None, folder: str = model_folder, name: str = model_name):
+    """
+    Participant folders of the results root with a model, all of them or only the given ones.
+    """
+    root = Path(root)
+    if participants:
+        participant_dirs = [root / participant for participant in participants]
+    else:
+        participant_dirs = sorted(path for path in root.iterdir() if path.is_dir() and path.name != OUTPUT_FOLDER)
+    return [path for path in participant_dirs if find_model(path, folder, name) is not None]
+
+
+def trial_key(trial: Path, biomod_path: str, options: dict):
+    """
+    Hash of the bioMod content, the trial files (size and modification time) and the reprocessing options.
+    """
+    key = hashlib.sha256(Path(biomod_path).read_bytes())
+    files = sorted(trial.iterdir()) if trial.is_dir() else [trial]
+    for path in files:
+        stat = path.stat()
+        key.update(f'{path.name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    key.update(json.dumps(options, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def load_trial_markers(trial: Path, marker_order: list, rate: float = None):
+    """
+    Markers (3, n_markers, n_frames) in meters and bioMod order, frame numbers and rate of a C3D or a session.
+    """
+    if trial.is_dir():
+        from session_recorder import open_session
+
+        frames, header = open_session(str(trial))
+        if header['marker_names'] and header['marker_names'] != marker_order:
+            raise ValueError(f'The markers of {trial} are not those of the model.')
+        markers = np.asarray(frames['markers'], dtype=np.float64).transpose(1, 2, 0)
+        return markers, np.asarray(frames['frame_number']), rate if rate else header['rate']
+    from batch_ik import load_ordered_markers
+
+    markers, file_rate = load_ordered_markers(str(trial), marker_order)
+    return markers, np.arange(1, markers.shape[2] + 1), rate if rate else file_rate if file_rate else 100
+
+
+def trial_columns(model, gh_angles, markers: np.ndarray, frame_numbers: np.ndarray, rate: float,
+                  ik_method: str = 'least_squares'):
+    """
+    Solve a whole trial and gather its columns: frame number, time, q of each degree of freedom and GH angles.
+    """
+    from gh_angles import GH_DOF_NAMES
+
+    ik_solver = IK_SOLVERS[ik_method](model, rate=rate)
+    q, _ = ik_solver.solve(markers)
+    columns = {'frame_number': frame_numbers, 'time': np.arange(q.shape[1]) / rate}
+    columns.update({f'q_{dof.to_string()}': q[i] for i, dof in enumerate(model.nameDof())})
+    columns.update({f'gh_{name}': angles for name, angles in zip(GH_DOF_NAMES, gh_angles(q))})
+    return columns
+
+
+def write_columns(path: Path, columns: dict, output_format: str = 'npz'):
+    """
+    Write the columns next to their final path and move them there once complete, so that an interrupted job
+    never leaves a truncated output.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    if output_format == 'npz':
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **columns)
+    elif output_format == 'csv':
+        np.savetxt(tmp_path, np.column_stack(list(columns.values())), delimiter=',', header=','.join(columns),
+                   comments='', fmt=['%d'] + ['%.8g'] * (len(columns) - 1))
+    else:
+        import pandas as pd
+
+        pd.DataFrame(columns).to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_manifest(path: Path, manifest: dict):
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=1))
+    os.replace(tmp_path, path)
+
+
+def reprocess_participant(participant_dir: str, output_dir: str, ik_method: str = 'least_squares',
+                          gh_convention: str = 'model', rate: float = None, output_format: str = 'npz',
+                          force: bool = False, folder: str = model_folder, name: str = model_name):
+    """
+    Solve every trial of a participant not done yet with its current model and these options.
+
+    Parameters
+    ----------
+    participant_dir: str
+        Folder of the participant.
+    output_dir: str
+        Folder of the participant outputs and manifest.
+    ik_method: str
+        Solver of ik_solvers.IK_SOLVERS.
+    gh_convention: str
+        Convention of the GH angles, see gh_angles.GHAngles.
+    rate: float
+        Rate of the trials, read from the C3D or the session if None.
+    output_format: str
+        'npz', 'csv' or 'parquet' (needs pandas).
+    force: bool
+        Solve every trial again, even those in the manifest.
+    folder, name: str
+        Model folder and model file name of the participant, see find_model.
+
+    Returns
+    -------
+    stats: dict
+        Participant, number of trials solved, skipped and failed, frames solved, model load and solve time.
+    """
+    from model_cache import convert_osim, get_model
+    from gh_angles import GHAngles
+
+    participant_dir, output_dir = Path(participant_dir), Path(output_dir)
+    stats = {'participant': participant_dir.name, 'solved': 0, 'skipped': 0, 'failed': 0, 'frames': 0,
+             'load_time': 0., 'solve_time': 0.}
+    tic = time.perf_counter()
+    model_path = find_model(participant_dir, folder, name)
+    biomod_path = convert_osim(str(model_path)) if model_path.suffix == '.osim' else str(model_path)
+    model = get_model(biomod_path)
+    marker_order = [marker.to_string() for marker in model.markerNames()]
+    gh_angles = GHAngles(model, convention=gh_convention)
+    stats['load_time'] = time.perf_counter() - tic
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_FILE
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() and not force else {}
+    options = {'ik_method': ik_method, 'gh_convention': gh_convention, 'rate': rate, 'format': output_format}
+    for trial in find_trials(participant_dir, (folder, OUTPUT_FOLDER)):
+        trial_name = trial.relative_to(participant_dir).as_posix()
+        output_path = output_dir / (trial_name.replace('/', '__').removesuffix('.c3d') + '.' + output_format)
+        key = trial_key(trial, biomod_path, options)
+        if manifest.get(trial_name) == key and output_path.exists():
+            stats['skipped'] += 1
+            continue
+        tic = time.perf_counter()
+        try:
+            markers, frame_numbers, trial_rate = load_trial_markers(trial, marker_order, rate)
+            columns = trial_columns(model, gh_angles, markers, frame_numbers, trial_rate, ik_method)
+            write_columns(output_path, columns, output_format)
+        except Exception as error:
+            print(f'{participant_dir.name}/{trial_name} failed: {error!r}')
+            stats['failed'] += 1
+            continue
+        stats['solve_time'] += time.perf_counter() - tic
+        stats['solved'] += 1
+        stats['frames'] += markers.shape[2]
+        manifest[trial_name] = key
+        _write_manifest(manifest_path, manifest)
+    return stats
+
+
+def reprocess(root: str, output_root: str = None, participants: list = None, n_workers: int = None, **options):
+    """
+    Reprocess the participants of a results root across a process pool, one participant per task, and report the
+    throughput.
+
+    Parameters
+    ----------
+    root: str
+        Results root holding a folder per participant.
+    output_root: str
+        Folder of the outputs, <root>/_reprocessed if None, with a folder per participant.
+    participants: list
+        Names of the participants to reprocess, all of them if None.
+    n_workers: int
+        Number of processes, all the cores if None.
+    **options
+        Keyword arguments of reprocess_participant.
+
+    Returns
+    -------
+    stats: list
+        Stats of each participant, see reprocess_participant.
+    """
+    folder, name = options.get('folder', model_folder), options.get('name', model_name)
+    participant_dirs = find_participants(root, participants, folder, name)
+    output_root = Path(output_root) if output_root else Path(root) / OUTPUT_FOLDER
+    print(f'{len(participant_dirs)} participants in {root}')
+    tic = time.perf_counter()
+    all_stats = []
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {pool.submit(reprocess_participant, str(path), str(output_root / path.name), **options): path
+                   for path in participant_dirs}
+        for future in as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as error:
+                print(f'{futures[future].name} failed: {error!r}')
+                continue
+            fps = stats['frames'] / stats['solve_time'] if stats['solve_time'] else 0
+            print(f'{stats["participant"]:<12} {stats["solved"]} trials solved, {stats["skipped"]} already done, '
+                  f'{stats["failed"]} failed | {stats["frames"]} frames at {fps:.0f} fps | '
+                  f'model loaded in {stats["load_time"]:.1f} s')
+            all_stats.append(stats)
+    duration = time.perf_counter() - tic
+    frames = sum(stats['frames'] for stats in all_stats)
+    print(f'{len(all_stats)}/{len(participant_dirs)} participants, '
+          f'{sum(stats["solved"] for stats in all_stats)} trials solved, '
+          f'{sum(stats["skipped"] for stats in all_stats)} already done, '
+          f'{sum(stats["failed"] for stats in all_stats)} failed in {duration:.1f} s | '
+          f'{frames / duration:.0f} frames/s, {len(all_stats) / duration * 60:.1f} participants/min')
+    return all_stats
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Reprocess the trials of every participant of a results root')
+    PARSER.add_argument('--root', dest='root', default=results_root, help='Results root, one folder per participant')
+    PARSER.add_argument('--output', dest='output', default=None,
+                        help=f'Output root, {OUTPUT_FOLDER} in the results root if omitted')
+    PARSER.add_argument('--participants', dest='participants', nargs='+', default=None,
+                        help='Participants to reprocess, all the folders of the root with a model if omitted')
+    PARSER.add_argument('--workers', dest='workers', type=int, default=None, help='Processes, all the cores if omitted')
+    PARSER.add_argument('--ik', dest='ik_method', default='least_squares',
+                        choices=list(IK_SOLVERS))
+    PARSER.add_argument('--gh-convention', dest='gh_convention', default='model',
+                        help='GH angles: model for the plane, elevation and axial rotation dofs, or an intrinsic '
+                             'sequence of the humerus in the scapula, e.g. yxy (ISB)')
+    PARSER.add_argument('--rate', dest='rate', type=float, default=None,
+                        help='Rate of the trials, read from the C3D or the session if omitted')
+    PARSER.add_argument('--format', dest='output_format', default='npz', choices=FORMATS)
+    PARSER.add_argument('--model-folder', dest='model_folder', default=model_folder)
+    PARSER.add_argument('--model-name', dest='model_name', default=model_name)
+    PARSER.add_argument('--force', dest='force', action='store_true',
+                        help='Solve every trial again instead of resuming')
+    ARGS = PARSER.parse_args()
+    reprocess(ARGS.root, ARGS.output, ARGS.participants, ARGS.workers, ik_method=ARGS.ik_method,
+              gh_convention=ARGS.gh_convention, rate=ARGS.rate, output_format=ARGS.output_format, force=ARGS.force,
+              folder=ARGS.model_folder, name=ARGS.model_name)
@@ -0,0 +1,210 @@
+"""
+Append-only binary recording of a feedback session.
+
+A session is a folder holding frames.bin, a preallocated memory-mapped array of fixed size records, and
+header.json describing the records. The acquisition loop only copies each frame into an in-memory staging ring,
+a background thread moves the staged frames to the file.
+"""
+import json
+import time
+import threading
+from pathlib import Path
+import numpy as np
+
+HEADER_FILE = 'header.json'
+FRAMES_FILE = 'frames.bin'
+
+
+def frame_dtype(nb_markers: int, nb_q: int):
+    """
+    Record of one frame: QTM frame number and timestamp, raw markers (meters, bioMod order), q and qdot with the
+    frame number they were solved from, reference pose and feedback ellipse (center x, center y, width, height).
+    """
+    return np.dtype([
+        ('frame_number', np.int64),
+        ('timestamp', np.int64),
+        ('markers', np.float32, (3, nb_markers)),
+        ('ik_frame_number', np.int64),
+        ('q', np.float64, (nb_q,)),
+        ('qdot', np.float64, (nb_q,)),
+        ('q_ref', np.float64, (nb_q,)),
+        ('ellipse', np.float64, (4,)),
+    ])
+
+
+class SessionRecorder:
+    def __init__(self, path: str, nb_markers: int, nb_q: int, rate: float = 100, marker_names: list = None,
+                 capacity: int = 360000, staging_size: int = 1024, flush_interval: float = 0.5):
+        """
+        Parameters
+        ----------
+        path: str
+            Folder of the session, created if needed.
+        nb_markers: int
+            Number of markers per frame.
+        nb_q: int
+            Number of generalized coordinates.
+        rate: float
+            Rate of the frames.
+        marker_names: list
+            Names of the markers, in the recorded order.
+        capacity: int
+            Number of frames preallocated on disk, the file grows by the same amount when it is full
+            (one hour at 100 Hz by default).
+        staging_size: int
+            Number of frames the acquisition can get ahead of the writer before frames are dropped.
+        flush_interval: float
+            Period of the background writer, in seconds.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = frame_dtype(nb_markers, nb_q)
+        self.header = {
+            'nb_markers': nb_markers,
+            'nb_q': nb_q,
+            'rate': rate,
+            'marker_names': marker_names,
+            'dtype': self.dtype.descr,
+            'n_frames': 0,
+            'references': [],
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.capacity = capacity
+        self.growth = capacity
+        self.flush_interval = flush_interval
+        self.frames = np.memmap(self.path / FRAMES_FILE, dtype=self.dtype, mode='w+', shape=(capacity,))
+        self._staging = np.zeros(staging_size, dtype=self.dtype)
+        self._q_ref = np.zeros(nb_q)
+        self.write_count = 0
+        self.written_count = 0
+        self.dropped_frames = 0
+        self.write_time = []
+        # The header is changed by the acquisition (references) and written by the writer thread
+        self._header_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._is_running = True
+        self._write_header()
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def _write_header(self):
+        with self._header_lock:
+            text = json.dumps(self.header, indent=1)
+        tmp_path = self.path / (HEADER_FILE + '.tmp')
+        tmp_path.write_text(text)
+        tmp_path.replace(self.path / HEADER_FILE)
+
+    def set_reference(self, q_ref: np.ndarray):
+        """
+        Reference pose stored with the following frames, and in the header with the frame it starts from.
+        """
+        self._q_ref[:] = q_ref
+        reference = {'from_frame': self.write_count, 'q_ref': self._q_ref.tolist()}
+        with self._header_lock:
+            self.header['references'].append(reference)
+
+    def record(self, frame_number: int, timestamp: int, markers: np.ndarray, q: np.ndarray, qdot: np.ndarray,
+               ellipse=(0, 0, 0, 0), ik_frame_number: int = None):
+        """
+        Stage a frame for writing, never blocks on disk. The frame is dropped if the writer is too far behind.
+
+        Parameters
+        ----------
+        frame_number: int
+            QTM frame number.
+        timestamp: int
+            QTM timestamp (microseconds).
+        markers: np.ndarray
+            Raw markers (3, n_markers) in meters.
+        q, qdot: np.ndarray
+            Generalized coordinates and velocities (n_q,).
+        ellipse: tuple
+            Feedback ellipse center x, center y, width and height.
+        ik_frame_number: int
+            Frame number q was solved from, frame_number if None.
+        """
+        if self.write_count - self.written_count >= self._staging.size:
+            self.dropped_frames += 1
+            return
+        row = self._staging[self.write_count % self._staging.size]
+        row['frame_number'] = frame_number
+        row['timestamp'] = timestamp
+        row['markers'] = markers
+        row['ik_frame_number'] = frame_number if ik_frame_number is None else ik_frame_number
+        row['q'] = q
+        row['qdot'] = qdot
+        row['q_ref'] = self._q_ref
+        row['ellipse'] = ellipse
+        self.write_count += 1
+        if self.write_count - self.written_count >= self._staging.size // 2:
+            self._wake_up.set()
+
+    def _grow(self):
+        self.frames.flush()
+        self.capacity += self.growth
+        self.frames = np.memmap(self.path / FRAMES_FILE, dtype=self.dtype, mode='r+', shape=(self.capacity,))
+
+    def _write_staged(self):
+        tic = time.perf_counter()
+        count = self.write_count
+        while self.written_count < count:
+            start = self.written_count % self._staging.size
+            n_frames = min(count - self.written_count, self._staging.size - start,
+                           self.capacity - self.written_count)
+            if n_frames == 0:
+                self._grow()
+                continue
+            self.frames[self.written_count:self.written_count + n_frames] = self._staging[start:start + n_frames]
+            self.written_count += n_frames
+        self.frames.flush()
+        with self._header_lock:
+            self.header['n_frames'] = self.written_count
+            self.header['dropped_frames'] = self.dropped_frames
+        self._write_header()
+        self.write_time.append(time.perf_counter() - tic)
+
+    def _writer(self):
+        while self._is_running:
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+            self._write_staged()
+
+    def close(self):
+        """
+        Write the remaining frames and trim the file to the recorded frames.
+        """
+        if not self._is_running:
+            return
+        self._is_running = False
+        self._wake_up.set()
+        self.thread.join()
+        self._write_staged()
+        # The mapping must be released before the file can be trimmed
+        del self.frames
+        with open(self.path / FRAMES_FILE, 'r+b') as file:
+            file.truncate(self.written_count * self.dtype.itemsize)
+        print(f'Session saved in {self.path}: {self.written_count} frames, {self.dropped_frames} dropped')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_session(path: str):
+    """
+    Memory-map a recorded session for analysis, without reading it in memory.
+
+    Returns
+    -------
+    frames, header: tuple
+        Read-only structured array of the recorded frames (fields as in frame_dtype, e.g. frames['q']) and the
+        session header.
+    """
+    path = Path(path)
+    header = json.loads((path / HEADER_FILE).read_text())
+    dtype = frame_dtype(header['nb_markers'], header['nb_q'])
+    if header['n_frames'] == 0:
+        return np.zeros(0, dtype=dtype), header
+    return np.memmap(path / FRAMES_FILE, dtype=dtype, mode='r', shape=(header['n_frames'],)), header
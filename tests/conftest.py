@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+
+@pytest.fixture(scope='session')
+def biomod_path():
+    return str(REPO_DIR / 'Wu_Shoulder_Model.bioMod')
+
+
+@pytest.fixture(scope='session')
+def model(biomod_path):
+    pytest.importorskip('biorbd')
+    from model_cache import get_model
+
+    return get_model(biomod_path)
+
+
+@pytest.fixture(scope='session')
+def trial_q(model, n_frames=60, rate=100, seed=0):
+    """
+    Smooth joint trajectories (n_q, n_frames) inside the ranges of the model.
+    """
+    from ik_solvers import get_q_bounds
+
+    q_min, q_max = get_q_bounds(model)
+    q_min, q_max = np.maximum(q_min, -np.pi), np.minimum(q_max, np.pi)
+    t = np.arange(n_frames) / rate
+    phase = np.random.default_rng(seed).uniform(0, 2 * np.pi, model.nbQ())
+    return (q_min + q_max)[:, None] / 2 + (q_max - q_min)[:, None] / 8 * np.sin(2 * np.pi * t + phase[:, None])
+
+
+@pytest.fixture(scope='session')
+def trial_markers(model, trial_q):
+    """
+    Markers (3, n_markers, n_frames) of the model following trial_q, without noise.
+    """
+    markers = np.zeros((3, model.nbMarkers(), trial_q.shape[1]))
+    for i in range(trial_q.shape[1]):
+        markers[:, :, i] = np.array([mark.to_array() for mark in model.markers(trial_q[:, i])]).T
+    return markers
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from batch_ik import batch_inverse_kinematics, load_ordered_markers, split_chunks
+
+
+@pytest.mark.parametrize('n_frames, chunk_size, overlap', [(1000, 300, 10), (300, 300, 10), (10, 300, 0),
+                                                           (601, 200, 50)])
+def test_split_chunks(n_frames, chunk_size, overlap):
+    chunks = split_chunks(n_frames, chunk_size, overlap)
+    # The kept frames of the chunks cover the trial once, in order
+    np.testing.assert_array_equal(np.concatenate([np.arange(start, end) for _, start, end in chunks]),
+                                  np.arange(n_frames))
+    assert chunks[0][0] == 0
+    for first, start, end in chunks[1:]:
+        assert first == start - overlap
+        assert end - start <= chunk_size
+
+
+def test_load_ordered_markers_npy(tmp_path):
+    markers = np.random.default_rng(0).normal(0, 1, (3, 4, 5))
+    np.save(tmp_path / 'trial.npy', markers)
+    loaded, rate = load_ordered_markers(str(tmp_path / 'trial.npy'), ['a', 'b', 'c', 'd'])
+    np.testing.assert_array_equal(loaded, markers)
+    assert rate is None
+
+
+def test_batch_matches_the_sequential_solve(biomod_path, model, trial_markers):
+    from ik_solvers import LeastSquaresIK
+
+    q_sequential, _ = LeastSquaresIK(model).solve(trial_markers)
+    q, qdot = batch_inverse_kinematics(biomod_path, trial_markers, n_workers=2, chunk_size=20, overlap=5)
+    assert q.shape == qdot.shape == q_sequential.shape
+    np.testing.assert_allclose(q, q_sequential, atol=1e-4)
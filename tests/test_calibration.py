@@ -0,0 +1,58 @@
+import numpy as np
+from calibration import FEEDBACK_DOFS, ReferenceCalibration
+
+
+def static_frames(nb_q=15, n_frames=100, std=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    mean = rng.uniform(-1, 1, nb_q)
+    return mean, mean[:, None] + rng.normal(0, np.deg2rad(std), (nb_q, n_frames))
+
+
+def test_reference_is_the_mean_of_the_collected_frames():
+    mean, q = static_frames()
+    calibration = ReferenceCalibration(q.shape[0], n_frames=50)
+    for frame in q.T:
+        calibration.add(frame)
+    # Frames past n_frames are not collected
+    assert calibration.is_complete and calibration.count == 50
+    reference = calibration.result()
+    np.testing.assert_allclose(reference['q'], q[:, :50].mean(axis=1))
+    np.testing.assert_allclose(reference['std'], np.rad2deg(q[:, :50].std(axis=1)))
+    for name, dof in FEEDBACK_DOFS.items():
+        assert reference[name] == reference['q'][dof]
+    assert reference['is_static']
+    calibration.reset()
+    assert not calibration.is_complete and calibration.count == 0
+
+
+def test_movement_of_a_feedback_dof_is_not_static():
+    _, q = static_frames()
+    q[FEEDBACK_DOFS['elbow']] += np.linspace(0, np.deg2rad(20), q.shape[1])
+    calibration = ReferenceCalibration(q.shape[0], n_frames=q.shape[1])
+    for frame in q.T:
+        calibration.add(frame)
+    assert not calibration.result()['is_static']
+    # Movements of the other degrees of freedom do not matter
+    _, q = static_frames()
+    q[0] += np.linspace(0, 1, q.shape[1])
+    calibration.reset()
+    for frame in q.T:
+        calibration.add(frame)
+    assert calibration.result()['is_static']
+
+
+def test_report(capsys):
+    _, q = static_frames(nb_q=3, n_frames=10)
+    q[2] += np.linspace(0, np.deg2rad(10), 10)
+    calibration = ReferenceCalibration(3, n_frames=10, feedback_dofs={'elbow': 2},
+                                       dof_names=['thorax_TransX', 'thorax_RotX', 'ulna_RotZ'])
+    for frame in q.T:
+        calibration.add(frame)
+    calibration.report(calibration.result())
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'Reference over 10 frames (mean +/- std, deg or mm):'
+    assert lines[1].split()[0] == 'thorax_TransX' and lines[1].endswith(' mm')
+    assert f'{q[0].mean() * 1e3:8.1f}' in lines[1]
+    assert lines[2].endswith(' deg')
+    assert lines[3].split()[:2] == ['ulna_RotZ', '(elbow)'] and lines[3].endswith('deg > max std')
+    assert f'{np.rad2deg(q[2].mean()):8.1f}' in lines[3]
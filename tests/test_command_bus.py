@@ -0,0 +1,67 @@
+import asyncio as aio
+import threading
+from command_bus import Command, CommandBus, TerminalCommands
+
+
+def test_post_and_poll_in_order():
+    async def run():
+        bus = CommandBus()
+        assert bus.poll() is None
+        bus.post(Command.ACCEPT)
+        bus.post(Command.SET_REFERENCE)
+        assert [command for _, command in bus.history] == [Command.ACCEPT, Command.SET_REFERENCE]
+        assert bus.history[0][0] <= bus.history[1][0]
+        assert bus.poll() is Command.ACCEPT
+        assert await bus.get() is Command.SET_REFERENCE
+        assert bus.poll() is None
+
+    aio.run(run())
+
+
+def test_wait_for_discards_the_other_commands():
+    async def run():
+        bus = CommandBus()
+        for command in (Command.SET_REFERENCE, Command.SET_REFERENCE, Command.ACCEPT, Command.STOP):
+            bus.post(command)
+        assert await bus.wait_for(Command.ACCEPT, Command.STOP) is Command.ACCEPT
+        assert bus.poll() is Command.STOP
+        bus.post(Command.ACCEPT)
+        bus.clear()
+        assert bus.poll() is None
+
+    aio.run(run())
+
+
+def test_post_from_another_thread():
+    async def run():
+        bus = CommandBus(aio.get_running_loop())
+        thread = threading.Thread(target=bus.post_threadsafe, args=(Command.STOP,))
+        thread.start()
+        command = await aio.wait_for(bus.get(), 1)
+        thread.join()
+        return command
+
+    assert aio.run(run()) is Command.STOP
+
+
+def test_terminal_commands(monkeypatch, capsys):
+    lines = iter(['', ' OK ', 'start', 'q'])
+
+    def fake_input():
+        try:
+            return next(lines)
+        except StopIteration:
+            raise EOFError
+
+    monkeypatch.setattr('builtins.input', fake_input)
+
+    async def run():
+        bus = CommandBus(aio.get_running_loop())
+        terminal = TerminalCommands(bus)
+        commands = [await aio.wait_for(bus.get(), 1) for _ in range(3)]
+        terminal.thread.join(1)
+        assert not terminal.thread.is_alive()
+        return commands
+
+    assert aio.run(run()) == [Command.SET_REFERENCE, Command.ACCEPT, Command.STOP]
+    assert "Unknown command 'start'" in capsys.readouterr().out
@@ -0,0 +1,139 @@
+import asyncio as aio
+import socket
+import struct
+from types import SimpleNamespace
+import matplotlib
+import numpy as np
+import pytest
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.patches import Ellipse
+from feedback import (FEEDBACK_PACKET, FeedbackRenderer, Mailbox, NullSink, UdpSink, gh_feedback, make_sink,
+                      update_ellipse)
+
+
+@pytest.fixture
+def renderer():
+    fig, axes = plt.subplots(1, 1)
+    axes.set_xlim(-10, 10)
+    axes.set_ylim(-10, 10)
+    ellipse = Ellipse((0, 0), width=3, height=3)
+    renderer = FeedbackRenderer(fig, axes, ellipse, update_ellipse, max_fps=20)
+    yield renderer
+    renderer.close()
+    plt.close(fig)
+
+
+def test_mailbox_keeps_the_latest_value():
+    mailbox = Mailbox()
+    assert mailbox.take() is None
+    for value in range(3):
+        mailbox.put(value)
+    assert mailbox.take() == 2
+    assert mailbox.take() is None
+    assert mailbox.overwritten == 2
+
+
+def test_renderer_blits_from_the_cached_background(renderer):
+    assert renderer.background is not None
+    assert renderer.artist.get_animated()
+    renderer.render(gh_feedback((2, 4, 0)))
+    assert renderer.artist.get_width() == 2 and renderer.artist.get_height() == 4
+    assert len(renderer.render_time) == 1
+
+
+def test_renderer_post_never_renders(renderer):
+    for i in range(10):
+        renderer.post(gh_feedback((i, i, 0), i))
+    assert renderer.render_time == []
+    assert renderer.dropped_renders == 9
+
+
+def test_renderer_run_displays_the_latest_value_at_a_capped_rate(renderer):
+    async def run():
+        task = aio.get_running_loop().create_task(renderer.run())
+        for i in range(100):
+            renderer.post(gh_feedback((i, 2 * i, 0), i))
+            await aio.sleep(0.002)
+        await aio.sleep(0.1)
+        task.cancel()
+
+    aio.run(run())
+    # 20 frames per second over about 0.3 s
+    assert 0 < len(renderer.render_time) <= 8
+    assert renderer.dropped_renders >= 100 - len(renderer.render_time) - 1
+    assert renderer.artist.get_width() == 99 and renderer.artist.get_height() == 198
+
+
+def test_renderer_close_disconnects_the_draw_callback(renderer):
+    renderer.close()
+    renderer.background = None
+    renderer.fig.canvas.draw()
+    assert renderer.background is None
+
+
+@pytest.fixture
+def receiver():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(1)
+    yield receiver
+    receiver.close()
+
+
+def test_null_sink_counts_the_records(capsys):
+    sink = make_sink('null')
+    assert isinstance(sink, NullSink)
+    for frame_number in range(3):
+        sink.post(gh_feedback(np.zeros(3), frame_number))
+    sink.report()
+    assert capsys.readouterr().out == 'Null feedback sink: 3 records discarded\n'
+
+
+def test_udp_sink_sends_feedback_packets(receiver):
+    sink = make_sink(f'udp:127.0.0.1:{receiver.getsockname()[1]}')
+    gh = np.array([0.1, -0.2, 0.3])
+    sink.post(gh_feedback(gh, frame_number=12, timestamp=120000))
+    frame_number, timestamp, *angles = FEEDBACK_PACKET.unpack(receiver.recv(1024))
+    assert (frame_number, timestamp) == (12, 120000)
+    np.testing.assert_array_equal(angles, gh)
+    assert sink.sent == 1 and sink.dropped == 0
+    sink.close()
+
+
+def test_osc_sink_sends_osc_messages(receiver):
+    sink = make_sink(f'osc:127.0.0.1:{receiver.getsockname()[1]}')
+    gh = np.array([0.1, -0.2, 0.3])
+    sink.post(gh_feedback(gh, frame_number=12))
+    message = receiver.recv(1024)
+    sink.close()
+    # Address and type tags padded to 4 bytes, then the big endian arguments
+    assert message[:16] == b'/shoulder/gh\0\0\0\0'
+    assert message[16:24] == b',ifff\0\0\0'
+    frame_number, *angles = struct.unpack('>i3f', message[24:])
+    assert frame_number == 12
+    np.testing.assert_allclose(angles, np.rad2deg(gh), rtol=1e-6)
+
+
+def test_make_sink_addresses():
+    sink = make_sink('udp:9100')
+    assert sink.address == ('127.0.0.1', 9100) and not sink.osc
+    sink.close()
+    sink = make_sink('osc')
+    assert sink.address == ('127.0.0.1', 9000) and sink.osc
+    sink.close()
+    with pytest.raises(ValueError, match='tcp'):
+        make_sink('tcp:127.0.0.1:9000')
+
+
+def test_udp_sink_drops_instead_of_blocking():
+    def full_buffer(data, address):
+        raise BlockingIOError
+
+    sink = UdpSink('127.0.0.1', 9000)
+    sink.socket.close()
+    sink.socket = SimpleNamespace(sendto=full_buffer, close=lambda: None)
+    # A datagram the socket cannot take is dropped and counted, the acquisition goes on
+    sink.post(gh_feedback(np.zeros(3)))
+    assert sink.sent == 0 and sink.dropped == 1
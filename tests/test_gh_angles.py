@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from gh_angles import GHAngles, dof_index, elementary_rotations, euler_angles
+
+
+@pytest.mark.parametrize('axis', [0, 1, 2])
+def test_elementary_rotations(axis):
+    angles = np.linspace(-np.pi, np.pi, 7)
+    expected = Rotation.from_euler('xyz'[axis], angles[:, np.newaxis]).as_matrix()
+    np.testing.assert_allclose(elementary_rotations(axis, angles), expected, atol=1e-12)
+
+
+@pytest.mark.parametrize('sequence', ['xyz', 'zxy', 'zyx', 'yxy', 'zyz', 'xzx'])
+def test_euler_angles_match_scipy(sequence):
+    rotations = Rotation.random(50, random_state=0)
+    angles = euler_angles(rotations.as_matrix(), sequence)
+    # Upper case is the intrinsic convention in scipy, with the same ranges of the second angle
+    np.testing.assert_allclose(angles, rotations.as_euler(sequence.upper()), atol=1e-10)
+    np.testing.assert_allclose(Rotation.from_euler(sequence.upper(), angles).as_matrix(), rotations.as_matrix(),
+                               atol=1e-10)
+
+
+@pytest.mark.parametrize('sequence', ['xy', 'xyw', 'xxy', 'xyy'])
+def test_euler_angles_invalid_sequence(sequence):
+    with pytest.raises(ValueError):
+        euler_angles(np.eye(3)[np.newaxis], sequence)
+
+
+def test_dof_index(model):
+    assert dof_index(model, 'humerus_shoulder_plane') == 11
+    assert dof_index(model, 'ulna_elbow_flexion') == 14
+    dof_names = [dof.to_string() for dof in model.nameDof()]
+    assert dof_index(model, dof_names[12]) == 12
+    with pytest.raises(ValueError, match='degrees of freedom'):
+        dof_index(model, 'thorax')
+    with pytest.raises(ValueError, match='No degree of freedom'):
+        dof_index(model, 'femur')
+
+
+def test_model_convention_reads_the_dofs(model, trial_q):
+    gh = GHAngles(model)
+    assert gh.feedback_dofs == {'GH_q1': 11, 'GH_q2': 12, 'elbow': 14}
+    np.testing.assert_array_equal(gh(trial_q[:, 0]), trial_q[11:14, 0])
+    np.testing.assert_array_equal(gh(trial_q), trial_q[11:14])
+    np.testing.assert_allclose(gh.relative(trial_q, trial_q[11:14, 0]), trial_q[11:14] - trial_q[11:14, :1])
+
+
+def test_sequence_convention_matches_the_segment_rotations(model, trial_q):
+    gh = GHAngles(model, convention='yxy')
+    segment_names = [model.segment(i).name().to_string() for i in range(model.nbSegment())]
+    scapula, humerus = segment_names.index('scapula'), segment_names.index('humerus')
+    expected = []
+    for q in trial_q.T[::10]:
+        scapula_rotation = model.globalJCS(q, scapula).to_array()[:3, :3]
+        humerus_rotation = model.globalJCS(q, humerus).to_array()[:3, :3]
+        expected.append(scapula_rotation.T @ humerus_rotation)
+    np.testing.assert_allclose(gh.rotation(trial_q[:, ::10]), expected, atol=1e-10)
+    angles = gh(trial_q[:, ::10])
+    assert angles.shape == (3, len(expected))
+    np.testing.assert_allclose(angles, euler_angles(np.array(expected), 'yxy').T, atol=1e-8)
+    # Relative angles are wrapped
+    relative = gh.relative(trial_q[:, ::10], angles[:, 0] + 2 * np.pi)
+    assert (np.abs(relative) <= np.pi).all()
+    np.testing.assert_allclose(relative[:, 0], 0, atol=1e-10)
+
+
+def test_sequence_convention_needs_a_parent_segment(model):
+    with pytest.raises(ValueError, match='not a parent'):
+        GHAngles(model, convention='yxy', proximal='ulna', distal='humerus')
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from ik_solvers import IK_SOLVERS, KalmanIK, LeastSquaresIK, ShoulderChainIK, kabsch
+
+
+def marker_error(model, q, markers):
+    """
+    Largest distance (m) between the model markers at q (n_q, n_frames) and the visible markers.
+    """
+    model_markers = np.stack([np.array([mark.to_array() for mark in model.markers(q[:, i])]).T
+                              for i in range(q.shape[1])], axis=2)
+    return np.nanmax(np.linalg.norm(model_markers - markers, axis=0))
+
+
+def test_kabsch_recovers_a_rigid_transformation():
+    rng = np.random.default_rng(0)
+    rotation = Rotation.random(random_state=0).as_matrix()
+    translation = rng.normal(0, 1, 3)
+    local_points = rng.normal(0, 0.1, (3, 5))
+    fitted_rotation, fitted_translation = kabsch(local_points, rotation @ local_points + translation[:, None])
+    np.testing.assert_allclose(fitted_rotation, rotation, atol=1e-10)
+    np.testing.assert_allclose(fitted_translation, translation, atol=1e-10)
+
+
+def test_kabsch_returns_a_rotation_for_mirrored_points():
+    local_points = np.random.default_rng(0).normal(0, 0.1, (3, 4))
+    rotation, _ = kabsch(local_points, np.diag([1, 1, -1]) @ local_points)
+    np.testing.assert_allclose(rotation @ rotation.T, np.eye(3), atol=1e-10)
+    assert np.linalg.det(rotation) == pytest.approx(1)
+
+
+@pytest.mark.parametrize('ik_class', [LeastSquaresIK, ShoulderChainIK])
+def test_solvers_track_the_trial_markers(model, trial_markers, ik_class):
+    ik_solver = ik_class(model, rate=100)
+    q, qdot = ik_solver.solve(trial_markers)
+    assert q.shape == qdot.shape == (model.nbQ(), trial_markers.shape[2])
+    assert marker_error(model, q, trial_markers) < 5e-3
+    np.testing.assert_allclose(qdot[:, 1:], np.diff(q, axis=1) * 100, atol=1e-8)
+
+
+def test_least_squares_stays_in_the_ranges(model, trial_q):
+    ik_solver = LeastSquaresIK(model, rate=100)
+    q_min, q_max = ik_solver.q_bounds
+    # The elbow is driven past its upper bound after the first frame, its best fit is out of range
+    q = np.repeat(trial_q[:, :1], 10, axis=1)
+    q[14, 1:] = q_max[14] + np.linspace(0.1, 0.5, 9)
+    markers = np.stack([np.array([mark.to_array() for mark in model.markers(q[:, i])]).T for i in range(10)], axis=2)
+    q_solved, _ = ik_solver.solve(markers)
+    assert (q_solved >= q_min[:, None]).all() and (q_solved <= q_max[:, None]).all()
+    np.testing.assert_allclose(q_solved[14, 1:], q_max[14], atol=1e-3)
+
+
+def test_shoulder_chain_matches_the_least_square_solution(model, trial_markers):
+    q_least_square, _ = LeastSquaresIK(model, rate=100).solve(trial_markers)
+    q_chain, _ = ShoulderChainIK(model, rate=100).solve(trial_markers)
+    # Same pose of the feedback degrees of freedom, to the convergence of both solvers
+    np.testing.assert_allclose(q_chain[11:15], q_least_square[11:15], atol=np.deg2rad(2))
+
+
+def test_shoulder_chain_solves_only_the_chain(model):
+    ik_solver = ShoulderChainIK(model)
+    np.testing.assert_array_equal(ik_solver.root_trans_idx, [0, 1, 2])
+    np.testing.assert_array_equal(ik_solver.root_rot_idx, [3, 4, 5])
+    assert not set(ik_solver.chain_dof_idx) & {0, 1, 2, 3, 4, 5}
+    assert ik_solver.chain_dof_idx.size == model.nbQ() - 6
+
+
+def test_shoulder_chain_root_needs_six_dofs(model):
+    with pytest.raises(ValueError, match='clavicle'):
+        ShoulderChainIK(model, root_segment='clavicle')
+
+
+@pytest.mark.parametrize('ik_class', [LeastSquaresIK, ShoulderChainIK])
+def test_solvers_leave_the_occluded_markers_out(model, trial_markers, ik_class):
+    markers = trial_markers.copy()
+    # Arm and elbow markers hidden for a while, and garbage instead of a scapula marker flagged as not valid
+    markers[:, [12, 14], 10:30] = np.nan
+    valid = np.isfinite(markers).all(axis=0)
+    valid[8, 30:40] = False
+    markers[:, 8, 30:40] = 10
+    ik_solver = ik_class(model, rate=100)
+    q, _ = ik_solver.solve(markers, valid)
+    assert ik_solver.total_extrapolated == 0
+    assert marker_error(model, q, np.where(valid, markers, np.nan)) < 5e-3
+
+
+def test_pose_is_extrapolated_then_held_without_markers(model, trial_markers, max_extrapolation=5):
+    ik_solver = LeastSquaresIK(model, rate=100, max_extrapolation=max_extrapolation)
+    q_solved, _ = ik_solver.solve(trial_markers[:, :, :20])
+    hidden = np.full(trial_markers[:, :, :10].shape, np.nan)
+    q_hidden, qdot_hidden = ik_solver.solve(hidden)
+    velocity = (q_solved[:, -1] - q_solved[:, -10]) * 100 / 9
+    # Extrapolated at the velocity of the last solved frames, inside the bounds
+    expected = np.clip(q_solved[:, -1:] + velocity[:, None] * np.arange(1, max_extrapolation + 1) / 100,
+                       *[bound[:, None] for bound in ik_solver.q_bounds])
+    np.testing.assert_allclose(q_hidden[:, :max_extrapolation], expected, atol=1e-10)
+    # Then held
+    np.testing.assert_array_equal(q_hidden[:, max_extrapolation:], q_hidden[:, max_extrapolation - 1:-1])
+    np.testing.assert_array_equal(qdot_hidden[:, max_extrapolation:], 0)
+    assert ik_solver.total_extrapolated == 10 and ik_solver.is_extrapolated
+    # Solved again as soon as the markers come back
+    q, _ = ik_solver.solve(trial_markers[:, :, 30])
+    assert not ik_solver.is_extrapolated and ik_solver.nb_extrapolated == 0
+    assert marker_error(model, q, trial_markers[:, :, 30:31]) < 5e-3
+
+
+def test_nothing_is_extrapolated_before_the_first_solved_frame(model, trial_markers):
+    ik_solver = LeastSquaresIK(model, rate=100)
+    q, qdot = ik_solver.solve(np.full(trial_markers[:, :, :3].shape, np.nan))
+    initial_q = np.clip(np.zeros(model.nbQ()), *ik_solver.q_bounds)
+    np.testing.assert_array_equal(q, np.repeat(initial_q[:, None], 3, axis=1))
+    np.testing.assert_array_equal(qdot, 0)
+    assert not ik_solver.is_initialized and ik_solver.total_extrapolated == 0
+
+
+def test_kalman_tracks_the_trial_from_an_initial_pose(model, trial_q, trial_markers):
+    ik_solver = IK_SOLVERS['kalman'](model, rate=100, initial_q=trial_q[:, 0])
+    assert isinstance(ik_solver, KalmanIK)
+    # Stepped once per frame, the filter state carries over between calls
+    q = np.hstack([ik_solver.solve(trial_markers[:, :, i])[0] for i in range(trial_markers.shape[2])])
+    assert marker_error(model, q[:, 10:], trial_markers[:, :, 10:]) < 5e-3
+    np.testing.assert_allclose(ik_solver.qdot, ik_solver._qdot.to_array())
+    assert ik_solver.qddot.shape == (model.nbQ(),)
+
+
+def test_kalman_restarts_on_reset(model, trial_q, trial_markers):
+    ik_solver = KalmanIK(model, rate=100, initial_q=trial_q[:, 0])
+    q_first, _ = ik_solver.solve(trial_markers[:, :, :10])
+    ik_solver.reset(trial_q[:, 0])
+    q_again, _ = ik_solver.solve(trial_markers[:, :, :10])
+    np.testing.assert_allclose(q_again, q_first, atol=1e-10)
+
+
+def test_kalman_leaves_the_occluded_markers_out(model, trial_q, trial_markers):
+    markers = trial_markers.copy()
+    markers[:, [12, 14], 20:40] = np.nan
+    ik_solver = KalmanIK(model, rate=100, initial_q=trial_q[:, 0])
+    q, _ = ik_solver.solve(markers)
+    assert ik_solver.total_extrapolated == 0
+    assert marker_error(model, q[:, 10:], markers[:, :, 10:]) < 5e-3
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+import numpy as np
+import pytest
+from ik_worker import IKWorker, SharedRing
+
+
+def test_shared_ring_round_trip():
+    ring = SharedRing((2, 3), n_slots=4)
+    try:
+        assert ring.count == 0
+        ring.push(np.full((2, 3), 1.5), 7, 3, 10, 20, 1)
+        data, meta = ring.read(0)
+        np.testing.assert_array_equal(data, 1.5)
+        np.testing.assert_array_equal(meta, [7, 3, 10, 20, 1])
+        # The copy is not a view of the shared memory
+        data[:] = 0
+        np.testing.assert_array_equal(ring.read(0)[0], 1.5)
+    finally:
+        ring.close()
+
+
+def test_shared_ring_attached_by_name():
+    ring = SharedRing((3,), n_slots=4)
+    reader = SharedRing((3,), n_slots=4, name=ring.name)
+    try:
+        assert not reader.is_owner
+        ring.push(np.arange(3.), 5)
+        assert reader.count == 1
+        data, meta = reader.read(0)
+        np.testing.assert_array_equal(data, np.arange(3.))
+        assert meta[0] == 5
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_shared_ring_overwritten_slot(n_slots=4):
+    ring = SharedRing((1,), n_slots=n_slots)
+    try:
+        for i in range(n_slots + 2):
+            ring.push(np.array([i]), i)
+        assert ring.count == n_slots + 2
+        # The first two writes were overwritten and the slot of the next write may be under way
+        assert ring.read(0) is None and ring.read(1) is None and ring.read(2) is None
+        for i in range(3, n_slots + 2):
+            data, meta = ring.read(i)
+            assert data[0] == i and meta[0] == i
+    finally:
+        ring.close()
+
+
+OWNER = """
+    import multiprocessing as mp
+    import subprocess
+    import sys
+    import numpy as np
+    from ik_worker import SharedRing
+
+    def push(name):
+        ring = SharedRing((3,), 4, name=name)
+        ring.push(np.arange(3.), 1)
+        ring.close()
+
+    if __name__ == '__main__':
+        ring = SharedRing((3,), 4)
+        if sys.argv[1] == 'spawned':
+            process = mp.get_context('spawn').Process(target=push, args=(ring.name,))
+            process.start()
+            process.join()
+        else:
+            code = f'from ik_worker import SharedRing; SharedRing((3,), 4, name="{ring.name}", standalone=True).close()'
+            subprocess.run([sys.executable, '-c', code], check=True)
+        print(ring.count)
+        ring.close()
+"""
+
+
+@pytest.mark.parametrize('attached_from', ['spawned', 'standalone'])
+def test_attached_ring_is_left_to_its_owner(tmp_path, attached_from):
+    script = tmp_path / 'owner.py'
+    script.write_text(textwrap.dedent(OWNER))
+    repo_dir = str(Path(__file__).resolve().parent.parent)
+    result = subprocess.run([sys.executable, str(script), attached_from], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=repo_dir))
+    assert result.stdout.split() == ['1' if attached_from == 'spawned' else '0']
+    # Neither unlinked by the process that attached it nor reported as leaked by the resource trackers
+    assert 'resource_tracker' not in result.stderr
+
+
+def wait_latest(worker, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        result = worker.latest()
+        if result is not None:
+            return result
+        time.sleep(0.001)
+    raise TimeoutError
+
+
+def test_worker_matches_the_in_process_solve(biomod_path, model, trial_markers):
+    from ik_solvers import LeastSquaresIK
+
+    q_expected, _ = LeastSquaresIK(model, rate=100).solve(trial_markers[:, :, :10])
+    with IKWorker(biomod_path, trial_markers.shape[1], model.nbQ(), rate=100, drop_stale=False) as worker:
+        assert worker.is_alive
+        for i in range(10):
+            worker.submit(trial_markers[:, :, i], frame_number=100 + i, row=i)
+            # One frame at a time, so every frame is solved from the previous one as in process
+            q, qdot, meta = wait_latest(worker)
+            np.testing.assert_allclose(q, q_expected[:, i], atol=1e-6)
+            assert qdot.shape == (model.nbQ(),)
+            assert meta[0] == 100 + i and meta[1] == i and meta[3] >= meta[2] and meta[4] == 0
+        assert worker.latest() is None
+    assert not worker.is_alive
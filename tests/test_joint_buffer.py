@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from scipy import signal
+from joint_buffer import ButterworthFilter, ExponentialFilter, JointBuffer, OneEuroFilter
+
+
+@pytest.fixture
+def q(nb_q=4, n_samples=300):
+    return np.cumsum(np.random.default_rng(0).normal(0, 0.01, (n_samples, nb_q)), axis=0) + 1
+
+
+def run_filter(q_filter, q):
+    return np.array([q_filter.update(sample).copy() for sample in q])
+
+
+def test_butterworth_matches_lfilter(q, rate=100, cutoff=6):
+    b, a = signal.butter(2, cutoff, fs=rate)
+    # Started from the steady state of the first sample, as the incremental filter
+    expected = signal.lfilter(b, a, q, axis=0, zi=signal.lfilter_zi(b, a)[:, None] * q[0])[0]
+    np.testing.assert_allclose(run_filter(ButterworthFilter(q.shape[1], rate, cutoff), q), expected, atol=1e-10)
+
+
+def test_exponential_filter(q, alpha=0.3):
+    expected = [q[0]]
+    for sample in q[1:]:
+        expected.append(expected[-1] + alpha * (sample - expected[-1]))
+    np.testing.assert_allclose(run_filter(ExponentialFilter(q.shape[1], alpha), q), expected)
+
+
+@pytest.mark.parametrize('q_filter', [ExponentialFilter(2), OneEuroFilter(2, 100), ButterworthFilter(2, 100)],
+                         ids=['exponential', 'one_euro', 'butterworth'])
+def test_filters_hold_a_constant_and_settle_after_a_step(q_filter):
+    # Started on the first sample, a constant signal goes through without transient
+    np.testing.assert_allclose(run_filter(q_filter, np.ones((50, 2))), 1)
+    step = run_filter(q_filter, np.full((200, 2), 2.))
+    assert 1 < step[0, 0] < 2
+    np.testing.assert_allclose(step[-1], 2, atol=1e-3)
+    q_filter.reset()
+    np.testing.assert_allclose(q_filter.update(np.array([5., 5.])), 5)
+
+
+def test_one_euro_lags_less_when_moving_fast(rate=100):
+    ramp = np.linspace(0, 2, 100)[:, None]
+    slow, fast = OneEuroFilter(1, rate, beta=0), OneEuroFilter(1, rate, beta=1)
+    assert abs(run_filter(fast, ramp)[-1, 0] - 2) < abs(run_filter(slow, ramp)[-1, 0] - 2)
+
+
+def test_joint_buffer_window_wraps_in_chronological_order(q, size=50):
+    q_buffer = JointBuffer(q.shape[1], size=size, filters={'exponential': ExponentialFilter(q.shape[1])})
+    for sample in q[:120]:
+        q_buffer.append(sample, qdot=-sample)
+    np.testing.assert_array_equal(q_buffer.window(), q[70:120].T)
+    np.testing.assert_array_equal(q_buffer.window(n_samples=5), q[115:120].T)
+    np.testing.assert_array_equal(q_buffer.latest(), q[119])
+    np.testing.assert_array_equal(q_buffer.latest(dofs=[1, 3]), q[119, [1, 3]])
+    np.testing.assert_array_equal(q_buffer.qdot[119 % size], -q[119])
+    expected = run_filter(ExponentialFilter(q.shape[1]), q[:120])[70:].T
+    np.testing.assert_allclose(q_buffer.window('exponential'), expected)
+    # latest returns a copy, the next sample does not change it
+    latest = q_buffer.latest()
+    q_buffer.append(q[120])
+    np.testing.assert_array_equal(latest, q[119])
+
+
+def test_joint_buffer_partial_window_and_reset(q):
+    q_buffer = JointBuffer(q.shape[1], size=50, filters={'butterworth': ButterworthFilter(q.shape[1], 100)})
+    for sample in q[:10]:
+        q_buffer.append(sample)
+    assert q_buffer.window().shape == (q.shape[1], 10)
+    q_buffer.reset()
+    assert q_buffer.window().shape == (q.shape[1], 0)
+    q_buffer.append(q[200])
+    # The filters restart from the new sample instead of carrying the previous state
+    np.testing.assert_allclose(q_buffer.latest('butterworth'), q[200])
@@ -0,0 +1,95 @@
+import asyncio as aio
+import time
+import numpy as np
+import pytest
+from latency_trace import STAGES, LatencyRecorder
+
+
+def test_stages_and_end_to_end_of_a_frame():
+    recorder = LatencyRecorder(capacity=10)
+    row = recorder.begin_frame(7, 70000, arrival_ns=1_000_000)
+    recorder.record('acquisition', 1_000_000, 1_500_000)
+    recorder.record('ik', 2_000_000, 4_000_000)
+    recorder.record('ik', 4_000_000, 5_000_000)
+    # The renderer draws later, in the row the value was posted with
+    recorder.begin_frame(8, 80000, arrival_ns=11_000_000)
+    recorder.record('draw', 12_000_000, 13_000_000, row)
+    columns = recorder.as_dict()
+    assert list(columns) == ['frame_number', 'qtm_timestamp', *STAGES, 'end_to_end']
+    np.testing.assert_array_equal(columns['frame_number'], [7, 8])
+    np.testing.assert_array_equal(columns['qtm_timestamp'], [70000, 80000])
+    np.testing.assert_array_equal(columns['acquisition'], [0.5, np.nan])
+    # Spans of the same stage add up
+    np.testing.assert_array_equal(columns['ik'], [3, np.nan])
+    np.testing.assert_array_equal(columns['draw'], [1, np.nan])
+    np.testing.assert_array_equal(columns['end_to_end'], [12, np.nan])
+
+
+def test_record_before_the_first_frame_is_ignored():
+    recorder = LatencyRecorder(capacity=10)
+    recorder.record('ik', 0, 10)
+    with recorder.span('ik'):
+        pass
+    assert recorder.as_dict()['frame_number'].size == 0
+    assert not recorder.durations_ns.any()
+
+
+def test_span_times_the_current_frame():
+    recorder = LatencyRecorder(capacity=10)
+    recorder.begin_frame(1, 0)
+    with recorder.span('filtering'):
+        time.sleep(0.01)
+    assert recorder.as_dict()['filtering'][0] >= 10
+
+
+def test_oldest_frames_are_overwritten_in_order(capacity=5):
+    recorder = LatencyRecorder(capacity=capacity)
+    for frame_number in range(1, 13):
+        recorder.begin_frame(frame_number, frame_number * 10)
+        recorder.record('ik', 0, frame_number * 1_000_000)
+    columns = recorder.as_dict()
+    np.testing.assert_array_equal(columns['frame_number'], np.arange(8, 13))
+    np.testing.assert_array_equal(columns['ik'], np.arange(8, 13))
+
+
+def test_to_csv(tmp_path):
+    recorder = LatencyRecorder(capacity=10)
+    for frame_number in range(3):
+        recorder.begin_frame(frame_number, frame_number * 10, arrival_ns=1_000_000)
+        recorder.record('reorder', 1_000_000, 1_250_000)
+        recorder.record('draw', 2_000_000, 3_000_000)
+    recorder.to_csv(str(tmp_path / 'trace.csv'))
+    data = np.genfromtxt(tmp_path / 'trace.csv', delimiter=',', names=True)
+    np.testing.assert_array_equal(data['frame_number'], [0, 1, 2])
+    np.testing.assert_array_equal(data['reorder'], 0.25)
+    np.testing.assert_array_equal(data['end_to_end'], 2)
+    assert np.isnan(data['ik']).all()
+    stats = recorder.summary()
+    assert set(stats) == {'reorder', 'draw', 'end_to_end'}
+    np.testing.assert_array_equal(stats['end_to_end'], [2, 2, 2])
+
+
+def test_interface_traces_acquisition_and_reorder(tmp_path):
+    from replay_interface import ReplayInterface
+
+    np.save(tmp_path / 'trial.npy', np.zeros((3, 4, 5)))
+
+    async def run():
+        interface = await ReplayInterface(str(tmp_path / 'trial.npy'))
+        await interface.add_marker_set(nb_markers=4, name='markers')
+        interface.recorder = LatencyRecorder(capacity=10)
+        for _ in range(5):
+            await interface.get_marker_set_data()
+        return interface.recorder.as_dict()
+
+    columns = aio.run(run())
+    np.testing.assert_array_equal(columns['frame_number'], np.arange(1, 6))
+    assert (columns['acquisition'] >= 0).all() and (columns['reorder'] > 0).all()
+    assert np.isnan(columns['end_to_end']).all()
+
+
+def test_unknown_stage():
+    recorder = LatencyRecorder(capacity=10)
+    recorder.begin_frame(1, 0)
+    with pytest.raises(KeyError):
+        recorder.record('unknown', 0, 1)
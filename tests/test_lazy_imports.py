@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+# Same list as benchmarks/test_startup.py, these are imported only by the code paths that use them
+LAZY_MODULES = ('tkinter', 'customtkinter', 'bioviz', 'osim_to_biomod', 'qtm_rt', 'ezc3d', 'pandas', 'ik_worker',
+                'live_bus', 'multiprocessing.shared_memory', 'biosiglive', 'matplotlib',
+                'matplotlib.pyplot', 'scipy.signal')
+
+
+def loaded_modules(code):
+    """
+    Modules loaded by running code in a fresh interpreter.
+    """
+    code += '; import sys; print("\\n".join(sys.modules))'
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                          cwd=Path(__file__).resolve().parent.parent).stdout.split()
+
+
+@pytest.mark.parametrize('module', ['IK_realtime', 'qtm_interface', 'replay_interface', 'feedback', 'model_cache',
+                                    'calibration', 'ik_solvers'])
+def test_import_loads_no_lazy_module(module):
+    modules = loaded_modules(f'import {module}')
+    assert module in modules
+    assert not set(modules) & set(LAZY_MODULES)
+
+
+def test_lazy_module_is_loaded_on_use():
+    # biosiglive builds the marker sets, it is loaded by the first one added
+    code = ('from qtm_interface import QTMInterface; import asyncio;'
+            'asyncio.run(QTMInterface(init_now=False).add_marker_set(2, "markers"))')
+    assert 'biosiglive' in loaded_modules(code)
+
+
+def test_marker_sets_solved_without_worker():
+    # ik_worker is only imported once a worker is built, solving without one leaves it unloaded
+    code = ('from types import SimpleNamespace; from qtm_interface import QTMInterface; import asyncio;'
+            'asyncio.run(QTMInterface.get_kinematics_from_marker_sets(SimpleNamespace(marker_sets=[]), {}))')
+    assert 'ik_worker' not in loaded_modules(code)
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+from multiprocessing import shared_memory
+from pathlib import Path
+import numpy as np
+import pytest
+from live_bus import LiveBus, LiveBusReader
+
+
+@pytest.fixture
+def name(request):
+    return f'test_bus_{os.getpid()}_{request.node.name[-20:]}'
+
+
+def publish(bus, frame_numbers, nb_markers=3, nb_q=2):
+    for frame_number in frame_numbers:
+        bus.publish(frame_number, frame_number * 10, np.full((3, nb_markers), frame_number),
+                    np.full(nb_q, frame_number), -np.full(nb_q, frame_number), ellipse=(1, 2, 3, 4))
+
+
+def test_reader_gets_the_frames_in_order(name):
+    with LiveBus(name, nb_markers=3, nb_q=2, n_slots=8) as bus, LiveBusReader(name) as reader:
+        assert (reader.nb_markers, reader.nb_q, reader.n_slots) == (3, 2, 8)
+        assert reader.latest() is None and reader.read_new().size == 0
+        bus.set_reference([0.5, -0.5])
+        publish(bus, range(5))
+        records = reader.read_new()
+        np.testing.assert_array_equal(records['frame_number'], np.arange(5))
+        np.testing.assert_array_equal(records['timestamp'], np.arange(5) * 10)
+        np.testing.assert_array_equal(records['ik_frame_number'], np.arange(5))
+        np.testing.assert_array_equal(records['q'][:, 1], np.arange(5))
+        np.testing.assert_array_equal(records['q_ref'], np.tile([0.5, -0.5], (5, 1)))
+        assert reader.latest()['frame_number'] == 4
+        publish(bus, [5, 6])
+        np.testing.assert_array_equal(reader.read_new()['frame_number'], [5, 6])
+        assert reader.lost_frames == 0
+
+
+def test_late_reader_loses_the_oldest_frames(name, n_slots=4):
+    with LiveBus(name, nb_markers=3, nb_q=2, n_slots=n_slots) as bus:
+        publish(bus, range(3))
+        # A reader starts from the frames published after it attached
+        with LiveBusReader(name) as reader:
+            publish(bus, range(3, 13))
+            records = reader.read_new()
+            # The slot written next is left out, as it may be under way
+            np.testing.assert_array_equal(records['frame_number'], [10, 11, 12])
+            assert reader.lost_frames == 7
+
+
+def test_slot_being_written_is_not_read(name):
+    with LiveBus(name, nb_markers=3, nb_q=2, n_slots=4) as bus, LiveBusReader(name) as reader:
+        publish(bus, range(2))
+        # The producer marks the slot with an odd sequence until the record is complete
+        bus._sequence[1] = 2 * 1 + 1
+        assert reader.read(1) is None
+        assert reader.latest()['frame_number'] == 0
+        assert reader.read_new()['frame_number'].tolist() == [0]
+        assert reader.lost_frames == 1
+
+
+def test_reader_checks_the_bus(name):
+    with pytest.raises(FileNotFoundError):
+        LiveBusReader(name, timeout=0)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=64)
+    try:
+        with pytest.raises(ValueError, match='not a live bus'):
+            LiveBusReader(name)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_standalone_reader_leaves_the_bus(name):
+    code = ('import sys; from live_bus import LiveBusReader; reader = LiveBusReader(sys.argv[1], standalone=True);'
+            'print(reader.latest()["frame_number"]); reader.close()')
+    with LiveBus(name, nb_markers=3, nb_q=2) as bus:
+        publish(bus, [42])
+        result = subprocess.run([sys.executable, '-c', code, name], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).resolve().parent.parent)
+        assert result.stdout.split() == ['42']
+        # The exit of the reader did not unlink the bus
+        with LiveBusReader(name, timeout=0) as reader:
+            assert reader.latest()['frame_number'] == 42
+    assert 'leaked shared_memory' not in result.stderr
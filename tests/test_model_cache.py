@@ -0,0 +1,58 @@
+import os
+import pytest
+from model_cache import clear_models, conversion_key, convert_osim, get_model
+
+
+@pytest.fixture
+def osim_path(tmp_path):
+    path = tmp_path / 'subject.osim'
+    path.write_text('<OpenSimDocument Version="40000"><Model name="subject"/></OpenSimDocument>')
+    return path
+
+
+def test_conversion_key_depends_on_content_and_options(osim_path, tmp_path):
+    key = conversion_key(str(osim_path), skip_muscle=True, mesh_dir='Geometry')
+    copy = tmp_path / 'copy.osim'
+    copy.write_bytes(osim_path.read_bytes())
+    # Same content and options in another order, same key
+    assert conversion_key(str(copy), mesh_dir='Geometry', skip_muscle=True) == key
+    assert conversion_key(str(osim_path), skip_muscle=False, mesh_dir='Geometry') != key
+    osim_path.write_text(osim_path.read_text().replace('subject', 'other'))
+    assert conversion_key(str(osim_path), skip_muscle=True, mesh_dir='Geometry') != key
+
+
+def cached_conversion(osim_path, text='version 4\n'):
+    """
+    Put a conversion of osim_path in its default cache as convert_osim would have, without the converter.
+    """
+    options = dict(ignore_muscle_applied_tag=False, ignore_fixed_dof_tag=False, ignore_clamped_dof_tag=False,
+                   mesh_dir=str(osim_path.parent) + '/Geometry', skip_muscle=True, print_general_informations=True)
+    cache_dir = osim_path.parent / '_biomod_cache'
+    cache_dir.mkdir()
+    cached_path = cache_dir / f'{osim_path.stem}_{conversion_key(str(osim_path), **options)[:16]}.bioMod'
+    cached_path.write_text(text)
+    return cached_path
+
+
+def test_convert_osim_uses_the_cached_conversion(osim_path):
+    cached_path = cached_conversion(osim_path)
+    biomod_path = convert_osim(str(osim_path))
+    assert biomod_path == str(osim_path.with_suffix('.bioMod'))
+    assert osim_path.with_suffix('.bioMod').read_text() == cached_path.read_text()
+    # A bioMod edited or converted with other options is replaced by the cached one
+    osim_path.with_suffix('.bioMod').write_text('edited')
+    convert_osim(str(osim_path))
+    assert osim_path.with_suffix('.bioMod').read_text() == cached_path.read_text()
+
+
+def test_get_model_parses_once_per_file_version(biomod_path, tmp_path):
+    pytest.importorskip('biorbd')
+    path = tmp_path / 'model.bioMod'
+    path.write_bytes(open(biomod_path, 'rb').read())
+    clear_models()
+    model = get_model(str(path))
+    assert get_model(str(path)) is model
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert get_model(str(path)) is not model
+    clear_models()
@@ -0,0 +1,66 @@
+import asyncio as aio
+import time
+import numpy as np
+from pacing import DeadlinePacer
+
+
+async def paced_loop(pacer, n_iter, work=None):
+    """
+    Run n_iter iterations of a paced loop, work maps an iteration to its blocking duration in seconds.
+    """
+    tic = time.perf_counter()
+    for i in range(n_iter):
+        await pacer.wait()
+        if work and i in work:
+            time.sleep(work[i])
+    return time.perf_counter() - tic
+
+
+def test_loop_keeps_the_rate_without_drift(rate=100, n_iter=50):
+    pacer = DeadlinePacer(rate)
+    elapsed = aio.run(paced_loop(pacer, n_iter))
+    # The deadlines are absolute, the sleep overshoots do not add up
+    assert (n_iter - 1) / rate <= elapsed < (n_iter - 1) / rate + 0.02
+    stats = pacer.stats()
+    # The first wait only starts the clock
+    assert stats['iterations'] == n_iter - 1
+    assert abs(stats['interval_p50'] - 1e3 / rate) < 2
+    assert stats['overruns'] == stats['skipped_deadlines'] == 0
+
+
+def test_overrun_skips_the_missed_deadlines(rate=100):
+    pacer = DeadlinePacer(rate)
+    aio.run(paced_loop(pacer, 10, work={4: 0.035}))
+    assert pacer.overruns == 1
+    assert pacer.skipped_deadlines in (2, 3)
+    # The deadlines left after the overrun are on the original grid, no burst of late iterations
+    assert (pacer.intervals[pacer.count - 3:pacer.count] > 0.5 / rate).all()
+    assert pacer.intervals[4] >= 0.035
+
+
+def test_loop_paced_by_the_frames(rate=100):
+    pacer = DeadlinePacer(rate, sleep=False)
+    elapsed = aio.run(paced_loop(pacer, 5, work={1: 0.032}))
+    # Nothing slept, only the late iteration is counted
+    assert elapsed < 0.05
+    assert pacer.overruns == 1 and pacer.skipped_deadlines == 2
+    np.testing.assert_array_equal(pacer.lateness[:pacer.count], 0)
+
+
+def test_frame_numbers():
+    pacer = DeadlinePacer(100)
+    for frame_number in (10, 11, 11, 14, 13, 15):
+        pacer.frame(frame_number)
+    assert pacer.duplicated_frames == 2
+    assert pacer.skipped_frames == 2
+    assert pacer.last_frame_number == 15
+
+
+def test_report(capsys):
+    pacer = DeadlinePacer(100)
+    assert pacer.report('IK') == {}
+    assert capsys.readouterr().out == 'IK: no iteration\n'
+    aio.run(paced_loop(pacer, 3))
+    stats = pacer.report('IK')
+    assert stats['iterations'] == 2
+    assert capsys.readouterr().out.startswith('IK: 2 iterations at ')
@@ -0,0 +1,345 @@
+import asyncio as aio
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from fake_qtm import FakeQTMServer, data_packet
+from qtm_interface import FrameBuffer, PacketDecoder, QTMInterface
+
+N_MARKERS = 8
+LABELS = [f'marker_{i}' for i in range(N_MARKERS)]
+
+
+@pytest.fixture
+def trial():
+    markers = np.random.default_rng(0).normal(0, 1, (3, N_MARKERS, 50))
+    markers[:, 3, 10:20] = np.nan
+    return markers
+
+
+@pytest.fixture
+def connect_to(monkeypatch):
+    """
+    Point the qtm_rt connection of QTMInterface to the port of a fake server.
+    """
+    import qtm_rt
+
+    connect = qtm_rt.connect
+
+    def patch(server):
+        port = server.server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(qtm_rt, 'connect', lambda host: connect(host, port=port))
+
+    return patch
+
+
+async def start_interface(connect_to, trial, target, residuals=False, **server_kwargs):
+    server = await FakeQTMServer(trial, LABELS, rate=200, port=0, **server_kwargs).start()
+    connect_to(server)
+    interface = await QTMInterface(ip='127.0.0.1', residuals=residuals)
+    await interface.add_marker_set(N_MARKERS, 'markers', rate=200, target_marker_list=target)
+    return server, interface
+
+
+async def stop_interface(server, interface):
+    await interface.stop_streaming()
+    interface.connection.disconnect()
+    await server.stop()
+
+
+def trial_frame(trial, frame_number):
+    return trial[:, :, (frame_number - 1) % trial.shape[2]]
+
+
+def qrt_packet(markers, residuals=None):
+    from qtm_rt.packet import QRTPacket
+
+    # Without the size and type header, as qtm_rt hands the packets over
+    return QRTPacket(data_packet(markers, 3, 30, residuals)[8:])
+
+
+@pytest.mark.parametrize('residuals', [False, True])
+def test_packet_decoder_matches_qtm_rt(trial, residuals):
+    markers = trial[:, :, 10] * 1e3
+    marker_residuals = np.linspace(0.1, 0.8, N_MARKERS)
+    packet = qrt_packet(markers, marker_residuals if residuals else None)
+    decoder = PacketDecoder(N_MARKERS, residuals)
+    assert decoder.component_name == ('3dres' if residuals else '3d')
+    positions = decoder.decode(packet)
+    if residuals:
+        expected = np.array(packet.get_3d_markers_residual()[1])
+        np.testing.assert_allclose(decoder.residuals, expected[:, 3], rtol=1e-6)
+    else:
+        expected = np.array(packet.get_3d_markers()[1])
+        assert np.isnan(decoder.residuals).all()
+    np.testing.assert_allclose(positions, expected[:, :3] * 1e-3, rtol=1e-6)
+    np.testing.assert_allclose(positions, trial[:, :, 10].T, rtol=1e-6)
+    # Occluded markers stay NaN and the next frame is decoded in the same array
+    assert np.isnan(positions[3]).all()
+    assert decoder.decode(qrt_packet(trial[:, :, 0] * 1e3, marker_residuals if residuals else None)) is positions
+    np.testing.assert_allclose(positions, trial[:, :, 0].T, rtol=1e-6)
+
+
+def test_packet_decoder_checks_the_packet(trial):
+    with pytest.raises(ValueError, match='3dres'):
+        PacketDecoder(N_MARKERS, residuals=True).decode(qrt_packet(trial[:, :, 0]))
+    with pytest.raises(RuntimeError, match=f'{N_MARKERS} markers'):
+        PacketDecoder(N_MARKERS + 1).decode(qrt_packet(trial[:, :, 0]))
+
+
+def test_frame_buffer_counters():
+    frame_buffer = FrameBuffer(2, size=3)
+    for frame_number in (1, 2, 2, 5, 6, 4, 7):
+        frame_buffer.push(np.full((3, 2), frame_number), frame_number, frame_number * 10)
+    assert frame_buffer.duplicated_frames == 2
+    assert frame_buffer.missed_frames == 2
+    assert frame_buffer.overwritten_frames == 2
+    positions, frame_numbers, timestamps = frame_buffer.get_new()
+    np.testing.assert_array_equal(frame_numbers, [5, 6, 7])
+    np.testing.assert_array_equal(timestamps, [50, 60, 70])
+    np.testing.assert_array_equal(positions[:, 0, 0], [5, 6, 7])
+    assert frame_buffer.get_new()[1].size == 0
+    positions, frame_number, _ = frame_buffer.get_latest()
+    assert frame_number == 7 and positions[0, 0] == 7
+
+
+def test_stream_missed_and_duplicated_frames(connect_to, trial, drop_every=7, duplicate_every=5):
+    async def run():
+        server, interface = await start_interface(connect_to, trial, LABELS, drop_every=drop_every,
+                                                  duplicate_every=duplicate_every)
+        await interface.start_streaming()
+        frame_numbers = []
+        while len(frame_numbers) < 60:
+            await interface.frame_buffer.wait()
+            positions, numbers, _ = interface.get_new_frames()
+            for pos, frame_number in zip(positions, numbers):
+                np.testing.assert_allclose(pos, trial_frame(trial, frame_number), rtol=1e-6)
+            frame_numbers.extend(numbers)
+        frame_buffer = interface.frame_buffer
+        await stop_interface(server, interface)
+        return np.array(frame_numbers), frame_buffer
+
+    frame_numbers, frame_buffer = aio.run(run())
+    expected = np.arange(frame_numbers[0], frame_numbers[-1] + 1)
+    expected = expected[expected % drop_every != 0]
+    np.testing.assert_array_equal(frame_numbers, expected)
+    assert frame_buffer.missed_frames == np.sum(np.arange(frame_numbers[0] + 1, frame_numbers[-1]) % drop_every == 0)
+    assert frame_buffer.duplicated_frames == np.sum(frame_numbers % duplicate_every == 0)
+    assert frame_buffer.overwritten_frames == 0
+
+
+def test_stream_overwritten_frames(connect_to, trial, buffer_size=4):
+    async def run():
+        server, interface = await start_interface(connect_to, trial, LABELS)
+        await interface.start_streaming(buffer_size=buffer_size)
+        # Nothing is read while the server streams, only the last frames are kept
+        while interface.frame_buffer.write_count < 20:
+            await aio.sleep(0.01)
+        frame_buffer = interface.frame_buffer
+        written = frame_buffer.write_count
+        positions, frame_numbers, _ = interface.get_new_frames()
+        await stop_interface(server, interface)
+        return frame_buffer, written, positions, frame_numbers
+
+    frame_buffer, written, positions, frame_numbers = aio.run(run())
+    assert frame_buffer.overwritten_frames == written - buffer_size
+    assert frame_buffer.missed_frames == 0
+    np.testing.assert_array_equal(np.diff(frame_numbers), 1)
+    assert frame_numbers[-1] == frame_buffer.last_frame_number
+    for pos, frame_number in zip(positions, frame_numbers):
+        np.testing.assert_allclose(pos, trial_frame(trial, frame_number), rtol=1e-6)
+
+
+@pytest.mark.parametrize('residuals', [False, True])
+def test_stream_marker_set_data(connect_to, trial, residuals):
+    target = LABELS[::-1]
+
+    async def run():
+        server, interface = await start_interface(connect_to, trial, target, residuals)
+        await interface.start_streaming()
+        results = []
+        for _ in range(20):
+            markers, _ = await interface.get_marker_set_data()
+            results.append((interface.frame_number, markers[:, :, 0].copy(), interface.marker_sets[0].valid.copy(),
+                            interface.marker_sets[0].residuals.copy()))
+        await stop_interface(server, interface)
+        return results
+
+    for frame_number, markers, valid, marker_residuals in aio.run(run()):
+        expected = trial_frame(trial, frame_number)[:, ::-1]
+        np.testing.assert_allclose(markers, expected, rtol=1e-6)
+        np.testing.assert_array_equal(valid, np.isfinite(expected).all(axis=0))
+        if residuals:
+            np.testing.assert_array_equal(marker_residuals, np.where(valid, 0.5, np.nan))
+        else:
+            assert np.isnan(marker_residuals).all()
+
+
+def marker_set(labels, name='markers', nb_channels=None):
+    nb_channels = nb_channels if nb_channels is not None else len(labels)
+    return SimpleNamespace(name=name, marker_names=labels, nb_channels=nb_channels, label_prefix='')
+
+
+def test_marker_order():
+    target = [LABELS[i] for i in (4, 0, 7, 2)]
+    markers = marker_set(LABELS, nb_channels=len(target))
+    QTMInterface._set_marker_order(markers, target)
+    np.testing.assert_array_equal(markers.indices, [4, 0, 7, 2])
+    frame = np.random.default_rng(0).normal(0, 1, (N_MARKERS, 3))
+    np.take(frame, markers.indices, axis=0, out=markers.ordered_data)
+    np.testing.assert_array_equal(markers.new_data[:, :, 0], frame[[4, 0, 7, 2]].T)
+    # new_data is a writable view of the gathered buffer
+    markers.new_data[0, 0, 0] = 1e3
+    assert markers.ordered_data[0, 0] == 1e3
+
+
+def test_marker_order_without_target():
+    markers = marker_set(LABELS)
+    QTMInterface._set_marker_order(markers)
+    np.testing.assert_array_equal(markers.indices, np.arange(N_MARKERS))
+    assert markers.new_data.shape == (3, N_MARKERS, 1)
+
+
+def test_marker_order_label_prefix():
+    markers = marker_set([f'R_{label}' for label in LABELS[:4]] + [f'L_{label}' for label in LABELS[:4]], nb_channels=4)
+    markers.label_prefix = 'L_'
+    QTMInterface._set_marker_order(markers, LABELS[:4])
+    np.testing.assert_array_equal(markers.indices, [4, 5, 6, 7])
+
+
+def test_marker_order_missing_label():
+    with pytest.raises(ValueError, match='marker_8'):
+        QTMInterface._set_marker_order(marker_set(LABELS), LABELS[:2] + ['marker_8'])
+
+
+def test_marker_order_more_labels_than_markers():
+    markers = marker_set(LABELS)
+    markers.nb_channels = N_MARKERS - 1
+    with pytest.raises(ValueError, match='do not match'):
+        QTMInterface._set_marker_order(markers, LABELS)
+
+
+async def replay_marker_sets(path, markers, prefixes, targets):
+    """
+    ReplayInterface of the markers (3, n_markers, n_frames) labeled with each prefix in turn, with one marker
+    set per prefix and target.
+    """
+    from replay_interface import ReplayInterface
+
+    labels = [prefix + name for prefix in prefixes for name in targets[0]]
+    np.save(path, np.concatenate(markers, axis=1))
+    interface = await ReplayInterface(str(path), marker_names=labels)
+    for prefix, target in zip(prefixes, targets):
+        await interface.add_marker_set(len(target), prefix.strip('_'), target_marker_list=target,
+                                       label_prefix=prefix)
+    return interface
+
+
+def test_marker_sets_served_from_one_frame(tmp_path):
+    rng = np.random.default_rng(0)
+    right, left = rng.normal(0, 1, (3, 4, 5)), rng.normal(0, 1, (3, 4, 5))
+    left[:, 1, 2] = np.nan
+    names = ['a', 'b', 'c', 'd']
+
+    async def run():
+        interface = await replay_marker_sets(tmp_path / 'trial.npy', (right, left), ('R_', 'L_'),
+                                             (names, names[::-1]))
+        np.testing.assert_array_equal(interface.marker_sets[1].indices, [7, 6, 5, 4])
+        frames = []
+        for _ in range(5):
+            markers, _ = await interface.get_marker_set_data()
+            frames.append([(data[:, :, 0].copy(), marker_set.valid.copy())
+                           for data, marker_set in zip(markers, interface.marker_sets)])
+        return frames
+
+    for i, ((right_markers, right_valid), (left_markers, left_valid)) in enumerate(aio.run(run())):
+        np.testing.assert_array_equal(right_markers, right[:, :, i])
+        np.testing.assert_array_equal(left_markers, left[:, ::-1, i])
+        assert right_valid.all()
+        np.testing.assert_array_equal(left_valid, [True, True, i != 2, True])
+
+
+def test_marker_sets_of_different_sizes(tmp_path):
+    rng = np.random.default_rng(0)
+    right, left = rng.normal(0, 1, (3, 4, 5)), rng.normal(0, 1, (3, 4, 5))
+
+    async def run():
+        # The right set takes all its labels, the left set only two of them
+        interface = await replay_marker_sets(tmp_path / 'trial.npy', (right, left), ('R_', 'L_'),
+                                             (['a', 'b', 'c', 'd'], ['d', 'b']))
+        assert interface.nb_qtm_markers == 8
+        assert [marker_set.nb_channels for marker_set in interface.marker_sets] == [4, 2]
+        frames = []
+        for _ in range(5):
+            markers, _ = await interface.get_marker_set_data()
+            frames.append([data[:, :, 0].copy() for data in markers])
+        return frames
+
+    for i, (right_markers, left_markers) in enumerate(aio.run(run())):
+        np.testing.assert_array_equal(right_markers, right[:, :, i])
+        np.testing.assert_array_equal(left_markers, left[:, [3, 1], i])
+
+
+def test_stream_marker_sets_of_different_sizes(connect_to, trial):
+    async def run():
+        server = await FakeQTMServer(trial, LABELS, rate=200, port=0).start()
+        connect_to(server)
+        interface = await QTMInterface(ip='127.0.0.1')
+        await interface.add_marker_set(3, 'first', target_marker_list=LABELS[5:2:-1])
+        await interface.add_marker_set(2, 'second', target_marker_list=[LABELS[0], LABELS[7]])
+        await interface.start_streaming()
+        # Buffered and decoded with every QTM label, whatever the size of the sets
+        assert interface.frame_buffer.positions.shape[2] == interface.decoder.nb_markers == N_MARKERS
+        results = []
+        for _ in range(10):
+            (first, second), _ = await interface.get_marker_set_data()
+            results.append((interface.frame_number, first[:, :, 0].copy(), second[:, :, 0].copy()))
+        await stop_interface(server, interface)
+        return results
+
+    for frame_number, first, second in aio.run(run()):
+        expected = trial_frame(trial, frame_number)
+        np.testing.assert_allclose(first, expected[:, [5, 4, 3]], rtol=1e-6)
+        np.testing.assert_allclose(second, expected[:, [0, 7]], rtol=1e-6)
+
+
+def test_marker_order_subset_of_the_labels():
+    # A set can take some of the QTM labels, but its size is that of its target
+    markers = marker_set(LABELS, nb_channels=3)
+    QTMInterface._set_marker_order(markers, LABELS[5:2:-1])
+    np.testing.assert_array_equal(markers.indices, [5, 4, 3])
+    assert markers.new_data.shape == (3, 3, 1)
+    with pytest.raises(ValueError, match='2 target markers'):
+        QTMInterface._set_marker_order(markers, LABELS[:2])
+    # Without a target, a set takes the labels in order
+    markers.nb_channels = N_MARKERS + 1
+    with pytest.raises(ValueError, match='do not match'):
+        QTMInterface._set_marker_order(markers)
+
+
+def test_kinematics_from_marker_sets(biomod_path, model, trial_markers, tmp_path, n_frames=5):
+    from ik_solvers import LeastSquaresIK
+    from ik_worker import IKWorker
+
+    names = [name.to_string() for name in model.markerNames()]
+    # The second subject is the same pose a meter aside
+    shifted = trial_markers[:, :, :n_frames] + np.array([1, 0, 0])[:, None, None]
+    q_expected = {'R': LeastSquaresIK(model).solve(trial_markers[:, :, :n_frames])[0],
+                  'L': LeastSquaresIK(model).solve(shifted)[0]}
+
+    async def run():
+        interface = await replay_marker_sets(tmp_path / 'trial.npy', (trial_markers[:, :, :n_frames], shifted),
+                                             ('R_', 'L_'), (names, names))
+        with IKWorker(biomod_path, len(names), model.nbQ(), drop_stale=False) as worker:
+            solvers = {'L': worker, 'R': LeastSquaresIK(model)}
+            results = []
+            for _ in range(n_frames):
+                await interface.get_marker_set_data()
+                results.append(await interface.get_kinematics_from_marker_sets(solvers))
+        return results
+
+    for i, kinematics in enumerate(aio.run(run())):
+        # In the order of the solvers, whatever order they are solved in
+        assert list(kinematics) == ['L', 'R']
+        for name, (q, qdot) in kinematics.items():
+            assert q.shape == qdot.shape == (model.nbQ(), 1)
+            np.testing.assert_allclose(q[:, 0], q_expected[name][:, i], atol=1e-6)
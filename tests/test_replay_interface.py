@@ -0,0 +1,99 @@
+import asyncio as aio
+import time
+import numpy as np
+import pytest
+from replay_interface import ReplayInterface, load_trial
+
+LABELS = ['a', 'b', 'c', 'd']
+
+
+@pytest.fixture
+def trial():
+    return np.random.default_rng(0).normal(0, 1, (3, len(LABELS), 10))
+
+
+@pytest.fixture
+def trial_path(trial, tmp_path):
+    path = tmp_path / 'trial.npy'
+    np.save(path, trial)
+    return str(path)
+
+
+async def replay(trial_path, target=None, **kwargs):
+    interface = await ReplayInterface(trial_path, marker_names=LABELS, **kwargs)
+    await interface.add_marker_set(nb_markers=len(LABELS), name='markers', rate=interface.system_rate,
+                                   target_marker_list=target)
+    return interface
+
+
+def test_load_trial_checks_the_marker_names(trial_path):
+    with pytest.raises(ValueError):
+        load_trial(trial_path, LABELS[:2])
+
+
+def test_replay_serves_every_frame_in_the_target_order(trial, trial_path):
+    target = ['c', 'a', 'd', 'b']
+
+    async def run():
+        interface = await replay(trial_path, target)
+        frames = []
+        for _ in range(trial.shape[2]):
+            markers, timestamp = await interface.get_marker_set_data()
+            frames.append((interface.frame_number, timestamp, markers[:, :, 0].copy()))
+        with pytest.raises(EOFError):
+            await interface.get_marker_set_data()
+        return interface, frames
+
+    interface, frames = aio.run(run())
+    assert interface.system_rate == 100
+    for i, (frame_number, timestamp, markers) in enumerate(frames):
+        assert frame_number == i + 1
+        assert timestamp == i * 10000
+        np.testing.assert_array_equal(markers, trial[:, [2, 0, 3, 1], i])
+
+
+def test_replay_keeps_the_given_rate(trial_path):
+    interface = aio.run(replay(trial_path, system_rate=250))
+    assert interface.system_rate == 250
+
+
+def test_replay_loop_keeps_frame_numbers_increasing(trial, trial_path):
+    async def run():
+        interface = await replay(trial_path, loop=True, system_rate=50)
+        frames = []
+        for _ in range(3 * trial.shape[2]):
+            markers, timestamp = await interface.get_marker_set_data()
+            frames.append((interface.frame_number, timestamp, markers[:, :, 0].copy()))
+        interface.rewind()
+        await interface.get_marker_set_data()
+        return interface, frames
+
+    interface, frames = aio.run(run())
+    frame_numbers = np.array([frame[0] for frame in frames])
+    np.testing.assert_array_equal(frame_numbers, np.arange(1, 3 * trial.shape[2] + 1))
+    np.testing.assert_array_equal([frame[1] for frame in frames], (frame_numbers - 1) * 20000)
+    for frame_number, _, markers in frames:
+        np.testing.assert_array_equal(markers, trial[:, :, (frame_number - 1) % trial.shape[2]])
+    assert interface.frame_number == 1
+
+
+def test_replay_realtime_paces_the_frames(trial, trial_path, rate=100):
+    async def run():
+        interface = await replay(trial_path, system_rate=rate, realtime=True)
+        tic = time.perf_counter()
+        for _ in range(trial.shape[2]):
+            await interface.get_marker_set_data()
+        return time.perf_counter() - tic
+
+    assert aio.run(run()) >= (trial.shape[2] - 1) / rate - 1e-3
+
+
+def test_replay_realtime_skips_the_stale_frames(trial, trial_path, rate=100):
+    async def run():
+        interface = await replay(trial_path, system_rate=rate, realtime=True)
+        await interface.get_marker_set_data()
+        time.sleep(5.5 / rate)
+        await interface.get_marker_set_data()
+        return interface.frame_number
+
+    assert aio.run(run()) in (6, 7)
@@ -0,0 +1,111 @@
+import shutil
+import numpy as np
+import pytest
+from reprocess import (MANIFEST_FILE, OUTPUT_FOLDER, find_model, find_participants, find_trials, reprocess,
+                       trial_key, write_columns)
+from session_recorder import SessionRecorder
+
+
+def touch(path, text=''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def test_find_model(tmp_path):
+    models_dir = tmp_path / '_models'
+    assert find_model(tmp_path) is None
+    touch(models_dir / 'subject.bioMod')
+    assert find_model(tmp_path) == models_dir / 'subject.bioMod'
+    # An osim is preferred to a bioMod, and the osim named in Parameters to any other
+    touch(models_dir / 'other.osim')
+    assert find_model(tmp_path) == models_dir / 'other.osim'
+    touch(models_dir / 'second.osim')
+    with pytest.raises(ValueError, match='Several'):
+        find_model(tmp_path)
+    assert find_model(tmp_path, name='second.osim') == models_dir / 'second.osim'
+
+
+def test_find_trials_and_participants(tmp_path):
+    participant = tmp_path / '00IB'
+    touch(participant / '_models' / 'subject.bioMod')
+    touch(participant / '_models' / 'static.c3d')
+    trials = [touch(participant / 'day1' / 'trial_1.c3d'), touch(participant / 'trial_0.c3d'),
+              touch(participant / 'sessions' / 'live' / 'header.json').parent]
+    touch(participant / OUTPUT_FOLDER / 'session' / 'header.json')
+    assert find_trials(participant) == sorted(trials)
+    touch(tmp_path / '01JD' / 'trial.c3d')
+    touch(tmp_path / OUTPUT_FOLDER / '00IB' / MANIFEST_FILE)
+    touch(tmp_path / '02MR' / '_models' / 'subject.osim')
+    assert find_participants(str(tmp_path)) == [participant, tmp_path / '02MR']
+    assert find_participants(str(tmp_path), ['01JD', '02MR']) == [tmp_path / '02MR']
+
+
+def test_trial_key(tmp_path):
+    biomod = touch(tmp_path / 'subject.bioMod', 'version 4\n')
+    trial = touch(tmp_path / 'trial.c3d', 'frames')
+    key = trial_key(trial, str(biomod), {'ik_method': 'least_squares', 'rate': None})
+    assert trial_key(trial, str(biomod), {'rate': None, 'ik_method': 'least_squares'}) == key
+    assert trial_key(trial, str(biomod), {'ik_method': 'kalman', 'rate': None}) != key
+    trial.write_text('other frames')
+    assert trial_key(trial, str(biomod), {'ik_method': 'least_squares', 'rate': None}) != key
+    key = trial_key(trial, str(biomod), {})
+    biomod.write_text('version 4\n// scaled again\n')
+    assert trial_key(trial, str(biomod), {}) != key
+    # A session is keyed on every file of its folder
+    session = touch(tmp_path / 'session' / 'header.json', '{}').parent
+    key = trial_key(session, str(biomod), {})
+    touch(session / 'frames.bin', 'more frames')
+    assert trial_key(session, str(biomod), {}) != key
+
+
+@pytest.mark.parametrize('output_format', ['npz', 'csv'])
+def test_write_columns(tmp_path, output_format):
+    columns = {'frame_number': np.arange(1, 5), 'time': np.arange(4) / 100, 'q_x': np.linspace(-1, 1, 4)}
+    path = tmp_path / f'trial.{output_format}'
+    write_columns(path, columns, output_format)
+    assert [file.name for file in tmp_path.iterdir()] == [path.name]
+    if output_format == 'npz':
+        data = np.load(path)
+    else:
+        data = np.genfromtxt(path, delimiter=',', names=True)
+    for name, values in columns.items():
+        np.testing.assert_allclose(data[name], values)
+
+
+def record_session(path, markers, marker_names, rate=100):
+    with SessionRecorder(str(path), markers.shape[1], 15, rate=rate, marker_names=marker_names) as session:
+        for i in range(markers.shape[2]):
+            session.record(i + 1, i * 10000, markers[:, :, i], np.zeros(15), np.zeros(15))
+
+
+def test_reprocess_resumes_and_follows_the_model(biomod_path, model, trial_q, trial_markers, tmp_path):
+    names = [name.to_string() for name in model.markerNames()]
+    participant = tmp_path / '00IB'
+    biomod = participant / '_models' / 'subject.bioMod'
+    biomod.parent.mkdir(parents=True)
+    shutil.copy(biomod_path, biomod)
+    record_session(participant / 'session_1', trial_markers, names)
+    record_session(participant / 'session_2', trial_markers[:, :, :20], names)
+    # Markers of another model, the trial fails without stopping the participant
+    record_session(participant / 'session_3', trial_markers[:, :, :20], names[::-1])
+
+    stats, = reprocess(str(tmp_path), n_workers=1)
+    assert (stats['solved'], stats['skipped'], stats['failed'], stats['frames']) == (2, 0, 1, 80)
+    output_dir = tmp_path / OUTPUT_FOLDER / '00IB'
+    data = np.load(output_dir / 'session_1.npz')
+    np.testing.assert_array_equal(data['frame_number'], np.arange(1, 61))
+    q = np.array([data[f'q_{dof.to_string()}'] for dof in model.nameDof()])
+    np.testing.assert_allclose(q[11:15], trial_q[11:15], atol=np.deg2rad(2))
+    np.testing.assert_array_equal(data['gh_plane'], q[11])
+
+    # Started again, only what is missing is solved
+    stats, = reprocess(str(tmp_path), n_workers=1)
+    assert (stats['solved'], stats['skipped'], stats['failed']) == (0, 2, 1)
+    (output_dir / 'session_2.npz').unlink()
+    stats, = reprocess(str(tmp_path), n_workers=1)
+    assert (stats['solved'], stats['skipped']) == (1, 1)
+    # A new model reprocesses everything of the participant
+    biomod.write_text(biomod.read_text() + '\n// scaled again\n')
+    stats, = reprocess(str(tmp_path), n_workers=1)
+    assert (stats['solved'], stats['skipped']) == (2, 0)
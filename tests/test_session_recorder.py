@@ -0,0 +1,53 @@
+import numpy as np
+from session_recorder import FRAMES_FILE, SessionRecorder, open_session
+
+
+def record_frames(recorder, frame_numbers, nb_markers=3, nb_q=2):
+    for frame_number in frame_numbers:
+        recorder.record(frame_number, frame_number * 10, np.full((3, nb_markers), frame_number / 100),
+                        np.full(nb_q, frame_number), -np.full(nb_q, frame_number), ellipse=(1, 2, 3, 4),
+                        ik_frame_number=frame_number - 1)
+
+
+def test_session_round_trip_and_growth(tmp_path, capacity=8):
+    with SessionRecorder(str(tmp_path / 'session'), nb_markers=3, nb_q=2, marker_names=['a', 'b', 'c'],
+                         capacity=capacity, staging_size=32, flush_interval=0.01) as recorder:
+        record_frames(recorder, range(10))
+        recorder.set_reference(np.array([0.5, -0.5]))
+        record_frames(recorder, range(10, 25))
+    frames, header = open_session(str(tmp_path / 'session'))
+    # Grown past the preallocated capacity, then trimmed to the recorded frames
+    assert header['n_frames'] == 25 and header['dropped_frames'] == 0
+    assert (tmp_path / 'session' / FRAMES_FILE).stat().st_size == 25 * frames.dtype.itemsize
+    assert header['marker_names'] == ['a', 'b', 'c']
+    np.testing.assert_array_equal(frames['frame_number'], np.arange(25))
+    np.testing.assert_array_equal(frames['timestamp'], np.arange(25) * 10)
+    np.testing.assert_array_equal(frames['ik_frame_number'], np.arange(25) - 1)
+    np.testing.assert_allclose(frames['markers'][:, 1, 2], np.arange(25) / 100, rtol=1e-6)
+    np.testing.assert_array_equal(frames['q'][:, 1], np.arange(25))
+    np.testing.assert_array_equal(frames['qdot'][:, 0], -np.arange(25))
+    np.testing.assert_array_equal(frames['ellipse'], np.tile([1, 2, 3, 4], (25, 1)))
+    # The reference is stored with the frames recorded after it
+    np.testing.assert_array_equal(frames['q_ref'][:10], 0)
+    np.testing.assert_array_equal(frames['q_ref'][10:], np.tile([0.5, -0.5], (15, 1)))
+    assert header['references'] == [{'from_frame': 10, 'q_ref': [0.5, -0.5]}]
+
+
+def test_frames_are_dropped_when_the_writer_is_behind(tmp_path):
+    recorder = SessionRecorder(str(tmp_path), nb_markers=3, nb_q=2, capacity=100, staging_size=4,
+                               flush_interval=0.01)
+    # The writer waits on the header lock after its first batch
+    with recorder._header_lock:
+        record_frames(recorder, range(20))
+        assert recorder.dropped_frames > 0
+    recorder.close()
+    frames, header = open_session(str(tmp_path))
+    assert header['n_frames'] + header['dropped_frames'] == 20
+    assert (np.diff(frames['frame_number']) > 0).all()
+
+
+def test_empty_session(tmp_path):
+    SessionRecorder(str(tmp_path), nb_markers=3, nb_q=2, capacity=10).close()
+    frames, header = open_session(str(tmp_path))
+    assert frames.size == 0 and header['n_frames'] == 0
+    assert frames.dtype.names[0] == 'frame_number'